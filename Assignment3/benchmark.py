@@ -0,0 +1,109 @@
+import argparse
+import sys
+import time
+
+import interpreter
+
+ADD = r"(\m.\n.\f.\x.m f (n f x))"
+MUL = r"(\m.\n.\f.m (n f))"
+EXP = r"(\m.\n.n m)"
+PRED = r"(\n.\f.\x.n (\g.\h.h (g f)) (\u.x) (\u.u))"
+
+# the Church numeral of n: \f.\x.f (f ... (f x))
+def numeral(n):
+    return r"(\f.\x." + "f (" * n + "x" + ")" * n + ")"
+
+# the number of a Church numeral in normal form, or None
+def numeral_value(tree):
+    if tree[0] != 'lam' or tree[2][0] != 'lam':
+        return None
+    f, x, body = tree[1], tree[2][1], tree[2][2]
+    count = 0
+    while body[0] == 'app' and body[1] == ('var', f):
+        count += 1
+        body = body[2]
+    return count if body == ('var', x) else None
+
+# normal order reduction by substitution: evaluate (the weak head normal
+# form of the subst engine), then the same under lambdas and in arguments
+def normalize_by_substitution(tree):
+    tree = interpreter.evaluate(tree)
+    if tree[0] == 'lam':
+        return ('lam', tree[1], normalize_by_substitution(tree[2]))
+    elif tree[0] == 'app':
+        return ('app', normalize_by_substitution(tree[1]), normalize_by_substitution(tree[2]))
+    return tree
+
+# substitute as it was before it checked for capture: every lambda it
+# passes through is renamed, with a second substitution
+def substitute_renaming(tree, name, replacement):
+    if tree[0] == 'var':
+        return replacement if tree[1] == name else tree
+    elif tree[0] == 'lam':
+        if tree[1] == name:
+            return tree
+        fresh_name = interpreter.name_generator.generate()
+        return ('lam', fresh_name, substitute_renaming(substitute_renaming(tree[2], tree[1], ('var', fresh_name)),
+                                                       name, replacement))
+    return ('app', substitute_renaming(tree[1], name, replacement), substitute_renaming(tree[2], name, replacement))
+
+# normalize_by_substitution with substitute_renaming
+def normalize_by_renaming(tree):
+    substitute = interpreter.substitute
+    interpreter.substitute = substitute_renaming
+    try:
+        return normalize_by_substitution(tree)
+    finally:
+        interpreter.substitute = substitute
+
+# time the best of a few runs of function()
+def best_time(function, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# (name, source, expected number) of the Church arithmetic programs
+def programs(scale):
+    return [
+        (f"add {100 * scale} {100 * scale}", f"{ADD} {numeral(100 * scale)} {numeral(100 * scale)}", 200 * scale),
+        (f"mul {10 * scale} {10 * scale}", f"{MUL} {numeral(10 * scale)} {numeral(10 * scale)}", 100 * scale * scale),
+        (f"exp 2 {5 + scale}", f"{EXP} {numeral(2)} {numeral(5 + scale)}", 2 ** (5 + scale)),
+        (f"pred {25 * scale}", f"{PRED} {numeral(25 * scale)}", 25 * scale - 1),
+    ]
+
+ENGINES = {'renaming': normalize_by_renaming, 'subst': normalize_by_substitution, 'debruijn': interpreter.normalize}
+
+# normalizing Church arithmetic with de Bruijn indices against normal order
+# reduction by substitution, with and without renaming every lambda. all
+# must give the expected numeral. prints the times and the fresh names made
+def bench_church(scale=4, repeat=3):
+    print(f"{'program':<14}" + "".join(f"{name:>11}" for name in ENGINES) + f"{'speedup':>9}{'renamed':>9}")
+    for name, source, expected in programs(scale):
+        ast = interpreter.LambdaCalculusTransformer().transform(interpreter.parser.parse(source))
+        times = {}
+        for engine, normalize in ENGINES.items():
+            before = interpreter.name_generator.counter
+            result = normalize(ast)
+            if engine == 'renaming':
+                renamed = interpreter.name_generator.counter - before
+            if engine == 'debruijn':
+                result = interpreter.from_debruijn(result)
+            if numeral_value(result) != expected:
+                raise AssertionError(f"{name}, {engine}: {interpreter.linearize(result)} is not {expected}")
+            times[engine] = best_time(lambda: normalize(ast), repeat)
+        print(f"{name:<14}" + "".join(f"{seconds * 1000:>9.1f}ms" for seconds in times.values()) +
+              f"{times['renaming'] / times['debruijn']:>8.1f}x{renamed:>9}")
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--scale', type=int, default=4, help="multiplies the sizes of the numerals")
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+    sys.setrecursionlimit(100000) # substitution recurses on the depth of the numerals
+    bench_church(args.scale, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,21 @@
+import argparse
+import os
 import sys
 from lark import Lark, Transformer, Tree
 import lark
 
-print(f"Python version: {sys.version}")
-print(f"Lark version: {lark.__version__}")
-
-#  run/execute/interpret source code
-def interpret(source_code):
-    print("SOURCE: ")
-    print(source_code)
-    print()
+#  run/execute/interpret source code. engine is 'subst' (evaluate) or
+#  'debruijn' (normalize, to full normal form)
+def interpret(source_code, engine='subst'):
     cst = parser.parse(source_code)
-    print(cst)
-    print()
     ast = LambdaCalculusTransformer().transform(cst)
-    print(ast)
-    result_ast = evaluate(ast)
+    result_ast = ENGINES[engine](ast)
     result = linearize(result_ast)
     return result
 
 # convert concrete syntax to CST
-parser = Lark(open("grammar.lark").read(), parser='lalr')
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "grammar.lark")) as grammar:
+    parser = Lark(grammar.read(), parser='lalr')
 
 # convert CST to AST
 class LambdaCalculusTransformer(Transformer):
@@ -80,6 +75,17 @@ class NameGenerator:
 
 name_generator = NameGenerator()
 
+# the names that occur free in tree
+def free_vars(tree):
+    if tree[0] == 'var':
+        return {tree[1]}
+    elif tree[0] == 'lam':
+        return free_vars(tree[2]) - {tree[1]}
+    elif tree[0] == 'app':
+        return free_vars(tree[1]) | free_vars(tree[2])
+    else:
+        raise Exception('Unknown tree', tree)
+
 # for beta reduction (capture-avoiding substitution)
 def substitute(tree, name, replacement):
     # tree [replacement/name] = tree with all instances of 'name' replaced by 'replacement'
@@ -89,30 +95,204 @@ def substitute(tree, name, replacement):
         else:
             return tree # x [r/n] --> x
     elif tree[0] == 'lam':
-        if tree[1] == name:
-            return tree # \n.e [r/n] --> \n.e
-        else:
+        if tree[1] == name or name not in free_vars(tree[2]):
+            return tree # \n.e [r/n] --> \n.e, and nothing to replace in e
+        elif tree[1] in free_vars(replacement):
             fresh_name = name_generator.generate()
             return ('lam', fresh_name, substitute(substitute(tree[2], tree[1], ('var', fresh_name)), name, replacement))
-            # \x.e [r/n] --> (\fresh.(e[fresh/x])) [r/n]
+            # \x.e [r/n] --> (\fresh.(e[fresh/x])) [r/n], only if x is free in r
+        else:
+            return ('lam', tree[1], substitute(tree[2], name, replacement))
     elif tree[0] == 'app':
         return ('app', substitute(tree[1], name, replacement), substitute(tree[2], name, replacement))
     else:
         raise Exception('Unknown tree', tree)
 
-def linearize(ast):
-    if ast[0] == 'var':
-        return ast[1]
-    elif ast[0] == 'lam':
-        return "(" + "\\" + ast[1] + "." + linearize(ast[2]) + ")"
-    elif ast[0] == 'app':
-        return "(" + linearize(ast[1]) + " " + linearize(ast[2]) + ")"
+# normalization with de Bruijn indices. the AST is converted once to
+#   ('abs', name, body)   a lambda, the name is only kept for linearize
+#   ('apply', e1, e2)
+#   ('bound', i)          the variable of the i-th enclosing 'abs', 0 is the innermost
+#   ('free', name)
+# and reduced in normal order: to weak head normal form with environments,
+# where arguments are evaluated when needed and at most once, then under
+# the lambdas and in the arguments of the result. nothing is renamed or
+# copied while reducing, linearize chooses the names at the end
+def normalize(tree):
+    return read_back(whnf(to_debruijn(tree, []), None))
+
+# scope holds the names of the enclosing lambdas, innermost last
+def to_debruijn(tree, scope):
+    if tree[0] == 'var':
+        for i, name in enumerate(reversed(scope)):
+            if name == tree[1]:
+                return ('bound', i)
+        return ('free', tree[1])
+    elif tree[0] == 'lam':
+        scope.append(tree[1])
+        body = to_debruijn(tree[2], scope)
+        scope.pop()
+        return ('abs', tree[1], body)
+    elif tree[0] == 'app':
+        return ('apply', to_debruijn(tree[1], scope), to_debruijn(tree[2], scope))
     else:
-        raise Exception('Unknown AST', ast)
+        raise Exception('Unknown tree', tree)
+
+# an argument: a term and its environment until it is needed, then its value
+class Thunk:
+    __slots__ = ('term', 'env', 'value')
+
+    def __init__(self, term, env, value=None):
+        self.term = term
+        self.env = env
+        self.value = value
+
+def force(thunk):
+    if thunk.value is None:
+        thunk.value = whnf(thunk.term, thunk.env)
+        thunk.term = thunk.env = None
+    return thunk.value
+
+# an environment is None or (thunk, enclosing environment)
+def lookup(env, index):
+    for _ in range(index):
+        env = env[1]
+    return env[0]
+
+def delay(term, env):
+    if term[0] == 'bound':
+        return lookup(env, term[1]) # share the thunk instead of wrapping it
+    return Thunk(term, env)
+
+# the value of term in env, either ('closure', body, env, name) or
+# ('neutral', head, args): a variable applied to thunks. head is the level
+# (the number of lambdas outside it) of a bound variable or a free name
+def whnf(term, env):
+    args = [] # pending arguments, the next one last
+    while True:
+        if term[0] == 'apply':
+            args.append(delay(term[2], env))
+            term = term[1]
+        elif term[0] == 'abs':
+            if not args:
+                return ('closure', term[2], env, term[1])
+            env = (args.pop(), env)
+            term = term[2]
+        elif term[0] == 'bound':
+            thunk = lookup(env, term[1])
+            value = thunk.value if thunk.value is not None else force(thunk)
+            if not args:
+                return value
+            if value[0] == 'neutral':
+                return ('neutral', value[1], value[2] + tuple(reversed(args)))
+            term, env = value[1], (args.pop(), value[2])
+        else:
+            return ('neutral', term[1], tuple(reversed(args)))
+
+# the normal form of value, as a de Bruijn term. iterative, so long
+# normal forms (large numerals) don't hit the recursion limit
+def read_back(value):
+    results = []
+    stack = [(value, 0)]
+    while stack:
+        item, level = stack.pop()
+        if isinstance(item, Thunk):
+            item = item.value if item.value is not None else force(item)
+        if item[0] == 'closure':
+            variable = Thunk(None, None, ('neutral', level, ()))
+            stack.append((('abs', item[3]), level))
+            stack.append((whnf(item[1], (variable, item[2])), level + 1))
+        elif item[0] == 'neutral':
+            head = ('bound', level - item[1] - 1) if isinstance(item[1], int) else ('free', item[1])
+            if not item[2]:
+                results.append(head)
+                continue
+            stack.append((('apply', head, len(item[2])), level))
+            for arg in reversed(item[2]):
+                stack.append((arg, level))
+        elif item[0] == 'abs':
+            results.append(('abs', item[1], results.pop()))
+        else:
+            term, args = item[1], results[-item[2]:]
+            del results[-item[2]:]
+            for arg in args:
+                term = ('apply', term, arg)
+            results.append(term)
+    return results[0]
+
+# the de Bruijn term as an AST. a lambda keeps its name unless an enclosing
+# lambda or a free variable has it, then it gets a number: x, x1, x2, ...
+def from_debruijn(term):
+    free = set()
+    stack = [term]
+    while stack:
+        node = stack.pop()
+        if node[0] == 'free':
+            free.add(node[1])
+        elif node[0] == 'abs':
+            stack.append(node[2])
+        elif node[0] == 'apply':
+            stack.extend(node[1:])
+    results = []
+    stack = [(term, ())]
+    while stack:
+        item, names = stack.pop()
+        if item[0] == 'bound':
+            results.append(('var', names[-1 - item[1]]))
+        elif item[0] == 'free':
+            results.append(('var', item[1]))
+        elif item[0] == 'abs':
+            name, number = item[1], 0
+            while name in free or name in names:
+                number += 1
+                name = item[1] + str(number)
+            stack.append((('lam', name), names))
+            stack.append((item[2], names + (name,)))
+        elif item[0] == 'apply':
+            stack.append((('app',), names))
+            stack.append((item[2], names))
+            stack.append((item[1], names))
+        elif item[0] == 'lam':
+            results.append(('lam', item[1], results.pop()))
+        else:
+            e2 = results.pop()
+            results.append(('app', results.pop(), e2))
+    return results[0]
+
+ENGINES = {'debruijn': normalize, 'subst': evaluate}
+
+# iterative, so long terms don't hit the recursion limit. de Bruijn terms
+# (from normalize) get their names here
+def linearize(ast):
+    if ast[0] in ('abs', 'apply', 'bound', 'free'):
+        ast = from_debruijn(ast)
+    out = []
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if isinstance(ast, str):
+            out.append(ast)
+        elif ast[0] == 'var':
+            out.append(ast[1])
+        elif ast[0] == 'lam':
+            stack.extend([")", ast[2], "(" + "\\" + ast[1] + "."])
+        elif ast[0] == 'app':
+            stack.extend([")", ast[2], " ", ast[1], "("])
+        else:
+            raise Exception('Unknown AST', ast)
+    return "".join(out)
 
 def main():
-    input = sys.argv[1]
-    result = interpret(input)
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('input', help="a lambda term")
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='subst',
+                            help="subst evaluates by substitution, debruijn normalizes (also under lambdas and "
+                                 "in arguments) with de Bruijn indices")
+    arg_parser.add_argument('--verbose', action='store_true', help="print the Python and Lark versions")
+    args = arg_parser.parse_args()
+    if args.verbose:
+        print(f"Python version: {sys.version}")
+        print(f"Lark version: {lark.__version__}")
+    result = interpret(args.input, args.engine)
     print(f"\033[95m{result}\033[0m")
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import unittest
+import benchmark
+import interpreter
+from interpreter import interpret, normalize, from_debruijn, linearize, parser, LambdaCalculusTransformer
+
+def parse(source_code):
+    return LambdaCalculusTransformer().transform(parser.parse(source_code))
+
+# the term without its names: two terms are alpha-equivalent if these are equal
+def nameless(tree):
+    term = interpreter.to_debruijn(tree, [])
+    stack = [term]
+    results = []
+    while stack:
+        item = stack.pop()
+        if item == 'abs':
+            results.append(('abs', results.pop()))
+        elif item == 'apply':
+            e2 = results.pop()
+            results.append(('apply', results.pop(), e2))
+        elif item[0] == 'abs':
+            stack.extend(['abs', item[2]])
+        elif item[0] == 'apply':
+            stack.extend(['apply', item[2], item[1]])
+        else:
+            results.append(item)
+    return results[0]
+
+class TestInterpreter(unittest.TestCase):
+    def test_default_engine(self):
+        # the default engine evaluates by substitution, not under lambdas or in arguments
+        tests = [
+            (r"\x.(\y.y) x", r"(\x.((\y.y) x))"),
+            (r"a ((\x.x) b)", r"(a ((\x.x) b))"),
+            (r"\x. (\y. y y)(\y. y y)", r"(\x.((\y.(y y)) (\y.(y y))))"),
+            (r"(\x.x x) (\y.y)", r"(\y.y)"),
+        ]
+        for input_expr, expected in tests:
+            with self.subTest(input=input_expr):
+                self.assertEqual(interpret(input_expr), expected)
+                self.assertEqual(interpret(input_expr, engine='subst'), expected)
+
+    def test_debruijn_engine(self):
+        # normal forms, reduced under lambdas and in arguments
+        tests = [
+            (r"\x.(\y.y) x", r"(\x.x)"),
+            (r"a ((\x.x) b)", r"(a b)"),
+            (r"(\x.\y.x) a", r"(\y.a)"),
+            (r"(\x.x x) (\y.y)", r"(\y.y)"),
+            # arguments that are never used are never evaluated
+            (r"(\x.\y.y) ((\x.x x) (\x.x x))", r"(\y.y)"),
+            # binders are renamed when they would capture, whether free or bound outside
+            (r"(\x.\y.x) y", r"(\y1.y)"),
+            (r"(\x.\y.x y) y", r"(\y1.(y y1))"),
+            (r"\y.(\x.\y.x y) y", r"(\y.(\y1.(y y1)))"),
+            (r"(\f.\x.f (f x)) (\f.\x.f (f x))", r"(\x.(\x1.(x (x (x (x x1))))))"),
+        ]
+        for input_expr, expected in tests:
+            with self.subTest(input=input_expr):
+                self.assertEqual(interpret(input_expr, engine='debruijn'), expected)
+
+    def test_debruijn_church_arithmetic(self):
+        for name, source, expected in benchmark.programs(1):
+            with self.subTest(program=name):
+                result = from_debruijn(normalize(parse(source)))
+                self.assertEqual(benchmark.numeral_value(result), expected)
+        # reading back and linearizing a long normal form doesn't hit the recursion limit
+        result = normalize(parse(f"{benchmark.MUL} {benchmark.numeral(50)} {benchmark.numeral(50)}"))
+        self.assertEqual(benchmark.numeral_value(from_debruijn(result)), 2500)
+        self.assertEqual(linearize(result), r"(\f.(\x." + "(f " * 2500 + "x" + ")" * 2500 + "))")
+
+    def test_debruijn_matches_substitution(self):
+        # the same normal forms as normal order reduction by substitution, up to the names
+        tests = [
+            r"(\x.\y.x) y",
+            r"(\x.\y.\z.x z) (\w. w)",
+            r"(\x.\y.x y) (\z.y z)",
+            r"(\f.\x.f (f x)) (\g.\y.g (g y))",
+            f"{benchmark.PRED} {benchmark.numeral(5)}",
+            f"{benchmark.MUL} {benchmark.numeral(3)} {benchmark.numeral(4)}",
+        ]
+        for input_expr in tests:
+            with self.subTest(input=input_expr):
+                ast = parse(input_expr)
+                self.assertEqual(nameless(from_debruijn(normalize(ast))),
+                                 nameless(benchmark.normalize_by_substitution(ast)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# precompiled programs: .lcc files hold the AST of a .lc file (after the
+# optimizer, unless it was off), so running them skips parsing.
+# layout, little-endian:
+#   header     magic b'LCC\0', format version (u16), AST version (u16, the
+#              AST_CACHE_VERSION of interpreter.py), flags (u32), sha256 of
+#              the source (32 bytes), number of nodes (u32), number of pool
+#              entries (u32), root reference (i32), length of the source
+#              path (u32) and the path (utf-8, relative to the .lcc file)
+#   node table 4 x i32 per node: opcode (nodes.OPCODES) and up to three
+#              field references. a child node is always before its parent
+#   pool       per entry a type byte, then b'f' a double, b'b' one byte,
+#              b's' the length (u32) and the utf-8 bytes
+# a reference >= 0 is a node index, a reference < 0 is -1 - a pool index.
+# the file is read through mmap: the node table is used in place, as a
+# memoryview of the mapping.
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import interpreter
+from nodes import ARITY, OPCODES, TAGS
+
+MAGIC = b'LCC\0'
+FORMAT_VERSION = 1
+OPTIMIZED = 1  # flag: the optimizer ran before the AST was written
+HEADER = struct.Struct('<4sHHI32sIIiI')
+NODE = struct.Struct('<4i')
+DOUBLE = struct.Struct('<d')
+LENGTH = struct.Struct('<I')
+
+# raised when an artifact can't be used: damaged, written by another format
+# or AST version, or older than its source
+class StaleArtifact(Exception):
+    pass
+
+def source_hash(source_code):
+    return hashlib.sha256(source_code.encode()).digest()
+
+def artifact_path(source_path):
+    return os.path.splitext(source_path)[0] + '.lcc'
+
+# parse (and optimize, while interpreter.optimizing) the .lc file at
+# source_path and write its artifact next to it, or to path
+def compile_file(source_path, path=None):
+    path = path or artifact_path(source_path)
+    with open(source_path) as file:
+        source_code = file.read()
+    ast = interpreter.load(source_code)
+    relative = os.path.relpath(os.path.abspath(source_path), os.path.dirname(os.path.abspath(path)))
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as file:
+        write_artifact(file, ast, source_code, relative, interpreter.optimizing)
+    os.replace(temporary, path)
+    return path
+
+def write_artifact(file, ast, source_code, source_path, optimized):
+    table = bytearray()
+    pool = []
+    pool_index = {}
+    results = []  # references of the fields built so far
+    stack = [(ast, False)]
+    while stack:
+        tree, built = stack.pop()
+        if built:
+            fields = [results.pop() if not isinstance(field, str) else constant(field, pool, pool_index)
+                      for field in reversed(tree[1:])]
+            fields.reverse()
+            table += NODE.pack(OPCODES[tree[0]], *fields, *[0] * (3 - len(fields)))
+            results.append(len(table) // NODE.size - 1)
+        elif isinstance(tree, tuple):
+            if tree[0] == 'app' and len(tree) == 2:
+                stack.append((tree[1], False))
+                continue
+            stack.append((tree, True))
+            stack.extend((field, False) for field in reversed(tree[1:]) if not isinstance(field, str))
+        else:
+            results.append(constant(tree, pool, pool_index))
+    path_bytes = source_path.encode()
+    file.write(HEADER.pack(MAGIC, FORMAT_VERSION, interpreter.AST_CACHE_VERSION, OPTIMIZED if optimized else 0,
+                           source_hash(source_code), len(table) // NODE.size, len(pool), results[0],
+                           len(path_bytes)))
+    file.write(path_bytes)
+    file.write(table)
+    for value in pool:
+        if isinstance(value, str):
+            data = value.encode()
+            file.write(b's' + LENGTH.pack(len(data)) + data)
+        elif isinstance(value, bool):
+            file.write(b'b' + bytes([value]))
+        else:
+            file.write(b'f' + DOUBLE.pack(value))
+
+# pool reference of a name or number, added to the pool if it is new
+def constant(value, pool, pool_index):
+    key = (type(value), value)
+    if key not in pool_index:
+        pool_index[key] = len(pool)
+        pool.append(value)
+    return -1 - pool_index[key]
+
+# (header fields, source path) of the artifact in data, StaleArtifact if it
+# isn't one this version can read
+def read_header(data):
+    if len(data) < HEADER.size:
+        raise StaleArtifact("truncated artifact")
+    magic, version, ast_version, flags, digest, node_count, pool_count, root, path_length = \
+        HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise StaleArtifact("not a .lcc artifact")
+    source_path = bytes(data[HEADER.size:HEADER.size + path_length]).decode()
+    if version != FORMAT_VERSION or ast_version != interpreter.AST_CACHE_VERSION:
+        raise StaleArtifact(f"artifact version {version}.{ast_version}, "
+                            f"expected {FORMAT_VERSION}.{interpreter.AST_CACHE_VERSION}")
+    return (flags, digest, node_count, pool_count, root, HEADER.size + path_length), source_path
+
+# the AST in data, a buffer holding an artifact
+def read_ast(data, header):
+    _, _, node_count, pool_count, root, offset = header
+    table_end = offset + node_count * NODE.size
+    if len(data) < table_end:
+        raise StaleArtifact("truncated artifact")
+    pool = []
+    position = table_end
+    try:
+        for _ in range(pool_count):
+            kind = data[position:position + 1]
+            position += 1
+            if kind == b'f':
+                pool.append(DOUBLE.unpack_from(data, position)[0])
+                position += DOUBLE.size
+            elif kind == b'b':
+                pool.append(bool(data[position]))
+                position += 1
+            elif kind == b's':
+                length, = LENGTH.unpack_from(data, position)
+                position += LENGTH.size
+                pool.append(bytes(data[position:position + length]).decode())
+                position += length
+            else:
+                raise StaleArtifact("damaged constant pool")
+    except (struct.error, IndexError):
+        raise StaleArtifact("truncated artifact") from None
+    built = []
+    with memoryview(data) as view, view[offset:table_end] as raw, raw.cast('i') as table:
+        if sys.byteorder != 'little':
+            table = array('i', bytes(raw))
+            table.byteswap()
+        for index in range(0, len(table), 4):
+            op = table[index]
+            built.append((TAGS[op], *[built[reference] if reference >= 0 else pool[-1 - reference]
+                                      for reference in table[index + 1:index + 1 + ARITY[op]]]))
+    return built[root] if root >= 0 else pool[-1 - root]
+
+# the AST to evaluate for the artifact at path. if the artifact can't be
+# used, or its source has changed since it was written, the source is
+# parsed instead. an artifact whose source is gone is used as it is
+def load_artifact(path):
+    source_path = os.path.splitext(path)[0] + '.lc'
+    try:
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header, relative = read_header(data)
+            source_path = os.path.join(os.path.dirname(os.path.abspath(path)), relative)
+            if os.path.exists(source_path):
+                with open(source_path) as source:
+                    if source_hash(source.read()) != header[1]:
+                        raise StaleArtifact(f"{source_path} changed since {path} was written")
+            ast = read_ast(data, header)
+    except (StaleArtifact, ValueError, IndexError, OSError) as e:
+        if not os.path.exists(source_path):
+            raise StaleArtifact(f"can't use {path} ({e}) and its source {source_path} is missing") from None
+        with open(source_path) as source:
+            return interpreter.load(source.read(), use_cache=True)
+    if interpreter.optimizing and not header[0] & OPTIMIZED:
+        import optimizer
+        ast = optimizer.optimize(ast)
+    return ast
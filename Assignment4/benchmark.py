@@ -0,0 +1,404 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import interpreter
+import nodes
+
+# time the best of a few runs of function()
+def best_time(function, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# bytes used by the nodes of an AST, without the shared names and numbers
+def ast_size(tree):
+    size = 0
+    count = 0
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if isinstance(tree, tuple):
+            fields = tree[1:]
+        elif isinstance(tree, nodes.Node):
+            fields = tree.fields()
+        else:
+            continue
+        size += sys.getsizeof(tree)
+        count += 1
+        stack.extend(fields)
+    return size, count
+
+# tuple AST against the slotted Node AST of nodes.py
+def bench_nodes(size=300):
+    source = "\\x. " + " + ".join("(if x <= %d then hd (tl (x:%d:#)) else -x)" % (i, i) for i in range(size))
+    ast = interpreter.parse(source)
+    node_ast = nodes.from_tuple(ast)
+    tuple_bytes, count = ast_size(ast)
+    node_bytes, _ = ast_size(node_ast)
+    print(f"memory per node ({count} nodes): tuples {tuple_bytes / count:.1f} B, Node {node_bytes / count:.1f} B")
+
+    # the substitution engines, on a program that is mostly dispatch on late tags
+    program = nodes.from_tuple(interpreter.parse(
+        "let f = \\x. tl (hd (x:#) : x : #) in hd (f 1) + hd (f 2) + hd (f 3)"))
+    tuple_program = nodes.to_tuple(program)
+    tuple_time = best_time(lambda: [interpreter.evaluate(tuple_program) for _ in range(2000)])
+    node_time = best_time(lambda: [nodes.evaluate(program) for _ in range(2000)])
+    print(f"evaluate x2000: tuples {tuple_time * 1000:.1f} ms, Node {node_time * 1000:.1f} ms")
+
+    result = interpreter.evaluate(tuple_program)
+    node_result = nodes.evaluate(program)
+    tuple_time = best_time(lambda: [interpreter.linearize(ast) for _ in range(20)])
+    node_time = best_time(lambda: [nodes.linearize(node_ast) for _ in range(20)])
+    print(f"linearize x20: tuples {tuple_time * 1000:.1f} ms, Node {node_time * 1000:.1f} ms")
+    assert interpreter.linearize(result) == nodes.linearize(node_result)
+
+# arithmetic and recursion heavy programs on the different engines.
+# subst doesn't unfold letrec, so it only runs the programs without it
+ENGINE_PROGRAMS = {
+    'arithmetic': "let f = \\x. (x * x + 3 * x - 1) * (x - 2) + x * 4 in "
+                  + " + ".join("f %d" % i for i in range(200)),
+    'factorial': "letrec fact = \\n. if n == 0 then 1 else n * fact (n-1) in fact 300",
+    'sum': "letrec sum = \\n. \\acc. if n == 0 then acc else sum (n-1) (acc+n) in sum 300 0",
+    # beta reductions whose bodies are lambdas and whose arguments are lambdas
+    'applications': "let twice = \\f. \\x. f (f x) in let compose = \\f. \\g. \\x. f (g x) in "
+                    + " + ".join("twice (compose (\\y. y + 1) (\\y. y * 2)) %d" % i for i in range(100)),
+    'self-application': "let self = \\s. s s in "
+                        + " + ".join("self (\\f. \\n. n * %d) %d" % (i, i) for i in range(200)),
+}
+
+def bench_engines(engines=('subst', 'env', 'stack', 'lazy', 'compiled', 'vm'), repeat=3):
+    for name, source in ENGINE_PROGRAMS.items():
+        ast = interpreter.parse(source)
+        times = []
+        for engine in engines:
+            if engine == 'subst' and 'letrec' in source:
+                continue
+            run = interpreter.ENGINES[engine]
+            times.append(f"{engine} {best_time(lambda: run(ast), repeat) * 1000:.2f} ms")
+        print(f"{name}: " + ", ".join(times))
+
+# tail-recursive loops of a million iterations. they run with the default
+# recursion limit, so the engines that finish them do so in constant stack
+def bench_tail_calls(size=1000000, engines=('env', 'stack', 'vm')):
+    source = "letrec sum = \\n. \\acc. if n == 0 then acc else sum (n-1) (acc+n) in sum %d 0" % size
+    ast = interpreter.parse(source)
+    print(f"recursion limit {sys.getrecursionlimit()}")
+    for engine in engines:
+        start = time.perf_counter()
+        result = interpreter.ENGINES[engine](ast)
+        print(f"sum {size} ({engine}): {result:.1f} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+# naive fibonacci with and without memoization, and a recursion down lists
+# of growing lengths, whose memoized time should grow linearly too
+def bench_memo(size=20, engines=('env', 'stack'), lengths=(2000, 4000, 8000)):
+    fib = "letrec fib = \\n. if n < 2 then n else fib (n-1) + fib (n-2) in fib %d" % size
+    length = ("letrec build = \\n. if n == 0 then # else n : build (n-1) in "
+              "letrec len = \\xs. if xs == # then 0 else 1 + len (tl xs) in len (build %d)")
+    for engine in engines:
+        run = interpreter.ENGINES[engine]
+        for name, ast in [(f"fib {size}", interpreter.parse(fib))] + [
+                (f"len {n}", interpreter.parse(length % n)) for n in (lengths if engine == 'stack' else ())]:
+            plain_time = best_time(lambda: run(ast), 1)
+            interpreter.memo_table = interpreter.MemoTable()
+            try:
+                memo_time = best_time(lambda: run(ast), 1)
+                counts = interpreter.memo_table.as_dict()
+            finally:
+                interpreter.memo_table = None
+            print(f"{name} ({engine}): {plain_time * 1000:.1f} ms, memoized {memo_time * 1000:.2f} ms "
+                  f"({counts['hits']} hits, {counts['misses']} misses)")
+
+# cons cells against array-backed lists: building a long list, comparing two
+# of them and printing the result
+def bench_lists(size=100000, engine='stack', repeat=3):
+    build = interpreter.parse("letrec range = \\n. \\acc. if n == 0 then acc else range (n-1) (n : acc) "
+                              "in range %d #" % size)
+    source = ":".join(str(i) for i in range(size)) + ":#"
+    compare = interpreter.parse(source + " == " + source)
+    run = interpreter.ENGINES[engine]
+    for array_lists in [False, True]:
+        interpreter.array_lists = array_lists
+        try:
+            build_time = best_time(lambda: run(build), repeat)
+            compare_time = best_time(lambda: run(compare), repeat)
+            result = run(build)
+            linearize_time = best_time(lambda: interpreter.linearize(result), repeat)
+        finally:
+            interpreter.array_lists = False
+        name = 'arrays' if array_lists else 'cons cells'
+        print(f"{name} ({size} elements): build {build_time * 1000:.1f} ms, == {compare_time * 1000:.1f} ms, "
+              f"linearize {linearize_time * 1000:.1f} ms")
+
+# linearize to a string and streamed to a file, on a long list and a deep term
+def bench_linearize(size=200000, repeat=3):
+    programs = {
+        'list': ":".join(str(i) for i in range(size)) + ":#",
+        'deep term': "\\x. " + "(" * size + "x" + " + 1)" * size,
+    }
+    for name, source in programs.items():
+        ast = interpreter.parse(source)
+        string_time = best_time(lambda: interpreter.linearize(ast), repeat)
+        with open(os.devnull, 'w') as devnull:
+            stream_time = best_time(lambda: interpreter.write_linear(ast, devnull), repeat)
+        print(f"{name} ({size}): linearize {string_time * 1000:.1f} ms, write_linear {stream_time * 1000:.1f} ms")
+
+# a fresh interpreter process: time to import the module and to get the
+# result of a one-line expression
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import interpreter
+imported = time.perf_counter()
+interpreter.interpret(%r)
+done = time.perf_counter()
+print(imported - start, done - imported)
+"""
+
+def bench_startup(expression="1+1", repeat=5):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT % expression], cwd=directory,
+                                capture_output=True, text=True, check=True).stdout
+        total = time.perf_counter() - start
+        import_time, first_result = map(float, output.split())
+        runs.append((total, import_time, first_result))
+    total, import_time, first_result = min(runs)
+    print(f"{expression!r}: process {total * 1000:.1f} ms, import {import_time * 1000:.1f} ms, "
+          f"first result {first_result * 1000:.1f} ms")
+
+# generated programs of about size bytes for bench_parse
+PARSE_PROGRAMS = {
+    'list': lambda size: ":".join(str(i) for i in range(size // 7)) + ":#",
+    'definitions': lambda size: "".join(
+        f"let f{i} = \\x. if x < {i} then x * {i} + 1 else (f{i - 1} x) - {i} in\n"
+        for i in range(1, size // 60)) + "f1 2",
+    'segments': lambda size: " ;;\n".join(
+        f"letrec g{i} = \\n. if n == 0 then # else n : g{i} (n-1) in hd (g{i} {i}) + (-{i})"
+        for i in range(size // 70)),
+}
+
+# parse and transform throughput: Lark building a Tree that
+# LambdaCalculusTransformer transforms afterwards, against the parser of
+# interpreter.get_parser, which applies the transformer as it reduces
+def bench_parse(size=2 * 1024 * 1024, repeat=1):
+    two_pass = interpreter.make_parser(interpreter.get_grammar())
+    transformer = interpreter.LambdaCalculusTransformer()
+    one_pass = interpreter.get_parser()
+    for name, generate in PARSE_PROGRAMS.items():
+        source = generate(size)
+        megabytes = len(source) / (1024 * 1024)
+        same = interpreter.linearize(transformer.transform(two_pass.parse(source))) == interpreter.linearize(one_pass.parse(source))
+        assert same, name
+        two_pass_time = best_time(lambda: transformer.transform(two_pass.parse(source)), repeat)
+        one_pass_time = best_time(lambda: one_pass.parse(source), repeat)
+        print(f"{name:<12} {megabytes:.1f} MB: Tree + transform {megabytes / two_pass_time:.2f} MB/s, "
+              f"inline transformer {megabytes / one_pass_time:.2f} MB/s ({two_pass_time / one_pass_time:.1f}x)")
+
+# loading a .lcc artifact against parsing and optimizing its .lc source
+def bench_artifact(size=200 * 1024, repeat=3):
+    import tempfile
+    import artifact
+    with tempfile.TemporaryDirectory() as directory:
+        for name, generate in PARSE_PROGRAMS.items():
+            source = generate(size)
+            source_path = os.path.join(directory, name + '.lc')
+            with open(source_path, 'w') as file:
+                file.write(source)
+            path = artifact.compile_file(source_path)
+            parse_time = best_time(lambda: interpreter.load(source), repeat)
+            load_time = best_time(lambda: artifact.load_artifact(path), repeat)
+            print(f"{name:<12} {len(source) / 1024:.0f} KiB source, {os.path.getsize(path) / 1024:.0f} KiB artifact: "
+                  f"parse {parse_time * 1000:.1f} ms, load {load_time * 1000:.1f} ms ({parse_time / load_time:.1f}x)")
+
+# the built-in list functions of primitives.py against the same functions
+# written with letrec
+PRIMITIVE_PROGRAMS = {
+    'sum': ("letrec foldl = \\f.\\z.\\xs. if xs == # then z else foldl f (f z (hd xs)) (tl xs) in "
+            "letrec rangefrom = \\i.\\n. if i < n then i : rangefrom (i+1) n else # in "
+            "foldl (\\a.\\b. a + b) 0 (rangefrom 0 %d)", "sum (range %d)"),
+    'map': ("letrec map = \\f.\\xs. if xs == # then # else f (hd xs) : map f (tl xs) in "
+            "letrec rangefrom = \\i.\\n. if i < n then i : rangefrom (i+1) n else # in "
+            "map (\\x. x * 2 + 1) (rangefrom 0 %d)", "map (\\x. x * 2 + 1) (range %d)"),
+    'length': ("letrec length = \\xs. if xs == # then 0 else 1 + length (tl xs) in length (range %d)",
+               "length (range %d)"),
+}
+
+def bench_primitives(size=10000, engines=('stack', 'vm'), repeat=3):
+    import primitives
+    for name, (defined, builtin) in PRIMITIVE_PROGRAMS.items():
+        defined_ast, builtin_ast = interpreter.parse(defined % size), interpreter.parse(builtin % size)
+        for engine in engines:
+            run = interpreter.ENGINES[engine]
+            assert interpreter.linearize(run(defined_ast)) == interpreter.linearize(run(builtin_ast))
+            defined_time = best_time(lambda: run(defined_ast), repeat)
+            builtin_time = best_time(lambda: run(builtin_ast), repeat)
+            print(f"{name:<7} {engine:<6} letrec {defined_time * 1000:8.2f} ms, "
+                  f"built-in {builtin_time * 1000:8.2f} ms ({defined_time / builtin_time:.0f}x)")
+    print(f"NumPy: {'yes' if primitives.get_numpy() else 'no'}")
+
+# the workloads of the suite. each takes a size and returns a function that
+# runs the workload once, everything before that (parsing, building the
+# input) is setup and isn't measured
+def workload_let_chain(size):
+    source = "".join(f"let x{i} = x{i - 1} + 1 in " if i else "let x0 = 1 in " for i in range(size)) + f"x{size - 1}"
+    ast = interpreter.parse(source)
+    return lambda: interpreter.evaluate(ast)
+
+def list_source(size):
+    return ":".join(str(i) for i in range(size)) + ":#"
+
+def workload_list_build(size):
+    ast = interpreter.parse(list_source(size))
+    return lambda: interpreter.evaluate_stack_program(ast)
+
+def workload_list_equality(size):
+    ast = interpreter.parse(list_source(size) + " == " + list_source(size))
+    return lambda: interpreter.evaluate_stack_program(ast)
+
+def workload_map_fold(size):
+    ast = interpreter.parse(
+        "letrec range = \\n. \\acc. if n == 0 then acc else range (n-1) (n : acc) in "
+        "letrec map = \\f. \\xs. if xs == # then # else (f (hd xs)) : (map f (tl xs)) in "
+        "letrec fold = \\f. \\acc. \\xs. if xs == # then acc else fold f (f acc (hd xs)) (tl xs) in "
+        "fold (\\a. \\b. a + b) 0 (map (\\x. x * 2) (range %d #))" % size)
+    return lambda: interpreter.evaluate_stack_program(ast)
+
+def workload_factorial(size):
+    ast = interpreter.parse("letrec fact = \\n. if n == 0 then 1 else n * fact (n-1) in fact %d" % size)
+    return lambda: interpreter.evaluate_closures(ast)
+
+def workload_fibonacci(size):
+    ast = interpreter.parse("letrec fib = \\n. if n < 2 then n else fib (n-1) + fib (n-2) in fib %d" % size)
+    return lambda: interpreter.evaluate_closures(ast)
+
+def workload_linearize(size):
+    ast = interpreter.evaluate_stack_program(interpreter.parse(list_source(size)))
+    return lambda: interpreter.linearize(ast)
+
+# a big .lc file: many definitions in front of one expression
+def workload_parse(size):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(directory, 'factorial.lc')) as file:
+        program = file.read()
+    lines = [f"let f{i} = \\x. if x < {i} then x * {i} + 1 else (f{i - 1} x) - {i} in" for i in range(1, size)]
+    source = "let f0 = \\x. x in\n" + "\n".join(lines) + "\n" + program
+    return lambda: interpreter.parse(source)
+
+# name -> (workload, default size)
+WORKLOADS = {
+    'let-chain': (workload_let_chain, 200),
+    'list-build': (workload_list_build, 20000),
+    'list-equality': (workload_list_equality, 20000),
+    'map-fold': (workload_map_fold, 5000),
+    'factorial': (workload_factorial, 150),
+    'fibonacci': (workload_fibonacci, 16),
+    'linearize': (workload_linearize, 100000),
+    'parse': (workload_parse, 2000),
+}
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# time per run and peak traced memory (of one more run). short workloads are
+# run in loops of at least min_seconds, the time is the best of repeat loops
+def measure(run, repeat=3, min_seconds=0.05):
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        if time.perf_counter() - start >= min_seconds:
+            break
+        loops *= 2
+    seconds = best_time(lambda: [run() for _ in range(loops)], repeat) / loops
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+# run the workloads with their sizes multiplied by scale and compare them to
+# the baseline: a time or peak memory more than threshold (a fraction) above
+# the baseline of the same workload and size is a regression. save writes
+# the results as the new baseline. returns the names of the regressions
+def run_suite(names=None, scale=1.0, baseline_path=BASELINE_PATH, threshold=0.25, save=False, repeat=5):
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+    results = {}
+    regressions = []
+    for name in names or WORKLOADS:
+        workload, size = WORKLOADS[name]
+        size = max(1, int(size * scale))
+        result = measure(workload(size), repeat)
+        result['size'] = size
+        results[name] = result
+        line = f"{name:<14} size {size:<7} {result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1024:10.1f} KiB"
+        old = baseline.get(name)
+        if old is not None and old['size'] == size:
+            changes = []
+            for key in ['seconds', 'peak_bytes']:
+                ratio = result[key] / old[key] if old[key] else 1.0
+                changes.append(f"{ratio - 1:+.0%}")
+                if ratio > 1 + threshold:
+                    regressions.append(f"{name} {key}")
+            line += "   (" + ", ".join(changes) + " vs baseline)"
+        print(line)
+    if save:
+        with open(baseline_path, 'w') as file:
+            json.dump({**baseline, **results}, file, indent=2, sort_keys=True)
+        print(f"baseline written to {baseline_path}")
+    if regressions:
+        print(f"regressions (more than {threshold:.0%} above the baseline): " + ", ".join(regressions))
+    return regressions
+
+BENCHMARKS = {
+    'artifact': bench_artifact,
+    'engines': bench_engines,
+    'linearize': bench_linearize,
+    'lists': bench_lists,
+    'memo': bench_memo,
+    'nodes': bench_nodes,
+    'parse': bench_parse,
+    'primitives': bench_primitives,
+    'startup': bench_startup,
+    'tail-calls': bench_tail_calls,
+}
+
+BENCHMARKS['suite'] = run_suite
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmarks of the interpreter.')
+    arg_parser.add_argument('names', nargs='*', choices=[[]] + sorted(BENCHMARKS),
+                            help="benchmarks to run, all of them by default")
+    arg_parser.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS), help="workloads of the suite to run")
+    arg_parser.add_argument('--scale', type=float, default=1.0, help="multiply the sizes of the suite's workloads")
+    arg_parser.add_argument('--baseline', default=BASELINE_PATH, help="JSON file of the suite's baseline")
+    arg_parser.add_argument('--threshold', type=float, default=0.25,
+                            help="fraction above the baseline that counts as a regression")
+    arg_parser.add_argument('--save', action='store_true', help="write the suite's results as the new baseline")
+    args = arg_parser.parse_args()
+    regressions = []
+    for name in args.names or sorted(BENCHMARKS):
+        print(f"== {name}")
+        if name == 'suite':
+            regressions = run_suite(args.workloads, args.scale, args.baseline, args.threshold, args.save)
+        else:
+            BENCHMARKS[name]()
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# closure compilation: the AST is translated once into nested Python
+# functions, one per node, that take an environment and return a value.
+# tags, names and subtrees are looked at only while compiling; running the
+# program is calling the function of the root.
+# values and environments are the ones of interpreter.evaluate_env, so the
+# results are read back and linearized the same way. a compiled lambda is a
+# closure ('closure', name, body, env, code) whose extra field is the
+# compiled body. variables are resolved while compiling: a bound variable
+# becomes the number of frames to skip in the environment chain.
+import operator
+
+import interpreter
+from interpreter import BINARY_OPS, apply_primitive, make_cons, quote, readback, values_equal, vec_head, vec_tail
+
+NUMBER_OPS = {
+    'plus': operator.add,
+    'minus': operator.sub,
+    'multiply': operator.mul,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'le': operator.le,
+    'ge': operator.ge,
+}
+
+# scope holds the names bound around tree, innermost first
+def compile_tree(tree, scope=()):
+    if not isinstance(tree, tuple):
+        return constant(tree)
+    return COMPILERS.get(tree[0], compile_constant)(tree, scope)
+
+def constant(value):
+    def run(env):
+        return value
+    return run
+
+def compile_constant(tree, scope):
+    return constant(tree)
+
+def compile_number(tree, scope):
+    return constant(tree[1])
+
+def compile_nil(tree, scope):
+    return constant(('nil',))
+
+def compile_var(tree, scope):
+    name = tree[1]
+    if name not in scope:
+        return constant(tree)  # free variables stay symbolic
+    depth = scope.index(name)
+    if depth == 0:
+        def run(env):
+            return env[1]
+    elif depth == 1:
+        def run(env):
+            return env[2][1]
+    elif depth == 2:
+        def run(env):
+            return env[2][2][1]
+    else:
+        def run(env):
+            for _ in range(depth):
+                env = env[2]
+            return env[1]
+    return run
+
+def compile_lam(tree, scope):
+    name, body = tree[1], tree[2]
+    body_code = compile_tree(body, (name,) + scope)
+
+    def run(env):
+        return ('closure', name, body, env, body_code)
+    return run
+
+def compile_app(tree, scope):
+    if len(tree) == 2:
+        return compile_tree(tree[1], scope)
+    function_code = compile_tree(tree[1], scope)
+    argument_code = compile_tree(tree[2], scope)
+
+    def run(env):
+        function = function_code(env)
+        argument = argument_code(env)
+        if function.__class__ is tuple:
+            if function[0] == 'closure':
+                return function[4]([function[1], argument, function[3], False])
+            if function[0] == 'nil':
+                return function
+        result = apply_primitive(function, argument, enter_closure)
+        if result is not None:
+            return result
+        return ('app', function, argument)
+
+    # compiled while limits or statistics are on: the applications are counted
+    def run_counted(env):
+        stats.tick()
+        return run(env)
+    stats = interpreter.stats
+    return run if stats is None else run_counted
+
+def enter_closure(function, value):
+    return function[4]([function[1], value, function[3], False])
+
+def compile_let(tree, scope):
+    name = tree[1]
+    value_code = compile_tree(tree[2], scope)
+    body_code = compile_tree(tree[3], (name,) + scope)
+
+    def run(env):
+        return body_code([name, value_code(env), env, False])
+    return run
+
+def compile_rec(tree, scope):
+    name = tree[1]
+    value_code = compile_tree(tree[2], (name,) + scope)
+    body_code = compile_tree(tree[3], (name,) + scope)
+
+    def run(env):
+        frame = [name, ('var', name), env, True]
+        frame[1] = value_code(frame)
+        return body_code(frame)
+    return run
+
+def compile_fix(tree, scope):
+    argument_code = compile_tree(tree[1], scope)
+
+    def run(env):
+        argument = argument_code(env)
+        if isinstance(argument, tuple) and argument[0] == 'closure':
+            frame = [argument[1], ('var', argument[1]), argument[3], True]
+            frame[1] = argument[4](frame)
+            return frame[1]
+        return ('fix', argument)
+    return run
+
+def compile_if(tree, scope):
+    condition_code = compile_tree(tree[1], scope)
+    then_code = compile_tree(tree[2], scope)
+    else_code = compile_tree(tree[3], scope)
+
+    def run(env):
+        condition = condition_code(env)
+        if isinstance(condition, tuple):
+            return ('if', condition, quote(tree[2], env), quote(tree[3], env))
+        if condition:
+            return then_code(env)
+        return else_code(env)
+    return run
+
+def compile_negation(tree, scope):
+    value_code = compile_tree(tree[1], scope)
+
+    def run(env):
+        value = value_code(env)
+        if isinstance(value, (float, int)):
+            return -value
+        return ('negation', value)
+    return run
+
+def compile_list_access(tree, scope):
+    tag = tree[0]
+    position = 1 if tag == 'hd' else 2
+    list_code = compile_tree(tree[1], scope)
+
+    def run(env):
+        lst = list_code(env)
+        if isinstance(lst, tuple):
+            if lst[0] == 'cons':
+                return lst[position]
+            elif lst[0] == 'vec':
+                return vec_head(lst) if position == 1 else vec_tail(lst)
+            elif lst[0] == 'nil':
+                return ('nil',)
+        return (tag, lst)
+    return run
+
+def compile_cons(tree, scope):
+    head_code = compile_tree(tree[1], scope)
+    tail_code = compile_tree(tree[2], scope)
+
+    def run(env):
+        return make_cons(head_code(env), tail_code(env))
+    return run
+
+def compile_seq(tree, scope):
+    first_code = compile_tree(tree[1], scope)
+    second_code = compile_tree(tree[2], scope)
+
+    def run(env):
+        return ('seq', first_code(env), second_code(env))
+    return run
+
+def compile_eq(tree, scope):
+    left_code = compile_tree(tree[1], scope)
+    right_code = compile_tree(tree[2], scope)
+
+    def run(env):
+        return values_equal(left_code(env), right_code(env))
+    return run
+
+def compile_binary(tree, scope):
+    tag = tree[0]
+    number_op = NUMBER_OPS[tag]
+    left_code = compile_tree(tree[1], scope)
+    right_code = compile_tree(tree[2], scope)
+
+    def run(env):
+        left = left_code(env)
+        right = right_code(env)
+        if left.__class__ is float and right.__class__ is float:
+            return number_op(left, right)
+        if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+            return BINARY_OPS[tag](left, right)
+        return (tag, left, right)
+    return run
+
+COMPILERS = {
+    'number': compile_number,
+    'nil': compile_nil,
+    'var': compile_var,
+    'lam': compile_lam,
+    'app': compile_app,
+    'let': compile_let,
+    'rec': compile_rec,
+    'fix': compile_fix,
+    'if': compile_if,
+    'negation': compile_negation,
+    'hd': compile_list_access,
+    'tl': compile_list_access,
+    'cons': compile_cons,
+    'seq': compile_seq,
+    'eq': compile_eq,
+}
+COMPILERS.update(dict.fromkeys(NUMBER_OPS, compile_binary))
+
+# engine entry point for interpret()
+def evaluate_compiled(tree):
+    return readback(compile_tree(tree)(None))
@@ -1,24 +1,349 @@
+import argparse
+import collections
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
 import sys
+import time
 import lark
-from lark import Lark, Transformer, Tree
+from lark import Lark, Transformer_NonRecursive, Tree
+import nodes
 
 
-print(f"Python version: {sys.version}")
-print(f"Lark version: {lark.__version__}")
 
 #  run/execute/interpret source code
-def interpret(source_code):
-    cst = parser.parse(source_code)
-    ast = LambdaCalculusTransformer().transform(cst)
-    result_ast = evaluate(ast)
+# engine selects the evaluation strategy, see ENGINES at the bottom of the file
+# use_cache looks the AST up in (and adds it to) the on-disk AST cache
+# with stats=True the result comes with the Stats of the run: (result, stats)
+# the max_ arguments limit the evaluation, see Stats
+# ast is the already loaded AST of source_code (eg from a .lcc artifact)
+def interpret(source_code, engine='subst', use_cache=False, stats=False,
+              max_steps=None, max_depth=None, max_nodes=None, max_seconds=None, ast=None):
+    if stats or max_steps or max_depth or max_nodes or max_seconds:
+        result, collected = interpret_with_stats(source_code, engine, use_cache,
+                                                 max_steps, max_depth, max_nodes, max_seconds,
+                                                 wrap=bool(stats or max_depth or max_nodes), ast=ast)
+        return (result, collected) if stats else result
+    if ast is None:
+        ast = load(source_code, use_cache)
+    if parallel_segments is not None:
+        return interpret_segments(ast, engine, parallel_segments)
+    result_ast = ENGINES[engine](ast)
     result = linearize(result_ast)
     return result
 
-# convert concrete syntax to CST
-parser = Lark(open("grammar.lark").read(), parser='lalr')
+# like interpret, but writes the result to the text stream instead of
+# building it as one string, for results too large to hold twice
+def interpret_stream(source_code, stream, engine='subst', use_cache=False):
+    ast = load(source_code, use_cache)
+    write_linear(ENGINES[engine](ast), stream)
 
-# convert CST to AST
-class LambdaCalculusTransformer(Transformer):
+# evaluation statistics. collecting them is off while the module global stats
+# is None: evaluate, evaluate_env and evaluate_stack then only pay for one
+# test per step, and parse for one per program. while a Stats is collecting,
+# evaluate, evaluate_env and substitute are replaced by wrappers that count
+# the calls, the nesting depth and the tuples the calls return other than
+# their argument (an estimate of the nodes allocated).
+# a Stats can also limit the evaluation: the number of steps (subterms
+# evaluated), the depth, the nodes allocated and the time. going past a limit
+# raises BudgetExceeded. the clock is read every CLOCK_STEPS steps.
+# ENGINE_LIMITS lists the limits each engine can enforce
+CLOCK_STEPS = 1024
+ALLOCATING = {'lam', 'app', 'let', 'rec', 'cons', 'seq'}
+
+class Stats:
+    def __init__(self, max_steps=None, max_depth=None, max_nodes=None, max_seconds=None):
+        self.phases = {}  # phase name -> seconds
+        self.constructs = collections.Counter()  # AST tag -> times evaluated
+        self.steps = 0
+        self.beta_reductions = 0
+        self.substitutions = 0  # calls of substitute from outside substitute
+        self.nodes_allocated = 0
+        self.max_depth = 0
+        self.depth = 0
+        self.substitute_depth = 0
+        self.optimizer = None  # Counter of optimizer.optimize_report
+        self.limits = {'steps': max_steps, 'depth': max_depth, 'nodes': max_nodes, 'seconds': max_seconds}
+        self.step_limit = max_steps or float('inf')
+        self.depth_limit = max_depth or float('inf')
+        self.node_limit = max_nodes or float('inf')
+        self.deadline = time.perf_counter() + max_seconds if max_seconds else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, tree):
+        self.constructs[tree[0] if isinstance(tree, tuple) else 'number'] += 1
+        self.tick()
+
+    # a step without a construct to count: an application of the vm and
+    # compiled engines, a node evaluated by the nodes engine
+    def tick(self):
+        self.steps += 1
+        if self.steps > self.step_limit:
+            raise BudgetExceeded('steps', self)
+        if self.deadline is not None and self.steps % CLOCK_STEPS == 0 and time.perf_counter() > self.deadline:
+            raise BudgetExceeded('seconds', self)
+
+    # evaluate_stack has no wrappers: depth is the number of pending frames,
+    # and the constructs that build a value or an environment frame count as
+    # allocating a node
+    def step(self, tree, depth):
+        self.count(tree)
+        self.reached(depth)
+        if isinstance(tree, tuple) and tree[0] in ALLOCATING:
+            self.allocated()
+
+    def reached(self, depth):
+        if depth > self.max_depth:
+            self.max_depth = depth
+            if depth > self.depth_limit:
+                raise BudgetExceeded('depth', self)
+
+    def allocated(self):
+        self.nodes_allocated += 1
+        if self.nodes_allocated > self.node_limit:
+            raise BudgetExceeded('nodes', self)
+
+    def as_dict(self):
+        return {
+            'phases': dict(self.phases),
+            'steps': self.steps,
+            'beta_reductions': self.beta_reductions,
+            'substitutions': self.substitutions,
+            'nodes_allocated': self.nodes_allocated,
+            'max_depth': self.max_depth,
+            'constructs': dict(self.constructs.most_common()),
+            'memo': memo_table.as_dict() if memo_table is not None else None,
+            'optimizer': dict(self.optimizer) if self.optimizer is not None else None,
+        }
+
+    def report(self):
+        lines = [f"{name + ' time':<18}{seconds * 1000:.3f} ms" for name, seconds in self.phases.items()]
+        lines += [f"steps             {self.steps}",
+                  f"beta reductions   {self.beta_reductions}",
+                  f"substitutions     {self.substitutions}",
+                  f"nodes allocated   {self.nodes_allocated}",
+                  f"max depth         {self.max_depth}"]
+        if memo_table is not None:
+            lines.append(f"memo              {memo_table.hits} hits, {memo_table.misses} misses")
+        if self.optimizer is not None:
+            removed = self.optimizer['before'] - self.optimizer['after']
+            lines.append(f"optimizer         {removed} of {self.optimizer['before']} nodes removed")
+        lines += ["evaluated"]
+        lines += [f"  {tag:<16}{count}" for tag, count in self.constructs.most_common()]
+        return '\n'.join(lines)
+
+    def wrap_evaluate(self, function):
+        def counted(*args):
+            self.depth += 1
+            try:
+                self.reached(self.depth)
+                result = function(*args)
+            finally:
+                self.depth -= 1
+            if isinstance(result, tuple) and result is not args[0]:
+                self.allocated()
+            return result
+        return counted
+
+    def wrap_substitute(self, function):
+        def counted(tree, name, replacement, *captured):
+            if self.substitute_depth == 0:
+                self.substitutions += 1
+            self.substitute_depth += 1
+            try:
+                result = function(tree, name, replacement, *captured)
+            finally:
+                self.substitute_depth -= 1
+            if result is not tree and result is not replacement:
+                self.allocated()
+            return result
+        return counted
+
+stats = None
+
+# raised when an evaluation goes past a limit of its Stats. resource is
+# 'steps', 'depth', 'nodes' or 'seconds', stats holds the counts so far
+class BudgetExceeded(Exception):
+    def __init__(self, resource, stats):
+        self.resource = resource
+        self.limit = stats.limits[resource]
+        self.stats = stats
+        super().__init__(f"{resource} budget of {self.limit} exceeded")
+
+    def as_dict(self):
+        return {'budget': self.resource, 'limit': self.limit, 'stats': self.stats.as_dict()}
+
+# collect into collected while the block runs. without wrap only the steps
+# and the time are counted, the cheaper way to enforce just those limits
+@contextlib.contextmanager
+def collecting(collected, wrap=True):
+    global stats, evaluate, evaluate_env, substitute
+    originals = evaluate, evaluate_env, substitute
+    stats = nodes.stats = collected
+    if wrap:
+        evaluate = collected.wrap_evaluate(evaluate)
+        evaluate_env = collected.wrap_evaluate(evaluate_env)
+        substitute = collected.wrap_substitute(substitute)
+    try:
+        yield collected
+    finally:
+        stats = nodes.stats = None
+        evaluate, evaluate_env, substitute = originals
+
+def interpret_with_stats(source_code, engine='subst', use_cache=False,
+                         max_steps=None, max_depth=None, max_nodes=None, max_seconds=None, wrap=True, ast=None):
+    check_limits(engine, max_steps, max_depth, max_nodes, max_seconds)
+    with collecting(Stats(max_steps, max_depth, max_nodes, max_seconds), wrap) as collected:
+        if ast is None:
+            ast = load(source_code, use_cache)
+        with collected.phase('evaluate'):
+            try:
+                result_ast = ENGINES[engine](ast)
+            except RecursionError:
+                if collected.limits['depth'] is None:
+                    raise
+                # with a depth limit, deeper than Python allows is past it
+                raise BudgetExceeded('depth', collected) from None
+        with collected.phase('linearize'):
+            result = linearize(result_ast)
+    return result, collected
+
+# on-disk caches: the compiled LALR tables of the grammar, and the ASTs of
+# .lc files keyed by a hash of their content. set LC_CACHE_DIR to move them,
+# or to an empty string to turn them off
+CACHE_DIR = os.environ.get('LC_CACHE_DIR', os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'lc-interpreter'))
+AST_CACHE_VERSION = 1  # bump when the AST produced by LambdaCalculusTransformer changes
+AST_CACHE_MAX_FILES = 256
+AST_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# path in the cache directory, or None if caching is off or impossible
+def cache_path(file_name):
+    if not CACHE_DIR:
+        return None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+    except OSError:
+        return None
+    return os.path.join(CACHE_DIR, file_name)
+
+# Lark checks that the cached tables belong to this grammar and Lark version.
+# with a transformer, the LALR parser calls it as it reduces each rule, so
+# parse returns the AST directly instead of a Tree to transform afterwards
+def make_parser(grammar, transformer=None):
+    return Lark(grammar, parser='lalr', transformer=transformer, cache=cache_path('grammar.lalr') or False)
+
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grammar.lark')
+
+# the grammar and the parser are only loaded when they are first needed, so
+# that importing this module (and short command line runs) stay cheap
+grammar = None
+parser = None
+
+def get_grammar():
+    global grammar
+    if grammar is None:
+        with open(GRAMMAR_PATH) as file:
+            grammar = file.read()
+    return grammar
+
+# convert concrete syntax to AST, with the one LambdaCalculusTransformer
+def get_parser():
+    global parser
+    if parser is None:
+        parser = make_parser(get_grammar(), LambdaCalculusTransformer())
+    return parser
+
+# source code to AST
+def parse(source_code):
+    if stats is not None:
+        with stats.phase('parse'):
+            return get_parser().parse(source_code)
+    return get_parser().parse(source_code)
+
+# the AST to evaluate: parsed (or loaded from the cache) and, while the
+# module global optimizing is true, simplified by optimizer.py
+optimizing = True
+
+def load(source_code, use_cache=False):
+    ast = parse_cached(source_code) if use_cache else parse(source_code)
+    if not optimizing:
+        return ast
+    import optimizer
+    if stats is not None:
+        with stats.phase('optimize'):
+            ast, stats.optimizer = optimizer.optimize_report(ast)
+        return ast
+    return optimizer.optimize(ast)
+
+# parse and transform source, or load its AST from the cache if it was seen before
+def parse_cached(source_code):
+    key = hashlib.sha256(f"{AST_CACHE_VERSION}\0{get_grammar()}\0{source_code}".encode()).hexdigest()
+    path = cache_path(key + '.ast')
+    if path is not None:
+        try:
+            start = time.perf_counter()
+            with open(path, 'rb') as file:
+                ast = pickle.load(file)
+            os.utime(path)  # most recently used
+            if stats is not None:
+                stats.phases['load'] = time.perf_counter() - start
+            return ast
+        except (OSError, pickle.PickleError, EOFError):
+            pass
+    ast = parse(source_code)
+    if path is not None:
+        store_ast(path, ast)
+    return ast
+
+def store_ast(path, ast):
+    try:
+        data = pickle.dumps(ast, pickle.HIGHEST_PROTOCOL)
+    except RecursionError:
+        return  # too deep to pickle, it is just parsed again next time
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except OSError:
+        return
+    evict_asts()
+
+# remove the least recently used ASTs until the cache is within its limits
+def evict_asts():
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith('.ast'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort(reverse=True)
+    total = 0
+    for count, (_, size, path) in enumerate(entries):
+        total += size
+        if count >= AST_CACHE_MAX_FILES or total > AST_CACHE_MAX_BYTES:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# convert CST to AST. the parser applies it while parsing, see get_parser.
+# on its own it transforms a Tree without recursion, so long lists and deep
+# terms can be transformed
+class LambdaCalculusTransformer(Transformer_NonRecursive):
     def plus(self, args):
         return ('plus', args[0], args[1])
     
@@ -104,278 +429,302 @@ class LambdaCalculusTransformer(Transformer):
     def cons(self, args):
         return ('cons', args[0], args[1])
 
-def linearize(ast):
-    if isinstance(ast, (float, int)):
-        return f"{ast:.1f}"
-    
-    if isinstance(ast, tuple):
-        if ast[0] == 'hd':
-            # Don't evaluate again, just format what we have
-            if isinstance(ast[1], tuple) and ast[1][0] == 'var':
-                return f"(hd {ast[1][1]})"  # Format unevaluated hd of variable
-            elif isinstance(ast[1], tuple) and ast[1][0] == 'cons':
-                return linearize(evaluate(ast))  # Evaluate and linearize the result
-            return f"(hd {linearize(ast[1])})"  # Format other unevaluated hd expressions
-        
-        elif ast[0] == 'cons':
-            return f"({linearize(ast[1])} : {linearize(ast[2])})"
-        
-        elif ast[0] == 'var':
-            return ast[1]
-        
-        elif ast[0] == 'lam':
-            return f"(\\{ast[1]}.{linearize(ast[2])})"
-        
-        elif ast[0] == 'app':
-            return f"({linearize(ast[1])} {linearize(ast[2])})"
-        
-        elif ast[0] == 'plus':
-            return f"({linearize(ast[1])} + {linearize(ast[2])})"
-        
-        elif ast[0] == 'minus':
-            return f"({linearize(ast[1])} - {linearize(ast[2])})"
-        
-        elif ast[0] == 'multiply':
-            return f"({linearize(ast[1])} * {linearize(ast[2])})"
-        
-        elif ast[0] == 'negation':
-            return f"(-{linearize(ast[1])})"
-        
-        elif ast[0] == 'number':
-            return f"{ast[1]:.1f}"
-        
-        elif ast[0] == 'let':
-            return f"(let {ast[1]} = {linearize(ast[2])} in {linearize(ast[3])})"
-        
-        elif ast[0] == 'rec':
-            return f"(letrec {ast[1]} = {linearize(ast[2])} in {linearize(ast[3])})"
-        
-        elif ast[0] == 'fix':
-            return f"(fix {linearize(ast[1])})"
-        
-        elif ast[0] == 'if':
-            return f"(if {linearize(ast[1])} then {linearize(ast[2])} else {linearize(ast[3])})"
-        
-        elif ast[0] == 'eq':
-            return f"({linearize(ast[1])} == {linearize(ast[2])})"
-        
-        elif ast[0] == 'lt':
-            return f"({linearize(ast[1])} < {linearize(ast[2])})"
-        
-        elif ast[0] == 'gt':
-            return f"({linearize(ast[1])} > {linearize(ast[2])})"
-        
-        elif ast[0] == 'ge':
-            return f"({linearize(ast[1])} >= {linearize(ast[2])})"
-        
-        elif ast[0] == 'le':
-            return f"({linearize(ast[1])} <= {linearize(ast[2])})"
-        
-        elif ast[0] == 'seq':
-            return f"{linearize(ast[1])} ;; {linearize(ast[2])}"
-        
-        elif ast[0] == 'nil':
-            return "#"
-        
-        elif ast[0] == 'tl':
+# output templates for linearize: strings are copied, integers are the
+# positions of the subtrees to linearize in their place
+LINEAR_FORMS = {
+    'cons': ('(', 1, ' : ', 2, ')'),
+    'app': ('(', 1, ' ', 2, ')'),
+    'plus': ('(', 1, ' + ', 2, ')'),
+    'minus': ('(', 1, ' - ', 2, ')'),
+    'multiply': ('(', 1, ' * ', 2, ')'),
+    'negation': ('(-', 1, ')'),
+    'fix': ('(fix ', 1, ')'),
+    'if': ('(if ', 1, ' then ', 2, ' else ', 3, ')'),
+    'eq': ('(', 1, ' == ', 2, ')'),
+    'lt': ('(', 1, ' < ', 2, ')'),
+    'gt': ('(', 1, ' > ', 2, ')'),
+    'ge': ('(', 1, ' >= ', 2, ')'),
+    'le': ('(', 1, ' <= ', 2, ')'),
+    'seq': (1, ' ;; ', 2),
+}
+
+# pieces of text joined into one chunk by linearize_chunks
+CHUNK_PIECES = 4096
+
+# iterative, so that long lists and deep terms don't hit the recursion limit.
+# the work stack holds subtrees and pieces of output text; an AST node is
+# never a plain string, so strings on the stack are always text to emit.
+# yields the output in chunks of about CHUNK_PIECES pieces, each piece of
+# text is copied once, so the time is linear in the size of the output
+def linearize_chunks(ast):
+    out = []
+    stack = [ast]
+    while stack:
+        if len(out) >= CHUNK_PIECES:
+            yield ''.join(out)
+            out = []
+        ast = stack.pop()
+        if isinstance(ast, str):
+            out.append(ast)
+        elif isinstance(ast, (float, int)):
+            out.append(f"{ast:.1f}")
+        elif isinstance(ast, tuple) and ast[0] in LINEAR_FORMS:
+            for part in reversed(LINEAR_FORMS[ast[0]]):
+                stack.append(ast[part] if isinstance(part, int) else part)
+        elif isinstance(ast, tuple) and ast[0] in ['hd', 'tl']:
             # Don't evaluate again, just format what we have
             if isinstance(ast[1], tuple) and ast[1][0] == 'var':
-                return f"(tl {ast[1][1]})"  # Format unevaluated tl of variable
+                out.append(f"({ast[0]} {ast[1][1]})")  # Format unevaluated hd/tl of variable
             elif isinstance(ast[1], tuple) and ast[1][0] == 'cons':
-                return linearize(evaluate(ast))  # Evaluate and linearize the result
-            return f"(tl {linearize(ast[1])})"  # Format other unevaluated tl expressions
+                stack.append(evaluate(ast))  # Evaluate and linearize the result
+            else:
+                stack.extend([')', ast[1], f"({ast[0]} "])  # Format other unevaluated hd/tl expressions
+        elif isinstance(ast, tuple) and ast[0] == 'var':
+            out.append(ast[1])
+        elif isinstance(ast, tuple) and ast[0] == 'lam':
+            stack.extend([')', ast[2], f"(\\{ast[1]}."])
+        elif isinstance(ast, tuple) and ast[0] == 'number':
+            out.append(f"{ast[1]:.1f}")
+        elif isinstance(ast, tuple) and ast[0] in ['let', 'rec']:
+            keyword = 'let' if ast[0] == 'let' else 'letrec'
+            stack.extend([')', ast[3], ' in ', ast[2], f"({keyword} {ast[1]} = "])
+        elif isinstance(ast, tuple) and ast[0] == 'nil':
+            out.append("#")
+        elif isinstance(ast, tuple) and ast[0] == 'vec':
+            if vec_numeric(ast):
+                out.extend(f"({item:.1f} : " for item in vec_items(ast))
+                out.append("#" + ")" * ast[2])
+            else:
+                stack.append(")" * ast[2])
+                stack.append("#")
+                for item in ast[1].items[:ast[2]]:
+                    stack.extend([" : ", item, "("])
+        else:
+            out.append(str(ast))
+    yield ''.join(out)
+
+def linearize(ast):
+    return ''.join(linearize_chunks(ast))
 
-    return str(ast)
+# write the linearized ast to a text stream (a file, sys.stdout, io.StringIO)
+def write_linear(ast, stream):
+    for chunk in linearize_chunks(ast):
+        stream.write(chunk)
 
+# tail positions (if branches, let and letrec bodies, the result of a beta
+# reduction) continue the loop with the new tree instead of recursing, so
+# only nested subterms use Python frames
 def evaluate(tree):
-    if isinstance(tree, (float, int)):
-        return tree
+    while True:
+        if stats is not None:
+            stats.count(tree)
+        if isinstance(tree, (float, int)):
+            return tree
 
-    if isinstance(tree, tuple):
-        if tree[0] == 'lam':
-            # If the lambda body is a constant value, return it directly
-            body = evaluate(tree[2])
-            if isinstance(body, (float, int)):
-                return body
-            return ('lam', tree[1], body)
-
-        elif tree[0] == 'app':  
-            if len(tree) == 2:  
-                return evaluate(tree[1])  
-            else:  
-                left = evaluate(tree[1])  
-                right = evaluate(tree[2])  
+        if isinstance(tree, tuple):
+            if tree[0] == 'lam':
+                # If the lambda body is a constant value, return it directly
+                body = evaluate(tree[2])
+                if isinstance(body, (float, int)):
+                    return body
+                return ('lam', tree[1], body)
+
+            elif tree[0] == 'app':  
+                if len(tree) == 2:  
+                    tree = tree[1]
+                    continue
+                else:  
+                    left = evaluate(tree[1])  
+                    right = evaluate(tree[2])  
                 
-                # If left is nil, just return nil
-                if isinstance(left, tuple) and left[0] == 'nil':
-                    return left
+                    # If left is nil, just return nil
+                    if isinstance(left, tuple) and left[0] == 'nil':
+                        return left
                 
-                # If left is a lambda, then perform beta reduction  
-                if isinstance(left, tuple) and left[0] == 'lam':  
-                    substituted = substitute(left[2], left[1], right)  
-                    return evaluate(substituted)  
+                    # If left is a lambda, then perform beta reduction  
+                    if isinstance(left, tuple) and left[0] == 'lam':  
+                        if stats is not None:
+                            stats.beta_reductions += 1
+                        tree = substitute(left[2], left[1], right)
+                        continue
        
-                # Otherwise, preserve the application structure  
-                return ('app', left, right)
+                    result = apply_primitive(left, right, enter_lam, cons_cell)
+                    if result is not None:
+                        return result
+                    # Otherwise, preserve the application structure  
+                    return ('app', left, right)
 
-        elif tree[0] == 'let':
-            # Evaluate the value first
-            value = evaluate(tree[2])
-            # Then substitute it in the body and evaluate
-            substituted = substitute(tree[3], tree[1], value)
-            return evaluate(substituted)
-
-        elif tree[0] == 'cons':
-            # Simply evaluate both parts fully
-            head = evaluate(tree[1])
-            tail = evaluate(tree[2])
-            return ('cons', head, tail)
+            elif tree[0] == 'let':
+                # Evaluate the value first
+                value = evaluate(tree[2])
+                # Then substitute it in the body and evaluate
+                tree = substitute(tree[3], tree[1], value)
+                continue
 
-        elif tree[0] == 'multiply':
-            # Evaluate multiplication first
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (float, int)) and isinstance(right, (float, int)):
-                return left * right
-            return ('multiply', left, right)
-
-        elif tree[0] == 'plus':
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (float, int)) and isinstance(right, (float, int)):
-                return left + right
-            return ('plus', left, right)
-
-        elif tree[0] == 'minus':
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (float, int)) and isinstance(right, (float, int)):
-                return left - right
-            return ('minus', left, right)
-
-        elif tree[0] == 'var':
-            return tree
+            elif tree[0] == 'cons':
+                # Simply evaluate both parts fully. the spine of a long list
+                # is walked in a loop, only the heads recurse
+                heads = [evaluate(tree[1])]
+                tree = tree[2]
+                while isinstance(tree, tuple) and tree[0] == 'cons':
+                    if stats is not None:
+                        stats.count(tree)
+                    heads.append(evaluate(tree[1]))
+                    tree = tree[2]
+                value = evaluate(tree)
+                for head in reversed(heads[1:]):
+                    if stats is not None:
+                        stats.allocated()
+                    value = ('cons', head, value)
+                return ('cons', heads[0], value)
 
-        elif tree[0] == 'number':
-            return tree[1]
+            elif tree[0] == 'multiply':
+                # Evaluate multiplication first
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+                    return left * right
+                return ('multiply', left, right)
 
-        elif tree[0] == 'negation':
-            value = evaluate(tree[1])
-            if isinstance(value, (float, int)):
-                return -value
-            return ('negation', value)
+            elif tree[0] == 'plus':
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+                    return left + right
+                return ('plus', left, right)
+
+            elif tree[0] == 'minus':
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+                    return left - right
+                return ('minus', left, right)
+
+            elif tree[0] == 'var':
+                return tree
+
+            elif tree[0] == 'number':
+                return tree[1]
+
+            elif tree[0] == 'negation':
+                value = evaluate(tree[1])
+                if isinstance(value, (float, int)):
+                    return -value
+                return ('negation', value)
         
-        elif tree[0] == 'rec':
-            # Create a lambda that will be the recursive function
-            func = ('lam', tree[1], tree[2])
-            # Create the fix expression
-            fix_expr = ('fix', func)
-            # Evaluate the fix expression
-            rec_value = evaluate(fix_expr)
-            # Substitute into body and evaluate
-            substituted = substitute(tree[3], tree[1], rec_value)
-            return evaluate(substituted)
-
-        elif tree[0] == 'fix':
-            # Evaluate the argument to fix
-            arg = evaluate(tree[1])
-            if isinstance(arg, tuple) and arg[0] == 'lam':
-                # Instead of evaluating immediately, return a special fix-lambda
-                return ('fix-lam', arg[1], arg[2])
-            return ('fix', arg)
-
-        elif tree[0] == 'if':
-            condition = evaluate(tree[1])
-            if isinstance(condition, tuple):
-                # If condition didn't evaluate to a boolean/number, return the if expression
-                return ('if', condition, tree[2], tree[3])
-            if condition:
-                return evaluate(tree[2])  # then branch
-            else:
-                return evaluate(tree[3])  # else branch
+            elif tree[0] == 'rec':
+                # Create a lambda that will be the recursive function
+                func = ('lam', tree[1], tree[2])
+                # Create the fix expression
+                fix_expr = ('fix', func)
+                # Evaluate the fix expression
+                rec_value = evaluate(fix_expr)
+                # Substitute into body and evaluate
+                tree = substitute(tree[3], tree[1], rec_value)
+                continue
+
+            elif tree[0] == 'fix':
+                # Evaluate the argument to fix
+                arg = evaluate(tree[1])
+                if isinstance(arg, tuple) and arg[0] == 'lam':
+                    # Instead of evaluating immediately, return a special fix-lambda
+                    return ('fix-lam', arg[1], arg[2])
+                return ('fix', arg)
+
+            elif tree[0] == 'if':
+                condition = evaluate(tree[1])
+                if isinstance(condition, tuple):
+                    # If condition didn't evaluate to a boolean/number, return the if expression
+                    return ('if', condition, tree[2], tree[3])
+                if condition:
+                    tree = tree[2]  # then branch
+                else:
+                    tree = tree[3]  # else branch
+                continue
 
-        elif tree[0] == 'eq':
-            # First fully evaluate both sides to get complete lists
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
+            elif tree[0] == 'eq':
+                # First fully evaluate both sides to get complete lists
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
             
-            # Compare the evaluated expressions
-            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-                return float(left == right)
+                # Compare the evaluated expressions
+                if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                    return float(left == right)
             
-            # For lists (cons structures), compare them recursively
-            if isinstance(left, tuple) and isinstance(right, tuple):
-                # If both are nil, they're equal
-                if left[0] == 'nil' and right[0] == 'nil':
-                    return float(True)
-                # If both are cons cells, compare heads and tails
-                if left[0] == 'cons' and right[0] == 'cons':
-                    # First check if heads are equal
-                    head_eq = evaluate(('eq', left[1], right[1]))
-                    if head_eq == 0.0:  # If heads are not equal
-                        return 0.0
-                    # Then check if tails are equal
-                    return evaluate(('eq', left[2], right[2]))
-                return float(False)  # Different types of structures
-            return float(False)  # Different types
-
-        elif tree[0] == 'lt':
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-                return left < right
-            return ('lt', left, right)
-
-        elif tree[0] == 'gt':
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-                return left > right
-            return ('gt', left, right)
-
-        elif tree[0] == 'ge':
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-                return left >= right
-            return ('ge', left, right)
-
-        elif tree[0] == 'le':
-            left = evaluate(tree[1])
-            right = evaluate(tree[2])
-            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-                return left <= right
-            return ('le', left, right)
-
-        elif tree[0] == 'seq':
-            # Evaluate both expressions and combine their results
-            result1 = evaluate(tree[1])
-            result2 = evaluate(tree[2])
-            return ('seq', result1, result2)  # Keep original 'seq' tag
-
-        elif tree[0] == 'hd':
-            lst = evaluate(tree[1])
-            if isinstance(lst, tuple):
-                if lst[0] == 'cons':
-                    head = lst[1]
-                    return head  # Simply return the head value
-                elif lst[0] == 'nil':
-                    return ('nil',)
-            return ('hd', lst)  # Keep hd unevaluated for variables or other types
-
-        elif tree[0] == 'tl':
-            lst = evaluate(tree[1])
-            if isinstance(lst, tuple):
-                if lst[0] == 'cons':
-                    return lst[2]  # Return the tail of the list
-                elif lst[0] == 'nil':
-                    return ('nil',)
-            return ('tl', lst)  # Keep tl unevaluated for variables or other types
-
-        elif tree[0] == 'nil':
-            return ('nil',)
+                # For lists (cons structures), compare them recursively
+                if isinstance(left, tuple) and isinstance(right, tuple):
+                    # If both are nil, they're equal
+                    if left[0] == 'nil' and right[0] == 'nil':
+                        return float(True)
+                    # If both are cons cells, compare heads and tails
+                    if left[0] == 'cons' and right[0] == 'cons':
+                        # First check if heads are equal
+                        head_eq = evaluate(('eq', left[1], right[1]))
+                        if head_eq == 0.0:  # If heads are not equal
+                            return 0.0
+                        # Then check if tails are equal
+                        tree = ('eq', left[2], right[2])
+                        continue
+                    return float(False)  # Different types of structures
+                return float(False)  # Different types
 
-    return tree
+            elif tree[0] == 'lt':
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                    return left < right
+                return ('lt', left, right)
+
+            elif tree[0] == 'gt':
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                    return left > right
+                return ('gt', left, right)
+
+            elif tree[0] == 'ge':
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                    return left >= right
+                return ('ge', left, right)
+
+            elif tree[0] == 'le':
+                left = evaluate(tree[1])
+                right = evaluate(tree[2])
+                if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                    return left <= right
+                return ('le', left, right)
+
+            elif tree[0] == 'seq':
+                # Evaluate both expressions and combine their results
+                result1 = evaluate(tree[1])
+                result2 = evaluate(tree[2])
+                return ('seq', result1, result2)  # Keep original 'seq' tag
+
+            elif tree[0] == 'hd':
+                lst = evaluate(tree[1])
+                if isinstance(lst, tuple):
+                    if lst[0] == 'cons':
+                        head = lst[1]
+                        return head  # Simply return the head value
+                    elif lst[0] == 'nil':
+                        return ('nil',)
+                return ('hd', lst)  # Keep hd unevaluated for variables or other types
+
+            elif tree[0] == 'tl':
+                lst = evaluate(tree[1])
+                if isinstance(lst, tuple):
+                    if lst[0] == 'cons':
+                        return lst[2]  # Return the tail of the list
+                    elif lst[0] == 'nil':
+                        return ('nil',)
+                return ('tl', lst)  # Keep tl unevaluated for variables or other types
+
+            elif tree[0] == 'nil':
+                return ('nil',)
+
+        return tree
 
 # generate a fresh name 
 # needed eg for \y.x [y/x] --> \z.y where z is a fresh name)
@@ -390,75 +739,1295 @@ class NameGenerator:
 
 name_generator = NameGenerator()
 
+# the subtrees of tree and the name its binder (if any) binds in them
+def scoped_children(tree):
+    if tree[0] in ['lam', 'fix-lam']:
+        return [(tree[2], tree[1])]
+    if tree[0] == 'let':
+        return [(tree[2], None), (tree[3], tree[1])]
+    if tree[0] == 'rec':
+        return [(tree[2], tree[1]), (tree[3], tree[1])]
+    if tree[0] == 'var':
+        return []
+    return [(child, None) for child in tree[1:] if isinstance(child, tuple)]
+
+# names that occur free in tree (a frozenset). callers that ask about many
+# subtrees of one tree pass a dict as cache: id(node) -> (node, names), the
+# node is kept in the entry so that its id can't be reused while cached
+def free_vars(tree, cache=None):
+    if not isinstance(tree, tuple):
+        return frozenset()
+    if cache is None:
+        return free_vars_walk(tree)
+    stack = [(tree, False)]
+    while stack:
+        node, ready = stack.pop()
+        if id(node) in cache:
+            continue
+        if node[0] == 'var':
+            cache[id(node)] = (node, frozenset([node[1]]))
+        elif ready:
+            names = set()
+            for child, bound in scoped_children(node):
+                if not isinstance(child, tuple):
+                    continue  # a number, as the body of a lambda or let
+                child_names = cache[id(child)][1]
+                names.update(child_names - {bound} if bound in child_names else child_names)
+            cache[id(node)] = (node, frozenset(names))
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child, _ in scoped_children(node) if isinstance(child, tuple))
+    return cache[id(tree)][1]
+
+# free_vars without a cache: one walk, with the names bound on the way
+def free_vars_walk(tree):
+    names = set()
+    stack = [(tree, ())]
+    while stack:
+        node, bound = stack.pop()
+        if node[0] == 'var':
+            if node[1] not in bound:
+                names.add(node[1])
+            continue
+        for child, binder in scoped_children(node):
+            if isinstance(child, tuple):
+                stack.append((child, bound if binder is None else (*bound, binder)))
+    return frozenset(names)
+
 # for beta reduction (capture-avoiding substitution)
-def substitute(tree, name, replacement):
-    if isinstance(tree, (float, int)):
+# subtrees in which name doesn't occur free are returned as they are, and a
+# binder is only renamed when name occurs under it and the replacement
+# mentions the name it binds. captured holds the free variables of the
+# replacement once they are needed: they are only computed when a binder is
+# crossed that has name under it, and not at all for numbers and lists
+def substitute(tree, name, replacement, captured=None):
+    if not isinstance(tree, tuple):
         return tree
-        
-    if isinstance(tree, tuple):
-        if tree[0] == 'var':
-            if tree[1] == name:
-                return replacement
+    tag = tree[0]
+
+    if tag == 'var':
+        return replacement if tree[1] == name else tree
+
+    if captured is None:
+        captured = []
+
+    if tag in ['lam', 'fix-lam']:
+        if tree[1] == name:
             return tree
-            
-        elif tree[0] == 'lam':
-            if tree[1] == name:
-                # Don't substitute if the lambda binds the same name
-                return tree
-            elif isinstance(replacement, tuple) and replacement[0] == 'var':
-                # If replacing with a variable, proceed normally
-                body = substitute(tree[2], name, replacement)
-                return ('lam', tree[1], body)
-            else:
-                # If replacing with a value, substitute directly
-                body = substitute(tree[2], name, replacement)
-                return ('lam', tree[1], body)
-                
-        elif tree[0] in ['app', 'plus', 'minus', 'multiply', 'cons']:
-            return (tree[0], substitute(tree[1], name, replacement), 
-                   substitute(tree[2], name, replacement))
-            
-        elif tree[0] == 'negation':
-            return (tree[0], substitute(tree[1], name, replacement))
-            
-        elif tree[0] == 'number':
+        body = substitute(tree[2], name, replacement, captured)
+        if body is tree[2]:
             return tree
-            
-        elif tree[0] == 'let':
-            if tree[1] == name:
-                return tree
-            return ('let', tree[1], 
-                    substitute(tree[2], name, replacement),
-                    substitute(tree[3], name, replacement))
+        if is_captured(tree[1], replacement, captured):
+            binder, scope = rename(tree[1], [tree[2]])
+            return (tag, binder, substitute(scope[0], name, replacement, captured))
+        return (tag, tree[1], body)
 
-        elif tree[0] == 'rec':
-            if tree[1] == name:
-                return tree
-            return ('rec', tree[1],
-                    substitute(tree[2], name, replacement),
-                    substitute(tree[3], name, replacement))
+    elif tag == 'let':
+        value = substitute(tree[2], name, replacement, captured)
+        body = tree[3]
+        binder = tree[1]
+        if binder != name:
+            body = substitute(tree[3], name, replacement, captured)
+            if body is not tree[3] and is_captured(binder, replacement, captured):
+                binder, scope = rename(binder, [tree[3]])
+                body = substitute(scope[0], name, replacement, captured)
+        if value is tree[2] and body is tree[3]:
+            return tree
+        return ('let', binder, value, body)
 
-        elif tree[0] == 'fix':
-            return ('fix', substitute(tree[1], name, replacement))
-        
-        elif tree[0] == 'if':
-            return ('if',
-                    substitute(tree[1], name, replacement),
-                    substitute(tree[2], name, replacement),
-                    substitute(tree[3], name, replacement))
-        
-        elif tree[0] in ['eq', 'lt', 'gt', 'le', 'ge']:
-            return (tree[0],
-                    substitute(tree[1], name, replacement),
-                    substitute(tree[2], name, replacement))
-    
+    elif tag == 'rec':
+        if tree[1] == name:
+            return tree
+        value = substitute(tree[2], name, replacement, captured)
+        body = substitute(tree[3], name, replacement, captured)
+        if value is tree[2] and body is tree[3]:
+            return tree
+        if is_captured(tree[1], replacement, captured):
+            binder, scope = rename(tree[1], [tree[2], tree[3]])
+            return ('rec', binder,
+                    substitute(scope[0], name, replacement, captured),
+                    substitute(scope[1], name, replacement, captured))
+        return ('rec', tree[1], value, body)
+
+    if len(tree) == 3:
+        left = substitute(tree[1], name, replacement, captured)
+        right = substitute(tree[2], name, replacement, captured)
+        if left is tree[1] and right is tree[2]:
+            return tree
+        return (tag, left, right)
+    children = [substitute(child, name, replacement, captured) for child in tree[1:]]
+    if all(new is old for new, old in zip(children, tree[1:])):
+        return tree
+    return (tag, *children)
+
+# true if binder occurs free in replacement. captured keeps the free
+# variables of replacement for the next binder
+def is_captured(binder, replacement, captured):
+    if not isinstance(replacement, tuple) or replacement[0] in ('nil', 'vec'):
+        return False
+    if not captured:
+        captured.append(free_vars(replacement))
+    return binder in captured[0]
+
+# \y.x [y/x] --> \z.y: binder renamed to a fresh name in the trees it scopes over
+def rename(binder, scope):
+    fresh_name = name_generator.generate()
+    return fresh_name, [substitute(tree, binder, ('var', fresh_name)) for tree in scope]
+
+# the built-in list functions of primitives.py are predefined names, not
+# keywords: an application of a free length, sum, range, map or foldl to all
+# of its arguments is computed by primitives.py, and a program can still bind
+# these names to functions of its own. the engines call apply_primitive
+# where an application would otherwise stay symbolic. enter(function, value)
+# applies a function of the engine, cons builds the resulting lists
+PRIMITIVE_NAMES = {'length', 'sum', 'range', 'map', 'foldl'}
+
+def apply_primitive(function, argument, enter, cons=None):
+    head = function
+    for _ in range(2):
+        if isinstance(head, tuple) and head[0] == 'app' and len(head) == 3:
+            head = head[1]
+    if not (isinstance(head, tuple) and head[0] == 'var' and head[1] in PRIMITIVE_NAMES):
+        return None
+    import primitives
+    return primitives.apply(function, argument, enter, cons or make_cons)
+
+def enter_lam(function, value):
+    return evaluate(substitute(function[2], function[1], value))
+
+def cons_cell(head, tail):
+    return ('cons', head, tail)
+
+def enter_closure(function, value):
+    return evaluate_env(function[2], [function[1], value, function[3], False])
+
+def enter_stack(function, value):
+    return evaluate_stack(function[2], [function[1], value, function[3], False])
+
+# environment-based evaluation (CEK-style)
+# instead of copying the lambda body on every beta reduction, a lambda evaluates
+# to a closure ('closure', name, body, env) and application just extends env.
+# env is a chain of frames [name, value, parent, is_rec], None is the empty env.
+# frames are lists so that letrec/fix can tie the knot by patching the value.
+def lookup(env, name):
+    while env is not None:
+        if env[0] == name:
+            return env[1]
+        env = env[2]
+    return ('var', name)  # free variables stay symbolic, as in evaluate
+
+# tail positions continue the loop like in evaluate, so a loop written as a
+# tail-recursive letrec function runs in constant Python stack
+def evaluate_env(tree, env=None):
+    while True:
+        if stats is not None:
+            stats.count(tree)
+        if isinstance(tree, (float, int)):
+            return tree
+
+        if isinstance(tree, tuple):
+            if tree[0] == 'var':
+                return lookup(env, tree[1])
+
+            elif tree[0] == 'lam':
+                # the body is only evaluated once the closure is applied
+                return ('closure', tree[1], tree[2], env)
+
+            elif tree[0] == 'app':
+                if len(tree) == 2:
+                    tree = tree[1]
+                    continue
+                left = evaluate_env(tree[1], env)
+                right = evaluate_env(tree[2], env)
+                if isinstance(left, tuple) and left[0] == 'nil':
+                    return left
+                if isinstance(left, tuple) and left[0] == 'closure':
+                    if memo_table is not None:
+                        key = memo_table.key(left, right)
+                        if key is not None:
+                            result = memo_table.get(key)
+                            if result is None:
+                                result = evaluate_env(left[2], [left[1], right, left[3], False])
+                                memo_table.put(key, left, result)
+                            return result
+                    if stats is not None:
+                        stats.beta_reductions += 1
+                    # bind the argument without copying the body
+                    tree, env = left[2], [left[1], right, left[3], False]
+                    continue
+                result = apply_primitive(left, right, enter_closure)
+                if result is not None:
+                    return result
+                return ('app', left, right)
+
+            elif tree[0] == 'let':
+                value = evaluate_env(tree[2], env)
+                tree, env = tree[3], [tree[1], value, env, False]
+                continue
+
+            elif tree[0] == 'rec':
+                # the name refers to itself until the value is known
+                frame = [tree[1], ('var', tree[1]), env, True]
+                frame[1] = evaluate_env(tree[2], frame)
+                tree, env = tree[3], frame
+                continue
+
+            elif tree[0] == 'fix':
+                arg = evaluate_env(tree[1], env)
+                if isinstance(arg, tuple) and arg[0] == 'closure':
+                    # fix (\f.e) = e with f bound to the result itself
+                    frame = [arg[1], ('var', arg[1]), arg[3], True]
+                    frame[1] = evaluate_env(arg[2], frame)
+                    return frame[1]
+                return ('fix', arg)
+
+            elif tree[0] == 'if':
+                condition = evaluate_env(tree[1], env)
+                if isinstance(condition, tuple):
+                    return ('if', condition, quote(tree[2], env), quote(tree[3], env))
+                if condition:
+                    tree = tree[2]
+                else:
+                    tree = tree[3]
+                continue
+
+            elif tree[0] == 'number':
+                return tree[1]
+
+            elif tree[0] == 'nil':
+                return ('nil',)
+
+            elif tree[0] == 'negation':
+                value = evaluate_env(tree[1], env)
+                if isinstance(value, (float, int)):
+                    return -value
+                return ('negation', value)
+
+            elif tree[0] == 'hd':
+                lst = evaluate_env(tree[1], env)
+                if isinstance(lst, tuple):
+                    if lst[0] == 'cons':
+                        return lst[1]
+                    elif lst[0] == 'vec':
+                        return vec_head(lst)
+                    elif lst[0] == 'nil':
+                        return ('nil',)
+                return ('hd', lst)
+
+            elif tree[0] == 'tl':
+                lst = evaluate_env(tree[1], env)
+                if isinstance(lst, tuple):
+                    if lst[0] == 'cons':
+                        return lst[2]
+                    elif lst[0] == 'vec':
+                        return vec_tail(lst)
+                    elif lst[0] == 'nil':
+                        return ('nil',)
+                return ('tl', lst)
+
+            elif tree[0] == 'cons':
+                return make_cons(evaluate_env(tree[1], env), evaluate_env(tree[2], env))
+
+            elif tree[0] == 'seq':
+                return ('seq', evaluate_env(tree[1], env), evaluate_env(tree[2], env))
+
+            elif tree[0] == 'eq':
+                return values_equal(evaluate_env(tree[1], env), evaluate_env(tree[2], env))
+
+            elif tree[0] in BINARY_OPS:
+                left = evaluate_env(tree[1], env)
+                right = evaluate_env(tree[2], env)
+                if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+                    return BINARY_OPS[tree[0]](left, right)
+                return (tree[0], left, right)
+
+        return tree
+
+# arithmetic and comparisons on two numbers, same results as evaluate
+BINARY_OPS = {
+    'plus': lambda l, r: l + r,
+    'minus': lambda l, r: l - r,
+    'multiply': lambda l, r: l * r,
+    'lt': lambda l, r: l < r,
+    'gt': lambda l, r: l > r,
+    'le': lambda l, r: l <= r,
+    'ge': lambda l, r: l >= r,
+}
+
+# '==' on evaluated values, numbers compare by value and lists element-wise
+# (lazy list cells are forced as far as the comparison needs them, two vecs
+# of numbers are compared as a whole)
+def values_equal(left, right):
+    while True:
+        if hash_cons_table is not None:
+            equal = hash_cons_table.equal(left, right)
+            if equal is not None:
+                return equal
+        if isinstance(left, list):
+            left = force(left)
+        if isinstance(right, list):
+            right = force(right)
+        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+            return float(left == right)
+        if not (isinstance(left, tuple) and isinstance(right, tuple)):
+            return 0.0
+        if left[0] == 'nil' and right[0] == 'nil':
+            return 1.0
+        if left[0] == 'vec' and right[0] == 'vec':
+            if left[2] != right[2]:
+                return 0.0
+            if vec_numeric(left) and vec_numeric(right):
+                return float(left[1].items[:left[2]] == right[1].items[:right[2]])
+        if left[0] == 'vec':
+            left = ('cons', vec_head(left), vec_tail(left))
+        if right[0] == 'vec':
+            right = ('cons', vec_head(right), vec_tail(right))
+        if left[0] != 'cons' or right[0] != 'cons':
+            return 0.0
+        if values_equal(left[1], right[1]) == 0.0:
+            return 0.0
+        left, right = left[2], right[2]
+
+# hash-consing of evaluated lists.
+# cons cells whose head is a number or an interned cell and whose tail is nil
+# or an interned cell are interned: structurally equal cells are the same
+# object, so shared sublists are stored once and '==' on two interned values
+# is an identity check. cells holding anything else (closures, free variables)
+# are left alone, as '==' never considers those equal.
+# tuples can't be weakly referenced, so the table is bounded by clearing it
+# when it is full. cells interned before that are simply no longer interned:
+# they still work as lists and '==' compares them element by element.
+class HashConsTable:
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.nil = ('nil',)
+        self.cells = {}
+
+    # key of the cell (head, tail), or None if head or tail isn't interned
+    def key(self, head, tail):
+        if isinstance(tail, tuple) and tail[0] == 'nil':
+            tail = self.nil
+        elif not (isinstance(tail, tuple) and tail[0] == 'cons' and self.interned(tail)):
+            return None
+        if isinstance(head, (float, int)):
+            return ('number', head, id(tail))
+        if isinstance(head, tuple) and head[0] == 'cons' and self.interned(head):
+            return ('cell', id(head), id(tail))
+        return None
+
+    # constant time: the fields of a cell in the table were interned when it
+    # was added, and the table is cleared as a whole
+    def interned(self, value):
+        if isinstance(value, (float, int)) or value is self.nil:
+            return True
+        if isinstance(value, tuple) and value[0] == 'cons':
+            if isinstance(value[1], (float, int)):
+                key = ('number', value[1], id(value[2]))
+            else:
+                key = ('cell', id(value[1]), id(value[2]))
+            return self.cells.get(key) is value
+        return False
+
+    def cons(self, head, tail):
+        key = self.key(head, tail)
+        if key is None:
+            return ('cons', head, tail)
+        cell = self.cells.get(key)
+        if cell is None:
+            if len(self.cells) >= self.max_size:
+                # head and tail are no longer interned after this
+                self.cells.clear()
+                return ('cons', head, tail)
+            if isinstance(head, (float, int)):
+                head = self.cells.setdefault(('number', head), head)
+            if tail[0] == 'nil':
+                tail = self.nil
+            cell = ('cons', head, tail)
+            self.cells[key] = cell
+        return cell
+
+    # 1.0 or 0.0 if '==' can be decided by identity, otherwise None
+    def equal(self, left, right):
+        if isinstance(left, tuple) and left[0] == 'nil':
+            left = self.nil
+        if isinstance(right, tuple) and right[0] == 'nil':
+            right = self.nil
+        if isinstance(left, (float, int)) or isinstance(right, (float, int)):
+            return None
+        if self.interned(left) and self.interned(right):
+            return float(left is right)
+        return None
+
+# the table used by the env and stack engines, None disables hash-consing
+hash_cons_table = None
+
+def make_cons(head, tail):
+    if array_lists:
+        return array_cons(head, tail)
+    if hash_cons_table is None:
+        return ('cons', head, tail)
+    return hash_cons_table.cons(head, tail)
+
+# array-backed lists.
+# a fully evaluated list is ('vec', buffer, length): its elements are
+# buffer.items[length - 1], ..., buffer.items[0], so the head is the last item
+# of the buffer and the tail is the same buffer with length - 1. lists sharing
+# a tail share its buffer: consing onto the longest list of a buffer appends
+# to it in place, consing onto a shorter one copies the part it uses. the
+# items a list uses are never changed, so lists stay persistent.
+# buffer.numeric counts the leading items that are numbers, a list of at most
+# that length holds only numbers and is compared and printed in bulk.
+# a cons onto anything but nil or a vec (an improper list such as 1:2, or a
+# symbolic tail) is an ordinary cons cell.
+class ListBuffer:
+    __slots__ = ('items', 'numeric')
+
+    def __init__(self, items):
+        self.items = items
+        self.numeric = 0
+        while self.numeric < len(items) and isinstance(items[self.numeric], (float, int)):
+            self.numeric += 1
+
+# used instead of cons cells by the env, stack, compiled and vm engines when true
+array_lists = False
+
+def array_cons(head, tail):
+    if isinstance(tail, tuple) and tail[0] == 'vec':
+        buffer, length = tail[1], tail[2]
+        if len(buffer.items) == length:
+            buffer.items.append(head)
+            if buffer.numeric == length and isinstance(head, (float, int)):
+                buffer.numeric += 1
+            return ('vec', buffer, length + 1)
+        return ('vec', ListBuffer(buffer.items[:length] + [head]), length + 1)
+    if isinstance(tail, tuple) and tail[0] == 'nil':
+        return ('vec', ListBuffer([head]), 1)
+    return ('cons', head, tail)
+
+def vec_head(lst):
+    return lst[1].items[lst[2] - 1]
+
+def vec_tail(lst):
+    if lst[2] == 1:
+        return ('nil',)
+    return ('vec', lst[1], lst[2] - 1)
+
+# the elements of a vec, head first
+def vec_items(lst):
+    return lst[1].items[lst[2] - 1::-1]
+
+def vec_numeric(lst):
+    return lst[2] <= lst[1].numeric
+
+# the same list as nested cons cells
+def vec_to_cells(lst):
+    cells = ('nil',)
+    for item in lst[1].items[:lst[2]]:
+        cells = ('cons', item, cells)
+    return cells
+
+# memoization of function applications (env and stack engines).
+# the language has no side effects, so applying the same function to the
+# same argument always gives the same result. an application is looked up
+# when the argument is data (numbers and lists of data) and the function's
+# free variables are bound to data or by letrec, which is what makes a
+# function like fib or fact "closed" here. the key is the function's body,
+# the keys of its free variables (a letrec binding by the identity of its
+# frame) and the key of the argument. the table keeps the closure with the
+# result, so the frames whose identities are in its key stay alive.
+# a list is keyed by a number for its contents: equal lists get the same
+# number, and each cons cell (or vec prefix) gets it once and keeps it, so
+# a recursion down a list doesn't copy the rest of the list on every call.
+# like HashConsTable, the numbering is bounded by clearing it (with the
+# entries, whose keys use it) when it is full.
+# a memoized application is no longer a tail call.
+class MemoTable:
+    def __init__(self, max_size=10000, max_cells=100000):
+        self.max_size = max_size
+        self.max_cells = max_cells
+        self.entries = collections.OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.free_var_cache = {}  # of the function bodies, see free_vars
+        self.list_numbers = {}  # (key of the head, number of the tail) -> number, # is 0
+        self.cell_numbers = {}  # id of a cons cell -> (cell, number)
+        self.vec_numbers = {}  # id of a ListBuffer -> (buffer, numbers of its prefixes)
+
+    # hashable key of an application, or None if it can't be memoized
+    def key(self, closure, argument):
+        if len(self.list_numbers) > self.max_cells:
+            self.list_numbers.clear()
+            self.cell_numbers.clear()
+            self.vec_numbers.clear()
+            self.entries.clear()
+        argument_key = self.data_key(argument)
+        if argument_key is None:
+            return None
+        body, name = closure[2], closure[1]
+        free = []
+        for free_name in sorted(free_vars(body, self.free_var_cache) - {name}):
+            frame = closure[3]
+            while frame is not None and frame[0] != free_name:
+                frame = frame[2]
+            if frame is None:
+                free.append((free_name, None))  # stays symbolic
+            elif frame[3]:
+                free.append((free_name, 'rec', id(frame)))
+            else:
+                value_key = self.data_key(frame[1])
+                if value_key is None:
+                    return None
+                free.append((free_name, value_key))
+        return (id(body), name, tuple(free), argument_key)
+
+    # hashable form of a value made of numbers and lists, None for anything else
+    def data_key(self, value):
+        if isinstance(value, (float, int)):
+            return value
+        number = self.list_number(value)
+        return None if number is None else ('list', number)
+
+    def list_number(self, value):
+        cells = []  # the cells not numbered yet, outermost first
+        while True:
+            if not isinstance(value, tuple):
+                return None
+            if value[0] == 'nil':
+                number = 0
+                break
+            if value[0] == 'vec':
+                number = self.vec_number(value)
+                if number is None:
+                    return None
+                break
+            if value[0] != 'cons':
+                return None
+            known = self.cell_numbers.get(id(value))
+            if known is not None:
+                number = known[1]
+                break
+            cells.append(value)
+            value = value[2]
+        for cell in reversed(cells):
+            head = self.data_key(cell[1])
+            if head is None:
+                return None
+            number = self.list_numbers.setdefault((head, number), len(self.list_numbers) + 1)
+            self.cell_numbers[id(cell)] = (cell, number)
+        return number
+
+    # the prefixes of a buffer never change, so their numbers are kept by length
+    def vec_number(self, value):
+        buffer, length = value[1], value[2]
+        entry = self.vec_numbers.get(id(buffer))
+        if entry is None:
+            entry = self.vec_numbers[id(buffer)] = (buffer, [0])
+        numbers = entry[1]
+        while len(numbers) <= length:
+            head = self.data_key(buffer.items[len(numbers) - 1])
+            if head is None:
+                return None
+            numbers.append(self.list_numbers.setdefault((head, numbers[-1]), len(self.list_numbers) + 1))
+        return numbers[length]
+
+    # the result stored for key, or None (results are never None)
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, closure, result):
+        self.entries[key] = (closure, result)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'max_size': self.max_size}
+
+# the table used by the env and stack engines, None disables memoization
+memo_table = None
+
+# put the values bound in env back into a term (used for residual terms)
+# letrec bindings are left as free names, reading them back would not terminate.
+# only names that occur free in tree are read back, so unused (lazy) bindings
+# are never forced. substitute renames the binders of tree that a value
+# mentions, so the free names of the values are not captured
+def quote(tree, env):
+    names = set(free_vars(tree))
+    while env is not None and names:
+        name = env[0]
+        if name in names:
+            names.discard(name)
+            if not env[3]:
+                tree = substitute_iter(tree, name, readback(env[1], cells=True))
+        env = env[2]
+    return tree
+
+# convert an evaluated value back to an AST that linearize understands
+# closures are turned into lambdas and normalized the same way evaluate does.
+# iterative like linearize, tuples without closures inside are kept as they are.
+# vecs of numbers are kept too, unless cells is true (for terms that evaluate
+# will see again), other vecs become cons cells
+def readback(value, cells=False):
+    results = []
+    stack = [(value, False)]
+    while stack:
+        node, built = stack.pop()
+        if built:
+            items = results[-len(node):]
+            del results[-len(node):]
+            if all(new is old for new, old in zip(items, node)):
+                results.append(node)
+            else:
+                results.append(tuple(items))
+        elif isinstance(node, list):
+            stack.append((force(node), False))
+        elif isinstance(node, tuple) and node[0] == 'closure':
+            results.append(evaluate(quote(('lam', node[1], node[2]), node[3])))
+        elif isinstance(node, tuple) and node[0] == 'vec':
+            if vec_numeric(node) and not cells:
+                results.append(node)
+            else:
+                stack.append((vec_to_cells(node), False))
+        elif isinstance(node, tuple):
+            stack.append((node, True))
+            stack.extend((item, False) for item in reversed(node))
+        else:
+            results.append(node)
+    return results[0]
+
+def evaluate_closures(tree):
+    return readback(evaluate_env(tree))
+
+# positions of the subtrees substitute_iter descends into, None for leaves
+# and for binders that shadow name
+def substituted_children(tree, name):
+    if not isinstance(tree, tuple) or tree[0] == 'var':
+        return None
+    if tree[0] in ['lam', 'fix-lam']:
+        return None if tree[1] == name else (2,)
+    if tree[0] == 'let':
+        return (2,) if tree[1] == name else (2, 3)
+    if tree[0] == 'rec':
+        return None if tree[1] == name else (2, 3)
+    return range(1, len(tree))
+
+# substitute with an explicit work stack instead of recursion, for the deep
+# terms quote builds. the same results and fresh names as substitute
+def substitute_iter(tree, name, replacement, captured=None):
+    if captured is None:
+        captured = []
+    results = []
+    stack = [(tree, False)]
+    while stack:
+        tree, built = stack.pop()
+        children = substituted_children(tree, name)
+        if built:
+            new_children = results[len(results) - len(children):]
+            del results[len(results) - len(children):]
+            results.append(rebuild(tree, children, new_children, name, replacement, captured))
+        elif children is not None:
+            stack.append((tree, True))
+            stack.extend((tree[position], False) for position in reversed(children))
+        elif isinstance(tree, tuple) and tree[0] == 'var' and tree[1] == name:
+            results.append(replacement)
+        else:
+            results.append(tree)
+    return results[0]
+
+# tree with its substituted children in place. a binder the replacement
+# mentions is renamed and its scope substituted again, as substitute does
+def rebuild(tree, children, new_children, name, replacement, captured):
+    if all(new is tree[position] for position, new in zip(children, new_children)):
+        return tree
+    tag = tree[0]
+    if tag in ['lam', 'fix-lam', 'let', 'rec'] and tree[1] != name:
+        scoped = {'lam': (2,), 'fix-lam': (2,), 'let': (3,), 'rec': (2, 3)}[tag]
+        if any(new_children[position - 2] is not tree[position] for position in scoped) \
+                and is_captured(tree[1], replacement, captured):
+            binder = name_generator.generate()
+            new_tree = [tag, binder, *tree[2:]]
+            for position in scoped:
+                renamed = substitute_iter(tree[position], tree[1], ('var', binder))
+                new_tree[position] = substitute_iter(renamed, name, replacement, captured)
+            if tag == 'let':
+                new_tree[2] = new_children[0]
+            return tuple(new_tree)
+    new_tree = list(tree)
+    for position, new in zip(children, new_children):
+        new_tree[position] = new
+    return tuple(new_tree)
+
+# stack-safe environment-based evaluation: a CEK machine.
+# evaluate_env recurses once per AST level, here the pending work is kept in
+# an explicit list of continuation frames, so the depth of the program (or of
+# the recursion it performs) is limited by memory instead of the C stack.
+# evaluation of tail positions (if branches, let bodies, function bodies)
+# pushes no frame at all.
+def evaluate_stack(tree, env=None):
+    stack = []
+    while True:
+        # descend into tree until it produces a value
+        while True:
+            if stats is not None:
+                stats.step(tree, len(stack))
+            if isinstance(tree, tuple):
+                tag = tree[0]
+                if tag == 'var':
+                    value = lookup(env, tree[1])
+                elif tag == 'lam':
+                    value = ('closure', tree[1], tree[2], env)
+                elif tag == 'app':
+                    if len(tree) == 2:
+                        tree = tree[1]
+                        continue
+                    stack.append(('app-arg', tree[2], env))
+                    tree = tree[1]
+                    continue
+                elif tag == 'let':
+                    stack.append(('let', tree[1], tree[3], env))
+                    tree = tree[2]
+                    continue
+                elif tag == 'rec':
+                    env = [tree[1], ('var', tree[1]), env, True]
+                    stack.append(('rec', env, tree[3]))
+                    tree = tree[2]
+                    continue
+                elif tag == 'if':
+                    stack.append(('if', tree, env))
+                    tree = tree[1]
+                    continue
+                elif tag in ['fix', 'negation', 'hd', 'tl']:
+                    stack.append((tag,))
+                    tree = tree[1]
+                    continue
+                elif tag in ['cons', 'seq', 'eq'] or tag in BINARY_OPS:
+                    stack.append(('right', tag, tree[2], env))
+                    tree = tree[1]
+                    continue
+                elif tag == 'number':
+                    value = tree[1]
+                elif tag == 'nil':
+                    value = ('nil',)
+                else:
+                    value = tree
+            else:
+                value = tree
+            break
+
+        # pass the value to the pending frames until one of them needs
+        # another subtree evaluated
+        while stack:
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == 'right':
+                stack.append(('combine', frame[1], value))
+                tree, env = frame[2], frame[3]
+                break
+            elif kind == 'combine':
+                tag, left = frame[1], frame[2]
+                if tag == 'cons':
+                    value = make_cons(left, value)
+                elif tag == 'seq':
+                    value = ('seq', left, value)
+                elif tag == 'eq':
+                    value = values_equal(left, value)
+                elif isinstance(left, (float, int)) and isinstance(value, (float, int)):
+                    value = BINARY_OPS[tag](left, value)
+                else:
+                    value = (tag, left, value)
+            elif kind == 'app-arg':
+                stack.append(('app-call', value))
+                tree, env = frame[1], frame[2]
+                break
+            elif kind == 'app-call':
+                left = frame[1]
+                if isinstance(left, tuple) and left[0] == 'nil':
+                    value = left
+                elif isinstance(left, tuple) and left[0] == 'closure':
+                    key = memo_table.key(left, value) if memo_table is not None else None
+                    if key is not None:
+                        result = memo_table.get(key)
+                        if result is not None:
+                            value = result
+                            continue
+                        stack.append(('memo', key, left))
+                    if stats is not None:
+                        stats.beta_reductions += 1
+                    tree, env = left[2], [left[1], value, left[3], False]
+                    break
+                else:
+                    result = apply_primitive(left, value, enter_stack)
+                    value = ('app', left, value) if result is None else result
+            elif kind == 'memo':
+                memo_table.put(frame[1], frame[2], value)
+            elif kind == 'let':
+                tree, env = frame[2], [frame[1], value, frame[3], False]
+                break
+            elif kind == 'rec':
+                frame[1][1] = value
+                tree, env = frame[2], frame[1]
+                break
+            elif kind == 'if':
+                if_tree, if_env = frame[1], frame[2]
+                if isinstance(value, tuple):
+                    value = ('if', value, quote(if_tree[2], if_env), quote(if_tree[3], if_env))
+                else:
+                    tree, env = (if_tree[2] if value else if_tree[3]), if_env
+                    break
+            elif kind == 'fix':
+                if isinstance(value, tuple) and value[0] == 'closure':
+                    env = [value[1], ('var', value[1]), value[3], True]
+                    stack.append(('fixed', env))
+                    tree = value[2]
+                    break
+                value = ('fix', value)
+            elif kind == 'fixed':
+                frame[1][1] = value
+            elif kind == 'negation':
+                if not isinstance(value, (float, int)):
+                    value = ('negation', value)
+                else:
+                    value = -value
+            elif kind in ['hd', 'tl']:
+                if isinstance(value, tuple) and value[0] == 'cons':
+                    value = value[1] if kind == 'hd' else value[2]
+                elif isinstance(value, tuple) and value[0] == 'vec':
+                    value = vec_head(value) if kind == 'hd' else vec_tail(value)
+                elif not (isinstance(value, tuple) and value[0] == 'nil'):
+                    value = (kind, value)
+        else:
+            return value
+
+def evaluate_stack_program(tree):
+    return readback(evaluate_stack(tree))
+
+# call-by-need evaluation.
+# arguments, let/letrec bindings and the fields of cons cells are not
+# evaluated but delayed as thunks, lists ['thunk', tree, env, name].
+# the first time a thunk's value is needed it is evaluated and updated in
+# place to ['done', value], so every later use shares the result.
+# while being evaluated it is marked 'busy'; needing it again then means a
+# value defined in terms of itself, which stays symbolic like in evaluate_env.
+# name is the variable the thunk is bound to, if any.
+def delay(tree, env, name=None):
+    if isinstance(tree, tuple):
+        if tree[0] == 'var':
+            return lookup(env, tree[1])  # share the thunk the variable is bound to
+        if tree[0] == 'lam':
+            return ('closure', tree[1], tree[2], env)
+        if tree[0] == 'number':
+            return tree[1]
+        if tree[0] == 'nil':
+            return ('nil',)
+        return ['thunk', tree, env, name]
     return tree
 
+# value of a thunk, evaluated at most once
+def force(thunk):
+    if thunk[0] == 'thunk':
+        thunk[0] = 'busy'
+        value = evaluate_lazy(thunk[1], thunk[2])
+        thunk[:] = ['done', value]
+    elif thunk[0] == 'busy':
+        return ('var', thunk[3])
+    return thunk[1]
+
+# the same machine as evaluate_stack, except that delayed values are only
+# evaluated where they are needed: in function position, in conditions,
+# as operands of arithmetic, comparisons, hd and tl, and as the result.
+# forcing a thunk pushes an 'update' frame that stores the value in it.
+def evaluate_lazy(tree, env=None):
+    stack = []
+    while True:
+        # descend into tree until it produces a value
+        while True:
+            if stats is not None:
+                stats.step(tree, len(stack))
+            if isinstance(tree, tuple):
+                tag = tree[0]
+                if tag == 'var':
+                    value = lookup(env, tree[1])
+                elif tag == 'lam':
+                    value = ('closure', tree[1], tree[2], env)
+                elif tag == 'app':
+                    if len(tree) == 2:
+                        tree = tree[1]
+                        continue
+                    stack.append(('app-call', delay(tree[2], env)))
+                    tree = tree[1]
+                    continue
+                elif tag == 'let':
+                    env = [tree[1], delay(tree[2], env, tree[1]), env, False]
+                    tree = tree[3]
+                    continue
+                elif tag == 'rec':
+                    # the binding's thunk is evaluated in the frame that holds it
+                    env = [tree[1], None, env, True]
+                    env[1] = delay(tree[2], env, tree[1])
+                    tree = tree[3]
+                    continue
+                elif tag == 'if':
+                    stack.append(('if', tree, env))
+                    tree = tree[1]
+                    continue
+                elif tag in ['fix', 'negation', 'hd', 'tl']:
+                    stack.append((tag,))
+                    tree = tree[1]
+                    continue
+                elif tag in ['cons', 'seq']:
+                    value = (tag, delay(tree[1], env), delay(tree[2], env))
+                elif tag == 'eq' or tag in BINARY_OPS:
+                    stack.append(('right', tag, tree[2], env))
+                    tree = tree[1]
+                    continue
+                elif tag == 'number':
+                    value = tree[1]
+                elif tag == 'nil':
+                    value = ('nil',)
+                else:
+                    value = tree
+            else:
+                value = tree
+            break
+
+        # pass the value to the pending frames until one of them needs
+        # another subtree (or a thunk) evaluated
+        while True:
+            if isinstance(value, list):
+                if value[0] == 'done':
+                    value = value[1]
+                    continue
+                if value[0] == 'busy':
+                    value = ('var', value[3])
+                    continue
+                stack.append(('update', value))
+                tree, env = value[1], value[2]
+                value[0] = 'busy'
+                break
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == 'update':
+                frame[1][:] = ['done', value]
+            elif kind == 'right':
+                stack.append(('combine', frame[1], value))
+                tree, env = frame[2], frame[3]
+                break
+            elif kind == 'combine':
+                tag, left = frame[1], frame[2]
+                if tag == 'eq':
+                    value = values_equal(left, value)
+                elif isinstance(left, (float, int)) and isinstance(value, (float, int)):
+                    value = BINARY_OPS[tag](left, value)
+                else:
+                    value = (tag, left, value)
+            elif kind == 'app-call':
+                argument = frame[1]
+                if isinstance(value, tuple) and value[0] == 'closure':
+                    tree, env = value[2], [value[1], argument, value[3], False]
+                    break
+                elif not (isinstance(value, tuple) and value[0] == 'nil'):
+                    result = apply_lazy_primitive(value, argument)
+                    value = ('app', value, argument) if result is None else result
+            elif kind == 'if':
+                if_tree, if_env = frame[1], frame[2]
+                if isinstance(value, tuple):
+                    value = ('if', value, quote(if_tree[2], if_env), quote(if_tree[3], if_env))
+                else:
+                    tree, env = (if_tree[2] if value else if_tree[3]), if_env
+                    break
+            elif kind == 'fix':
+                if isinstance(value, tuple) and value[0] == 'closure':
+                    # one shared thunk for the self reference
+                    self_frame = [value[1], None, value[3], True]
+                    self_frame[1] = ['thunk', value[2], self_frame, value[1]]
+                    value = self_frame[1]
+                else:
+                    value = ('fix', value)
+            elif kind == 'negation':
+                if not isinstance(value, (float, int)):
+                    value = ('negation', value)
+                else:
+                    value = -value
+            elif kind in ['hd', 'tl']:
+                if isinstance(value, tuple) and value[0] == 'cons':
+                    value = value[1] if kind == 'hd' else value[2]
+                elif not (isinstance(value, tuple) and value[0] == 'nil'):
+                    value = (kind, value)
+
+def evaluate_lazy_program(tree):
+    return readback(evaluate_lazy(tree))
+
+def enter_lazy(function, value):
+    return evaluate_lazy(function[2], [function[1], value, function[3], False])
+
+# the built-ins take evaluated data: when one is applied to all of its
+# arguments, they are forced, lists included, and given to apply_primitive
+def apply_lazy_primitive(function, argument):
+    arguments = [argument]
+    head = function
+    while isinstance(head, tuple) and head[0] == 'app' and len(head) == 3 and len(arguments) < 3:
+        arguments.append(head[2])
+        head = head[1]
+    if not (isinstance(head, tuple) and head[0] == 'var' and head[1] in PRIMITIVE_NAMES):
+        return None
+    import primitives
+    if primitives.ARITY[head[1]] != len(arguments):
+        return None
+    for value in reversed(arguments[1:]):
+        head = ('app', head, force_data(value))
+    return apply_primitive(head, force_data(argument), enter_lazy, cons_cell)
+
+# value with its thunks forced, in the cells of lists too. iterative along
+# the tails, so long lists don't hit the recursion limit. a cell counts as a
+# step: a list defined in terms of itself never ends, like length would
+def force_data(value):
+    if isinstance(value, list):
+        value = force(value)
+    heads = []
+    while isinstance(value, tuple) and value[0] == 'cons':
+        if stats is not None:
+            stats.tick()
+        heads.append(force_data(value[1]))
+        value = force(value[2]) if isinstance(value[2], list) else value[2]
+    for head in reversed(heads):
+        value = ('cons', head, value)
+    return value
+
+# closure_compiler.py imports this module, so it is only imported when used
+def evaluate_compiled(tree):
+    import closure_compiler
+    return closure_compiler.evaluate_compiled(tree)
+
+# vm.py imports this module too
+def evaluate_vm(tree):
+    import vm
+    return vm.evaluate_vm(tree)
+
+ENGINES = {
+    'subst': evaluate,
+    'env': evaluate_closures,
+    'stack': evaluate_stack_program,
+    'nodes': nodes.evaluate_tuple,
+    'lazy': evaluate_lazy_program,
+    'compiled': evaluate_compiled,
+    'vm': evaluate_vm,
+}
+
+# the limits of Stats each engine enforces. the nodes and compiled engines
+# evaluate with Python recursion and allocate without counting, the vm
+# counts the depth of its own call stack
+ENGINE_LIMITS = {
+    'subst': {'steps', 'depth', 'nodes', 'seconds'},
+    'env': {'steps', 'depth', 'nodes', 'seconds'},
+    'stack': {'steps', 'depth', 'nodes', 'seconds'},
+    'lazy': {'steps', 'depth', 'nodes', 'seconds'},
+    'nodes': {'steps', 'seconds'},
+    'compiled': {'steps', 'seconds'},
+    'vm': {'steps', 'depth', 'seconds'},
+}
+
+# ValueError if engine can't enforce one of the limits that are set
+def check_limits(engine, max_steps=None, max_depth=None, max_nodes=None, max_seconds=None):
+    limits = {'steps': max_steps, 'depth': max_depth, 'nodes': max_nodes, 'seconds': max_seconds}
+    unsupported = [name for name, limit in limits.items() if limit and name not in ENGINE_LIMITS[engine]]
+    if unsupported:
+        raise ValueError(f"the {engine} engine can't limit " + " or ".join(unsupported) +
+                         ", it supports --max-" + ", --max-".join(sorted(ENGINE_LIMITS[engine])))
+
+# result of one program of a batch: result is the linearized output, or None
+# if evaluating it failed, in which case error describes the exception
+BatchResult = collections.namedtuple('BatchResult', ['index', 'source', 'result', 'error', 'seconds'])
+
+# limits holds max_ arguments for interpret
+def interpret_one(job):
+    index, source_code, engine, limits = job
+    start = time.perf_counter()
+    try:
+        result, error = interpret(source_code, engine=engine, **limits), None
+    except Exception as e:  # includes RecursionError and lark's parse errors
+        result, error = None, f"{type(e).__name__}: {e}"
+    return BatchResult(index, source_code, result, error, time.perf_counter() - start)
+
+# build the parser once per worker process, before its first program
+def init_worker():
+    get_parser()
+
+# evaluate many independent programs on a pool of worker processes.
+# yields a BatchResult per program as soon as it is available: in input order
+# if ordered is true, otherwise in the order they complete. a failing program
+# doesn't stop the batch, its BatchResult carries the error instead.
+# workers defaults to the number of CPUs, with workers=1 everything runs in
+# this process.
+def interpret_many(programs, workers=None, chunksize=1, engine='subst', ordered=True, limits=None):
+    jobs = ((index, source_code, engine, limits or {}) for index, source_code in enumerate(programs))
+    if workers == 1:
+        yield from map(interpret_one, jobs)
+        return
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+        if ordered:
+            yield from pool.imap(interpret_one, jobs, chunksize)
+        else:
+            yield from pool.imap_unordered(interpret_one, jobs, chunksize)
+
+# the top-level segments of a 'a ;; b ;; c' program share no bindings, so
+# they can be evaluated side by side. while parallel_segments is not None,
+# interpret and the command line evaluate them on a pool of that many worker
+# processes (0 for one per CPU). segments whose segment_cost
+# is below segment_threshold are evaluated in this process, while the pool
+# works on the others. the segments are linearized where they are evaluated
+# and joined like linearize joins a 'seq', so the output is the same
+parallel_segments = None
+segment_threshold = 200
+RECURSION_COST = 1000  # a letrec or fix may run for any number of steps
+
+def segments(ast):
+    parts = []
+    while isinstance(ast, tuple) and ast[0] == 'seq':
+        parts.append(ast[1])
+        ast = ast[2]
+    parts.append(ast)
+    return parts
+
+# estimate of the work of evaluating tree: its size, plus RECURSION_COST per
+# letrec or fix
+def segment_cost(tree):
+    cost = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        cost += 1
+        if isinstance(node, tuple):
+            if node[0] in ('rec', 'fix'):
+                cost += RECURSION_COST
+            stack.extend(field for field in node[1:] if isinstance(field, tuple))
+    return cost
+
+def evaluate_segment(job):
+    tree, engine = job
+    return linearize(ENGINES[engine](tree))
+
+def interpret_segments(ast, engine='subst', workers=None, threshold=None):
+    threshold = segment_threshold if threshold is None else threshold
+    parts = segments(ast)
+    costly = [index for index, part in enumerate(parts) if segment_cost(part) >= threshold]
+    if len(costly) < 2:  # nothing to evaluate side by side
+        return linearize(ENGINES[engine](ast))
+    with multiprocessing.Pool(workers or None) as pool:
+        pending = {index: pool.apply_async(evaluate_segment, ((parts[index], engine),)) for index in costly}
+        # in order, so the first failing segment raises like it would in one process
+        results = [pending[index].get() if index in pending else evaluate_segment((part, engine))
+                   for index, part in enumerate(parts)]
+    return ' ;; '.join(results)
+
 def main():
-    input_arg = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description='Evaluate a lambda calculus program.')
+    arg_parser.add_argument('input', nargs='?', help="source code or a path to a .lc file")
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='subst',
+                            help="evaluation strategy: 'subst' rewrites terms, 'env' uses closures, "
+                                 "'stack' uses closures without recursion, "
+                                 "'nodes' rewrites terms on the compact AST in nodes.py, "
+                                 "'lazy' evaluates call-by-need, "
+                                 "'compiled' runs the program compiled to Python closures, "
+                                 "'vm' runs the program compiled to bytecode")
+    arg_parser.add_argument('--hash-cons', type=int, metavar='SIZE',
+                            help="intern evaluated lists (env and stack engines) in a table of at most SIZE entries")
+    arg_parser.add_argument('--array-lists', action='store_true',
+                            help="represent evaluated lists as arrays (env, stack, compiled and vm engines)")
+    arg_parser.add_argument('--memo', type=int, metavar='SIZE',
+                            help="memoize applications (env and stack engines) in a table of at most SIZE entries")
+    arg_parser.add_argument('--no-optimize', action='store_true',
+                            help="evaluate the program as parsed, without optimizer.py")
+    arg_parser.add_argument('--parallel', action='store_true',
+                            help="evaluate the top-level ';;' segments on --workers processes (default one per CPU)")
+    arg_parser.add_argument('--segment-threshold', type=int, metavar='COST',
+                            help="with --parallel, evaluate segments cheaper than COST (default 200) in the main process")
+    arg_parser.add_argument('--stats', action='store_true', help="print evaluation statistics to stderr")
+    arg_parser.add_argument('--stats-json', action='store_true', help="print evaluation statistics to stderr as JSON")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="run under cProfile and print the functions that took the most time to stderr")
+    arg_parser.add_argument('--max-steps', type=int, metavar='N', help="stop after evaluating N subterms")
+    arg_parser.add_argument('--max-depth', type=int, metavar='N', help="stop when the evaluation nests deeper than N")
+    arg_parser.add_argument('--max-nodes', type=int, metavar='N', help="stop after allocating about N nodes")
+    arg_parser.add_argument('--max-seconds', type=float, metavar='S', help="stop after S seconds of evaluation")
+    arg_parser.add_argument('--compile', action='store_true',
+                            help="write the parsed and optimized .lc file to a .lcc artifact instead of evaluating it")
+    arg_parser.add_argument('--disassemble', action='store_true',
+                            help="print the bytecode of the program instead of evaluating it")
+    arg_parser.add_argument('--verbose', action='store_true', help="print the Python and Lark versions")
+    arg_parser.add_argument('--serve', metavar='SOCKET', help="run an evaluation server on the Unix socket SOCKET")
+    arg_parser.add_argument('--connect', metavar='SOCKET', help="send the input to the server on SOCKET")
+    arg_parser.add_argument('--workers', type=int, help="number of worker processes of the server or of --parallel")
+    arg_parser.add_argument('--timeout', type=float, default=10.0, help="seconds the server waits for a result")
+    args = arg_parser.parse_args()
+    if args.serve:
+        import server
+        server.serve(args.serve, workers=args.workers, timeout=args.timeout)
+        return
+    if args.input is None:
+        arg_parser.error("the input is required")
+    input_arg = args.input
+    if args.verbose:
+        print(f"Python version: {sys.version}")
+        print(f"Lark version: {lark.__version__}")
+    if args.hash_cons:
+        global hash_cons_table
+        hash_cons_table = HashConsTable(args.hash_cons)
+    if args.array_lists:
+        global array_lists
+        array_lists = True
+    if args.no_optimize:
+        global optimizing
+        optimizing = False
+    if args.parallel:
+        global parallel_segments, segment_threshold
+        parallel_segments = args.workers or 0
+        if args.segment_threshold is not None:
+            segment_threshold = args.segment_threshold
+    if args.memo:
+        global memo_table
+        memo_table = MemoTable(args.memo)
     
+    if args.connect:
+        import server
+        if input_arg.endswith('.lc'):
+            response = server.request(args.connect, path=input_arg, engine=args.engine)
+        else:
+            response = server.request(args.connect, source=input_arg, engine=args.engine)
+        if response['error'] is not None:
+            print(f"Error: {response['error']}")
+        else:
+            print(f"\033[95m{response['result']}\033[0m")
+        return
+
+    if args.compile:
+        import artifact
+        if not input_arg.endswith('.lc'):
+            arg_parser.error("--compile needs a .lc file")
+        try:
+            print(f"wrote {artifact.compile_file(input_arg)}")
+        except FileNotFoundError:
+            print(f"Error: Could not find file '{input_arg}'")
+        return
+
+    # a .lcc artifact is loaded instead of parsed, see artifact.py
+    ast = None
+    input_code = None
+    if input_arg.endswith('.lcc'):
+        import artifact
+        try:
+            ast = artifact.load_artifact(input_arg)
+        except artifact.StaleArtifact as e:
+            print(f"Error: {e}")
+            return
     # Check if the input is a file path ending in .lc
-    if input_arg.endswith('.lc'):
+    elif input_arg.endswith('.lc'):
         try:
             with open(input_arg, 'r') as file:
                 input_code = file.read()
@@ -471,9 +2040,65 @@ def main():
     else:
         # Treat as direct command line input
         input_code = input_arg
-    
-    result = interpret(input_code)
-    print(f"\033[95m{result}\033[0m")
+
+    if args.disassemble:
+        import vm
+        print(vm.disassemble(vm.compile_program(load(input_code) if ast is None else ast)))
+        return
+
+    # only files are cached, one-off expressions would just fill the cache
+    use_cache = input_arg.endswith('.lc')
+    limits = {'max_steps': args.max_steps, 'max_depth': args.max_depth,
+              'max_nodes': args.max_nodes, 'max_seconds': args.max_seconds}
+    try:
+        check_limits(args.engine, **limits)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    if args.stats or args.stats_json or args.profile or any(limits.values()):
+        profile = None
+        if args.profile:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+        collected = None
+        try:
+            if args.stats or args.stats_json:
+                result, collected = interpret(input_code, engine=args.engine, use_cache=use_cache, stats=True,
+                                              ast=ast, **limits)
+            else:
+                result = interpret(input_code, engine=args.engine, use_cache=use_cache, ast=ast, **limits)
+        except BudgetExceeded as e:
+            print(f"Error: {e}")
+            if args.stats_json:
+                print(json.dumps(e.as_dict(), indent=2), file=sys.stderr)
+            elif args.stats:
+                print(e.stats.report(), file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if profile is not None:
+                profile.disable()
+        print(f"\033[95m{result}\033[0m")
+        if args.stats_json:
+            print(json.dumps(collected.as_dict(), indent=2), file=sys.stderr)
+        elif args.stats:
+            print(collected.report(), file=sys.stderr)
+        if profile is not None:
+            import pstats
+            pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+        return
+    if ast is None:
+        ast = load(input_code, use_cache)
+    if args.parallel:
+        print(f"\033[95m{interpret_segments(ast, args.engine, parallel_segments)}\033[0m")
+        return
+    result_ast = ENGINES[args.engine](ast)
+    # the result is written as it is linearized
+    sys.stdout.write("\033[95m")
+    write_linear(result_ast, sys.stdout)
+    sys.stdout.write("\033[0m\n")
 
 if __name__ == "__main__":
+    # modules such as server.py import this file as 'interpreter', let them
+    # use this instance instead of loading a second copy
+    sys.modules.setdefault('interpreter', sys.modules[__name__])
     main()
\ No newline at end of file
@@ -1,5 +1,17 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from interpreter import interpret
+import interpreter
+import nodes
+import server
+from interpreter import interpret, interpret_many, parse, linearize, substitute, substitute_iter
 
 class TestInterpreter(unittest.TestCase):
     def test_lazy_evaluation(self):
@@ -46,5 +58,708 @@ class TestInterpreter(unittest.TestCase):
                 result = interpret(input_expr)
                 self.assertEqual(result, expected)
 
+    # (input, expected output) pairs shared by all evaluation engines
+    engine_tests = [
+        ("(if 1 == 1 then \\x.x+1 else \\x.x+2) 5 + 10", "16.0"),
+        ("if 1 == 1 then 1 else 2 + 1", "1.0"),
+        ("1 ;; 2", "1.0 ;; 2.0"),
+        ("1 ;; 2 ;; 3", "1.0 ;; 2.0 ;; 3.0"),
+        ("1+1 ;; (\\x.x)a ;; (\\x.x+x)2", "2.0 ;; a ;; 4.0"),
+        ("1:2 ;; 1:2:#", "(1.0 : 2.0) ;; (1.0 : (2.0 : #))"),
+        ("(1)", "1.0"),
+        ("#", "#"),
+        ("1:2:3:#", "(1.0 : (2.0 : (3.0 : #)))"),
+        ("(\\x.x) #", "#"),
+        ("(\\x.\\y.x) 1:# a", "(1.0 : #)"),
+        ("(\\x.\\y.y) a 1:#", "(1.0 : #)"),
+        ("let f = \\x.x+1 in (f 1) : (f 2) : (f 3) : #", "(2.0 : (3.0 : (4.0 : #)))"),
+        ("1:2 == 1:2", "1.0"),
+        ("1:2 == 1:3", "0.0"),
+        ("1:2:# == 1:2:#", "1.0"),
+        ("(1-2) : (2+2) : # == (-1):4:#", "1.0"),
+        ("hd a", "(hd a)"),
+        ("hd (1:2:#)", "1.0"),
+        ("hd 1:2:#", "1.0"),
+        ("tl a", "(tl a)"),
+        ("tl (1:2:#)", "(2.0 : #)"),
+        ("tl 1:2:#", "(2.0 : #)"),
+        # ("letrec map = \\f. \\xs. if xs==# then # else (f (hd xs)) : (map f (tl xs)) in (map (\\x.x+1) (1:2:3:#))", "(2.0 : (3.0 : (4.0 : #)))")
+    ]
+
+    def test_environment_engine(self):
+        # The other engines must agree with the substitution engine
+        for engine in ['env', 'stack', 'nodes', 'lazy', 'compiled', 'vm']:
+            for input_expr, expected in self.engine_tests:
+                with self.subTest(engine=engine, input=input_expr):
+                    result = interpret(input_expr, engine=engine)
+                    self.assertEqual(result, expected)
+        # closures read back as lambdas don't capture the free names of their values
+        capture_tests = [
+            ("(\\x.\\y.x+y) y", "(\\Var1.(y + Var1))"),
+            ("(\\x.\\y.x) y", "(\\Var1.y)"),
+        ]
+        for engine in ['subst', 'env', 'stack', 'nodes', 'lazy', 'compiled', 'vm']:
+            for input_expr, expected in capture_tests:
+                with self.subTest(engine=engine, input=input_expr):
+                    interpreter.name_generator.counter = 0
+                    self.assertEqual(interpret(input_expr, engine=engine), expected)
+
+    def test_environment_engine_recursion(self):
+        tests = [
+            ("letrec map = \\f. \\xs. if xs==# then # else (f (hd xs)) : (map f (tl xs)) in (map (\\x.x+1) (1:2:3:#))", "(2.0 : (3.0 : (4.0 : #)))"),
+            ("letrec f = \\n. if n == 0 then 1 else n * f (n-1) in f 5", "120.0"),
+            ("(fix \\f.\\n. if n == 0 then 0 else n + f (n-1)) 4", "10.0"),
+            ("(\\x.\\y.x+y) 1", "(\\y.(1.0 + y))"),
+        ]
+        for engine in ['env', 'stack', 'lazy', 'compiled', 'vm']:
+            for input_expr, expected in tests:
+                with self.subTest(engine=engine, input=input_expr):
+                    result = interpret(input_expr, engine=engine)
+                    self.assertEqual(result, expected)
+
+    def test_stack_engine_deep_programs(self):
+        # Deeper than the Python recursion limit
+        n = 20000
+        result = interpret("letrec range = \\n. if n == 0 then # else n : range (n-1) in range %d" % n, engine='stack')
+        self.assertTrue(result.startswith("(20000.0 : (19999.0 : "))
+        self.assertTrue(result.endswith("(1.0 : #)" + ")" * (n - 1)))
+        source = ":".join(str(i) for i in range(n)) + ":#"
+        self.assertEqual(interpret(source + " == " + source, engine='stack'), "1.0")
+        result = interpret("letrec sum = \\n. \\acc. if n == 0 then acc else sum (n-1) (acc+n) in sum %d 0" % n, engine='stack')
+        self.assertEqual(result, "200010000.0")
+        # a closure over a long list is read back without recursing per cell
+        for engine in ['stack', 'lazy']:
+            with self.subTest(engine=engine):
+                result = interpret("let xs = %s in \\y. xs" % source, engine=engine)
+                self.assertTrue(result.startswith("(\\y.(0.0 : (1.0 : "))
+                self.assertTrue(result.endswith("(19999.0 : #)" + ")" * n))
+
+    def test_vm_engine(self):
+        import vm
+        # recursion runs on the VM's own call stack
+        n = 20000
+        result = interpret("letrec range = \\n. if n == 0 then # else n : range (n-1) in range %d" % n, engine='vm')
+        self.assertTrue(result.startswith("(20000.0 : (19999.0 : "))
+        result = interpret("letrec sum = \\n. \\acc. if n == 0 then acc else sum (n-1) (acc+n) in sum %d 0" % n, engine='vm')
+        self.assertEqual(result, "200010000.0")
+        self.assertEqual(interpret("\\x. if x then 1 else 2", engine='vm'), "(\\x.(if x then 1.0 else 2.0))")
+
+        listing = vm.disassemble(vm.compile_program(parse("let f = \\x. x + 1 in f 2")))
+        self.assertEqual(listing.splitlines(), [
+            "<program>:",
+            "     0 CLOSURE   0    \\x",
+            "     2 BIND      1    'f'",
+            "     4 LOAD      0",
+            "     6 CONST     2    2.0",
+            "     8 TAIL_CALL",
+            "    10 RETURN",
+            "x:",
+            "     0 LOAD      0",
+            "     2 CONST     0    1.0",
+            "     4 BINARY    0    plus",
+            "     6 RETURN",
+        ])
+
+    def test_tail_calls(self):
+        # far more iterations than the Python recursion limit
+        n = 50000
+        source = "letrec sum = \\n. \\acc. if n == 0 then acc else sum (n-1) (acc+n) in sum %d 0" % n
+        self.assertEqual(interpret(source, engine='env'), "1250025000.0")
+        source = ("letrec build = \\n. \\acc. if n == 0 then acc else build (n-1) (n:acc) in "
+                  "letrec count = \\xs. \\acc. if xs == # then acc else count (tl xs) (acc+1) in count (build %d #) 0")
+        self.assertEqual(interpret(source % 5000, engine='env'), "5000.0")
+        # subst doesn't unfold letrec, self-application loops instead
+        source = "(\\f. f f %d) (\\self.\\n. if n < 1 then 7 else self self (n-1))" % 5000
+        self.assertEqual(interpret(source), "7.0")
+
+    def test_lazy_engine(self):
+        tests = [
+            # the argument is never needed, so the loop never runs
+            ("(\\x.1) (letrec loop = \\n. loop n in loop 0)", "1.0"),
+            ("letrec ones = 1 : ones in hd (tl (tl ones))", "1.0"),
+            ("letrec nats = \\n. n : nats (n+1) in hd (tl (tl (nats 0)))", "2.0"),
+            ("letrec x = x + 1 in x", "(x + 1.0)"),
+        ]
+        for input_expr, expected in tests:
+            with self.subTest(input=input_expr):
+                self.assertEqual(interpret(input_expr, engine='lazy'), expected)
+
+    def test_example_programs(self):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        tests = [
+            ("factorial.lc", ['env', 'stack', 'lazy', 'compiled', 'vm'], "3628800.0"),
+            ("fibonacci.lc", ['lazy'], "832040.0"),
+        ]
+        for file_name, engines, expected in tests:
+            with open(os.path.join(directory, file_name)) as file:
+                source = file.read()
+            for engine in engines:
+                with self.subTest(file=file_name, engine=engine):
+                    self.assertEqual(interpret(source, engine=engine), expected)
+
+    def test_hash_consing(self):
+        interpreter.hash_cons_table = interpreter.HashConsTable()
+        try:
+            for engine in ['env', 'stack', 'compiled', 'vm']:
+                for input_expr, expected in self.engine_tests:
+                    with self.subTest(engine=engine, input=input_expr):
+                        self.assertEqual(interpret(input_expr, engine=engine), expected)
+            ast = parse("(1:2:#) : (0:1:2:#) : #")
+            value = interpreter.evaluate_stack(ast)
+            # the shared sublist 1:2:# is stored once
+            self.assertIs(value[1], value[2][1][2])
+            self.assertEqual(interpret("(a:#) == (a:#)", engine='stack'), "0.0")
+            # once the table is full it starts over, '==' still works
+            interpreter.hash_cons_table = interpreter.HashConsTable(max_size=3)
+            self.assertEqual(interpret("1:2:3:4:# == 1:2:3:4:#", engine='stack'), "1.0")
+            self.assertEqual(interpret("1:2:3:4:# == 1:2:3:5:#", engine='stack'), "0.0")
+            self.assertLessEqual(len(interpreter.hash_cons_table.cells), 3)
+        finally:
+            interpreter.hash_cons_table = None
+
+    def test_array_lists(self):
+        interpreter.array_lists = True
+        try:
+            for engine in ['env', 'stack', 'compiled', 'vm']:
+                for input_expr, expected in self.engine_tests:
+                    with self.subTest(engine=engine, input=input_expr):
+                        self.assertEqual(interpret(input_expr, engine=engine), expected)
+            value = interpreter.evaluate_env(parse("let xs = 1:2:# in (0:xs) : (5:xs) : xs : #"))
+            first, second, xs = interpreter.vec_items(value)
+            # 0:xs extends the buffer of xs, 5:xs copies it
+            self.assertIs(first[1], xs[1])
+            self.assertIsNot(second[1], xs[1])
+            self.assertEqual(interpreter.linearize(value),
+                             "((0.0 : (1.0 : (2.0 : #))) : ((5.0 : (1.0 : (2.0 : #))) : ((1.0 : (2.0 : #)) : #)))")
+            tests = [
+                ("1:2", "(1.0 : 2.0)"),
+                ("1:x:#", "(1.0 : (x : #))"),
+                ("(\\x.x):#", "((\\x.x) : #)"),
+                ("tl (tl (1:2:#)) ;; hd (tl (1:2:#))", "# ;; 2.0"),
+                ("(1:2:#) == (1:2:#) ;; (1:2:#) == (1:3:#) ;; (1:#) == (1:2:#) ;; (a:#) == (a:#)", "1.0 ;; 0.0 ;; 0.0 ;; 0.0"),
+                ("((1:#):#) == ((1:#):#) ;; (1:2:#) == (1:2)", "1.0 ;; 0.0"),
+                ("let xs = 1:2:# in \\y. (hd xs) + y", "(\\y.(1.0 + y))"),
+            ]
+            for engine in ['env', 'stack', 'compiled', 'vm']:
+                for input_expr, expected in tests:
+                    with self.subTest(engine=engine, input=input_expr):
+                        self.assertEqual(interpret(input_expr, engine=engine), expected)
+            n = 20000
+            source = ":".join(str(i) for i in range(n)) + ":#"
+            self.assertEqual(interpret(source + " == " + source, engine='stack'), "1.0")
+            result = interpret("letrec range = \\n. if n == 0 then # else n : range (n-1) in range %d" % n, engine='vm')
+            self.assertTrue(result.startswith("(20000.0 : (19999.0 : "))
+            self.assertTrue(result.endswith("(1.0 : #)" + ")" * (n - 1)))
+        finally:
+            interpreter.array_lists = False
+
+    def test_memoization(self):
+        interpreter.memo_table = interpreter.MemoTable()
+        try:
+            for engine in ['env', 'stack']:
+                for input_expr, expected in self.engine_tests:
+                    with self.subTest(engine=engine, input=input_expr):
+                        self.assertEqual(interpret(input_expr, engine=engine), expected)
+            fib = "letrec fib = \\n. if n < 2 then n else fib (n-1) + fib (n-2) in fib 60"
+            for engine in ['env', 'stack']:
+                interpreter.memo_table = interpreter.MemoTable()
+                with self.subTest(engine=engine):
+                    # without the table this would take about 10^12 calls
+                    self.assertEqual(interpret(fib, engine=engine), "1548008755920.0")
+                    self.assertEqual(interpreter.memo_table.misses, 61)
+                    self.assertGreater(interpreter.memo_table.hits, 0)
+            tests = [
+                ("letrec len = \\xs. if xs == # then 0 else 1 + len (tl xs) in len (1:2:3:#) + len (1:2:3:#)", "6.0"),
+                ("let y = 3 in (\\x. x + y) 1 ;; (\\x. x + z) 1", "4.0 ;; (1.0 + z)"),
+                ("let f = \\g. g 1 in f (\\x. x + 1) + f (\\x. x + 2)", "5.0"),
+            ]
+            for engine in ['env', 'stack']:
+                for input_expr, expected in tests:
+                    with self.subTest(engine=engine, input=input_expr):
+                        self.assertEqual(interpret(input_expr, engine=engine), expected)
+            # equal lists have the same key, whether they are cells or vecs
+            table = interpreter.MemoTable()
+            one_two = table.data_key(interpreter.evaluate_env(parse("1:2:#")))
+            self.assertEqual(table.data_key(('cons', 1.0, ('cons', 2.0, ('nil',)))), one_two)
+            self.assertEqual(table.data_key(interpreter.array_cons(1.0, interpreter.array_cons(2.0, ('nil',)))), one_two)
+            self.assertNotEqual(table.data_key(('cons', 2.0, ('cons', 1.0, ('nil',)))), one_two)
+            self.assertNotEqual(table.data_key(('cons', ('cons', 1.0, ('nil',)), ('cons', 2.0, ('nil',)))), one_two)
+            self.assertIsNone(table.data_key(('cons', 1.0, ('var', 'x'))))
+            # the numbering is cleared with the entries when it is full
+            table = interpreter.MemoTable(max_cells=100)
+            interpreter.memo_table = table
+            length = "letrec len = \\xs. if xs == # then 0 else 1 + len (tl xs) in len (%s#)"
+            self.assertEqual(interpret(length % ("1:" * 150), engine='env'), "150.0")
+            self.assertEqual(interpret(length % ("1:" * 50), engine='env'), "50.0")
+            self.assertLessEqual(len(table.list_numbers), 101)
+            interpreter.memo_table = interpreter.MemoTable(max_size=10)
+            interpret(fib, engine='env')
+            self.assertEqual(len(interpreter.memo_table.entries), 10)
+        finally:
+            interpreter.memo_table = None
+
+    def test_optimizer(self):
+        import optimizer
+        tests = [
+            ("1 + 2 * 3", 7.0),
+            ("-(2) + 1 == -1", 1.0),
+            ("if 1 < 2 then a else b", ('var', 'a')),
+            ("let x = 1 in let y = x + 2 in y * y", 9.0),
+            ("\\z. let x = 1 + 2 in if z then x else 0", ('lam', 'z', ('if', ('var', 'z'), 3.0, 0.0))),
+            ("letrec f = \\n. n in let unused = f in 3", 3.0),
+            # names bound more than once could be renamed by the engines, so their bindings are kept
+            ("let x = 4 in let y = x in let x = 5 in y", ('let', 'x', 4.0, ('let', 'y', ('var', 'x'), ('let', 'x', 5.0, ('var', 'y'))))),
+            ("let x = 4 in let y = x in let z = 5 in y", 4.0),
+            ("letrec f = \\x. 1 in let g = \\y. 2 in f (g 3)", ('rec', 'f', ('lam', 'x', 1.0), ('let', 'g', ('lam', 'y', 2.0), ('app', ('var', 'f'), ('app', ('var', 'g'), 3.0))))),
+            # lambdas are never inlined, nor values used under a lambda or more than once
+            ("let f = \\x.1 in f 2", ('let', 'f', ('lam', 'x', 1.0), ('app', ('var', 'f'), 2.0))),
+            ("\\z. let x = z + 1 in \\w. x", ('lam', 'z', ('let', 'x', ('plus', ('var', 'z'), 1.0), ('lam', 'w', ('var', 'x'))))),
+            ("\\z. let x = z + 1 in x * x", ('lam', 'z', ('let', 'x', ('plus', ('var', 'z'), 1.0), ('multiply', ('var', 'x'), ('var', 'x'))))),
+            ("\\y. let x = y + 1 in (\\y. x) 5", ('lam', 'y', ('let', 'x', ('plus', ('var', 'y'), 1.0), ('app', ('lam', 'y', ('var', 'x')), 5.0)))),
+            ("\\y. let x = y + 1 in x : #", ('lam', 'y', ('cons', ('plus', ('var', 'y'), 1.0), ('nil',)))),
+            # the branches of an if the engines don't reduce are left alone
+            ("\\x. if x then 1+2 else 0", ('lam', 'x', ('if', ('var', 'x'), ('plus', 1.0, 2.0), 0.0))),
+            ("if a then 1 else 2 * 3", ('if', ('var', 'a'), 1.0, ('multiply', 2.0, 3.0))),
+            ("if 1 then 2 * 3 else a", 6.0),
+            # under a lambda, nothing that changes the free variables is dropped
+            ("\\x. if 1 then 0 else z", ('lam', 'x', ('if', 1.0, 0.0, ('var', 'z')))),
+            ("\\x. let y = z in 3", ('lam', 'x', ('let', 'y', ('var', 'z'), 3.0))),
+            ("\\x. let y = x in let z = 2 in x", ('lam', 'x', ('var', 'x'))),
+        ]
+        for input_expr, expected in tests:
+            with self.subTest(input=input_expr):
+                self.assertEqual(optimizer.optimize(parse(input_expr)), expected)
+        tree, report = optimizer.optimize_report(parse("let x = 1 in let y = x + 2 in if y < 5 then y else 0"))
+        self.assertEqual(tree, 3.0)
+        self.assertEqual((report['before'], report['after']), (12, 1))
+        self.assertEqual((report['inlined'], report['folded'], report['branches']), (2, 2, 1))
+        self.assertEqual(optimizer.optimize(parse("+".join(["1"] * 20000))), 20000.0)
+        # the results are the same with and without the optimizer
+        residual = ["\\x. if x then 1+2 else 0", "if a then 1 else 2 * 3", "let z = x in \\x. if 1 then 0 else z",
+                    "let z = x in \\x. let y = z in 3", "(letrec y = x in (letrec x = (hd (\\z. (x 2))) in (-(hd (\\x. y)))))"]
+        try:
+            for engine in ['subst', 'env']:
+                for input_expr in [test[0] for test in self.engine_tests] + residual:
+                    with self.subTest(engine=engine, input=input_expr):
+                        interpreter.optimizing = False
+                        interpreter.name_generator.counter = 0
+                        unoptimized = interpret(input_expr, engine=engine)
+                        interpreter.optimizing = True
+                        interpreter.name_generator.counter = 0
+                        self.assertEqual(interpret(input_expr, engine=engine), unoptimized)
+        finally:
+            interpreter.optimizing = True
+        result, stats = interpret("let x = 2 in x * 3", stats=True)
+        self.assertEqual(result, "6.0")
+        self.assertEqual(stats.as_dict()['optimizer']['after'], 1)
+
+    def test_parallel_segments(self):
+        fact = "letrec f = \\n. if n == 0 then 1 else n * f (n-1) in f %d"
+        source = " ;; ".join([fact % 5, "1+1", fact % 6, "(\\x.x) a", "1:2:#", fact % 7])
+        self.assertEqual(len(interpreter.segments(parse(source))), 6)
+        self.assertLess(interpreter.segment_cost(parse("1+1")), interpreter.segment_threshold)
+        self.assertGreater(interpreter.segment_cost(parse(fact % 5)), interpreter.segment_threshold)
+        for engine in ['subst', 'env', 'vm']:
+            expected = interpret(source, engine=engine)
+            for threshold in [0, None, 10 ** 9]:
+                with self.subTest(engine=engine, threshold=threshold):
+                    result = interpreter.interpret_segments(parse(source), engine, workers=2, threshold=threshold)
+                    self.assertEqual(result, expected)
+        interpreter.parallel_segments = 2
+        try:
+            self.assertEqual(interpret(source, engine='env'), "120.0 ;; 2.0 ;; 720.0 ;; a ;; (1.0 : (2.0 : #)) ;; 5040.0")
+            # the first failing segment raises, like without the pool
+            with self.assertRaises(RecursionError):
+                interpret(fact % 3 + " ;; letrec g = \\n. 1 + g (n+1) in g 0 ;; " + fact % 4, engine='env')
+        finally:
+            interpreter.parallel_segments = None
+        directory = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run([sys.executable, 'interpreter.py', '--parallel', '--workers', '2', '--engine', 'env',
+                                 source], cwd=directory, capture_output=True, text=True, check=True)
+        self.assertIn("120.0 ;; 2.0 ;; 720.0 ;; a ;; (1.0 : (2.0 : #)) ;; 5040.0", output.stdout)
+
+    def test_inline_transformer(self):
+        # the parser builds the AST while parsing, there is no Tree to transform
+        two_pass = interpreter.make_parser(interpreter.get_grammar())
+        transformer = interpreter.LambdaCalculusTransformer()
+        sources = [input_expr for input_expr, _ in self.engine_tests] + [
+            "letrec f = \\n. if n <= 0 then 1 else n * f (n-1) in f 5 ;; -(3) ;; -x",
+            "let x = (\\y. y >= 2) 3 in fix (\\f. x) == 1 < 2 > 0",
+            ":".join(str(i) for i in range(20000)) + ":#",
+        ]
+        for source in sources:
+            with self.subTest(input=source[:40]):
+                ast = interpreter.get_parser().parse(source)
+                self.assertNotIsInstance(ast, interpreter.Tree)
+                self.assertEqual(linearize(ast), linearize(transformer.transform(two_pass.parse(source))))
+
+    def test_artifacts(self):
+        import artifact
+        sources = [input_expr for input_expr, _ in self.engine_tests] + [
+            "letrec f = \\n. if n <= 0 then 1 else n * f (n-1) in f 5 ;; -(3) ;; -x",
+            "let x = 1 < 2 in x ;; 2.5 ;; \\unicode_name. unicode_name",
+            ":".join(str(i) for i in range(20000)) + ":#",
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            source_path = os.path.join(directory, 'program.lc')
+            path = os.path.join(directory, 'program.lcc')
+            for source in sources:
+                with self.subTest(input=source[:40]):
+                    with open(source_path, 'w') as file:
+                        file.write(source)
+                    self.assertEqual(artifact.compile_file(source_path), path)
+                    ast = artifact.load_artifact(path)
+                    self.assertEqual(linearize(ast), linearize(interpreter.load(source)))
+                    self.assertEqual(interpret(None, ast=ast, engine='stack'), interpret(source, engine='stack'))
+            # a changed source is parsed again
+            with open(source_path, 'w') as file:
+                file.write("1 + 1")
+            artifact.compile_file(source_path)
+            with open(source_path, 'w') as file:
+                file.write("2 + 2")
+            self.assertEqual(artifact.load_artifact(path), 4.0)
+            # so are artifacts of another version and damaged ones
+            artifact.compile_file(source_path)
+            with open(path, 'r+b') as file:
+                file.seek(4)
+                file.write(bytes([99]))
+            self.assertEqual(artifact.load_artifact(path), 4.0)
+            with open(path, 'wb') as file:
+                file.write(b'LCC')
+            self.assertEqual(artifact.load_artifact(path), 4.0)
+            # without its source the artifact is used as it is
+            artifact.compile_file(source_path)
+            os.remove(source_path)
+            self.assertEqual(artifact.load_artifact(path), 4.0)
+            with open(path, 'wb') as file:
+                file.write(b'LCC')
+            with self.assertRaises(artifact.StaleArtifact):
+                artifact.load_artifact(path)
+
+            with open(source_path, 'w') as file:
+                file.write("letrec f = \\n. if n == 0 then 1 else n * f (n-1) in f 6")
+            interpreter_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interpreter.py')
+            output = subprocess.run([sys.executable, interpreter_path, '--compile', source_path],
+                                    capture_output=True, text=True, check=True)
+            self.assertIn(path, output.stdout)
+            output = subprocess.run([sys.executable, interpreter_path, '--engine', 'env', path],
+                                    capture_output=True, text=True, check=True)
+            self.assertIn("720.0", output.stdout)
+
+    def test_primitives(self):
+        import primitives
+        definitions = {
+            'length': "letrec length = \\xs. if xs == # then 0 else 1 + length (tl xs) in ",
+            'foldl': "letrec foldl = \\f.\\z.\\xs. if xs == # then z else foldl f (f z (hd xs)) (tl xs) in ",
+            'sum': "letrec total = \\acc.\\xs. if xs == # then acc else total (acc + (hd xs)) (tl xs) in let sum = total 0 in ",
+            'map': "letrec map = \\f.\\xs. if xs == # then # else (f (hd xs)) : (map f (tl xs)) in ",
+            'range': "letrec from = \\i.\\n. if i < n then i : from (i+1) n else # in let range = \\n. from 0 n in ",
+        }
+        tests = [
+            ("length (1:2:3:#)", "3.0"),
+            ("length #", "0.0"),
+            ("sum (1:2.5:3:#)", "6.5"),
+            ("range 5", "(0.0 : (1.0 : (2.0 : (3.0 : (4.0 : #)))))"),
+            ("range 2.5", "(0.0 : (1.0 : (2.0 : #)))"),
+            ("map (\\x. x * 2 + 1) (1:2:3:#)", "(3.0 : (5.0 : (7.0 : #)))"),
+            ("map (\\x. x : #) (1:2:#)", "((1.0 : #) : ((2.0 : #) : #))"),
+            ("let k = 3 in map (\\x. x * k) (range 3)", "(0.0 : (3.0 : (6.0 : #)))"),
+            ("map (\\f. f 2) ((\\x.x+1) : (\\x.x*3) : #)", "(3.0 : (6.0 : #))"),
+            ("foldl (\\a.\\b. b : a) # (1:2:3:#)", "(3.0 : (2.0 : (1.0 : #)))"),
+            ("foldl (\\a.\\b. a - b) 0 (range 4)", "-6.0"),
+            ("sum (map (\\x. -x) (range 10))", "-45.0"),
+            ("sum (map (\\x. x * 0.1) (range 100))", "495.0"),
+            ("map (\\x. x + y) (1:2:#)", "((1.0 + y) : ((2.0 + y) : #))"),
+        ]
+        for engine in ['subst', 'env', 'stack', 'compiled', 'vm', 'lazy', 'nodes']:
+            for input_expr, expected in tests:
+                with self.subTest(engine=engine, input=input_expr):
+                    self.assertEqual(interpret(input_expr, engine=engine), expected)
+                    # the same as the functions defined in the language (subst and nodes don't unfold letrec)
+                    if engine not in ('subst', 'nodes'):
+                        defined = "".join(definitions[name] for name in definitions if name + " " in input_expr)
+                        self.assertEqual(interpret(defined + input_expr, engine=engine), expected)
+        self.assertEqual(interpret("sum (range 4) ;; map (\\x. x + 1) (1:#)"), "6.0 ;; (2.0 : #)")
+        # not applicable: the application stays symbolic
+        self.assertEqual(interpret("length (1:2) ;; map (\\x. x) a ;; sum (a:#)", engine='env'),
+                         "(length (1.0 : 2.0)) ;; ((map (\\x.x)) a) ;; (sum (a : #))")
+        # a program's own bindings of the names come first
+        for engine in ['env', 'lazy', 'nodes']:
+            with self.subTest(engine=engine):
+                self.assertEqual(interpret("let sum = \\x. x in sum (1:#)", engine=engine), "(1.0 : #)")
+        # lazy arguments are evaluated when a built-in needs them
+        self.assertEqual(interpret("let xs = map (\\x. x * x) (range 4) in sum xs + length (tl xs)", engine='lazy'), "17.0")
+        # the same results with and without NumPy
+        saved = primitives.numpy
+        try:
+            for input_expr in ["sum (map (\\x. x * 0.1) (range 1000))", "sum (0.1:0.2:0.3:#)",
+                               "map (\\x. -x * 0.3) (0:1:2:#)", "sum (range 100000)"]:
+                with self.subTest(input=input_expr):
+                    primitives.numpy = None  # NumPy if it is installed
+                    expected = interpret(input_expr, engine='vm')
+                    primitives.numpy = False
+                    self.assertEqual(interpret(input_expr, engine='vm'), expected)
+        finally:
+            primitives.numpy = saved
+        interpreter.array_lists = True
+        try:
+            self.assertEqual(interpret("length (map (\\x. x + 1) (range 20000))", engine='vm'), "20000.0")
+        finally:
+            interpreter.array_lists = False
+
+    def test_ast_cache(self):
+        saved = interpreter.CACHE_DIR, interpreter.AST_CACHE_MAX_FILES
+        with tempfile.TemporaryDirectory() as directory:
+            interpreter.CACHE_DIR, interpreter.AST_CACHE_MAX_FILES = directory, 2
+            try:
+                self.assertEqual(interpret("1:2:#", use_cache=True), "(1.0 : (2.0 : #))")
+                cached = interpreter.parse_cached("1:2:#")
+                self.assertEqual(cached, ('cons', 1.0, ('cons', 2.0, ('nil',))))
+                for source in ["1", "2", "3"]:
+                    interpreter.parse_cached(source)
+                asts = [name for name in os.listdir(directory) if name.endswith('.ast')]
+                self.assertEqual(len(asts), 2)
+            finally:
+                interpreter.CACHE_DIR, interpreter.AST_CACHE_MAX_FILES = saved
+
+    def test_import_from_other_directory(self):
+        # importing builds nothing and prints nothing, the grammar is found next to the module
+        directory = os.path.dirname(os.path.abspath(__file__))
+        script = "import sys; sys.path.insert(0, %r); import interpreter; " \
+                 "assert interpreter.parser is None; print(interpreter.interpret('1+1'))" % directory
+        output = subprocess.run([sys.executable, '-c', script], cwd=tempfile.gettempdir(),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output, "2.0\n")
+
+    def test_interpret_many(self):
+        deep = "(\\f. f f 5000) (\\self.\\n. if n < 1 then 0 else 1 + self self (n-1))"
+        programs = ["1+1", "1 +", "(\\x.x+1) 2", deep, "1:2:#"]
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                results = list(interpret_many(programs, workers=workers, chunksize=2))
+                self.assertEqual([result.index for result in results], list(range(len(programs))))
+                self.assertEqual([result.result for result in results],
+                                 ["2.0", None, "3.0", None, "(1.0 : (2.0 : #))"])
+                self.assertTrue(results[1].error.startswith("UnexpectedToken"))
+                self.assertTrue(results[3].error.startswith("RecursionError"))
+                self.assertTrue(all(result.seconds >= 0 for result in results))
+        results = interpret_many(programs, workers=2, ordered=False, engine='stack')
+        self.assertEqual(sorted(result.index for result in results), list(range(len(programs))))
+
+    def test_server(self):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        with tempfile.TemporaryDirectory() as socket_directory:
+            socket_path = os.path.join(socket_directory, 'lc.sock')
+            process = subprocess.Popen([sys.executable, os.path.join(directory, 'interpreter.py'),
+                                        '--serve', socket_path, '--workers', '2', '--timeout', '1'])
+            try:
+                for _ in range(100):
+                    if os.path.exists(socket_path):
+                        break
+                    time.sleep(0.1)
+                response = server.request(socket_path, source="1+1")
+                self.assertEqual((response['result'], response['error']), ("2.0", None))
+                self.assertIn('seconds', response)
+                response = server.request(socket_path, path=os.path.join(directory, 'factorial.lc'), engine='env')
+                self.assertEqual(response['result'], "3628800.0")
+                response = server.request(socket_path, source="letrec f = \\n. f n in f 1", engine='stack')
+                self.assertTrue(response['error'].startswith("Timeout"))
+                # pipelined requests on one connection
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(socket_path)
+                    for index in range(20):
+                        client.sendall(json.dumps({'id': index, 'source': "%d*2" % index}).encode() + b'\n')
+                    client.sendall(b'not json\n')
+                    with client.makefile('rb') as responses:
+                        results = [json.loads(responses.readline()) for _ in range(21)]
+                results = {response['id']: response for response in results}
+                self.assertEqual([results[index]['result'] for index in range(20)],
+                                 ["%.1f" % (index * 2) for index in range(20)])
+                self.assertTrue(results[None]['error'].startswith("JSONDecodeError"))
+            finally:
+                process.terminate()
+                process.wait()
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_nodes_conversion(self):
+        for input_expr, expected in self.engine_tests:
+            with self.subTest(input=input_expr):
+                ast = parse(input_expr)
+                self.assertEqual(nodes.to_tuple(nodes.from_tuple(ast)), ast)
+                self.assertEqual(nodes.linearize(nodes.from_tuple(ast)), linearize(ast))
+                self.assertEqual(nodes.linearize(nodes.evaluate(nodes.from_tuple(ast))), expected)
+
+    def test_nodes_substitute(self):
+        # the same results, and fresh names, as the tuple substitute
+        for input_expr in ["(\\x. hd x)(1:2:#)", "(\\x. tl x)(1:2:#)", "(\\x.\\y.x+y) y", "(\\x.\\y.x) y",
+                           "\\y. (\\x. \\y. x y) y", "let y = 2 in (\\x. let y = 1 in x + y) y",
+                           "(\\x. letrec y = \\n. x in y) y"]:
+            with self.subTest(input=input_expr):
+                ast = parse(input_expr)
+                counter = interpreter.name_generator.counter
+                expected = linearize(interpreter.evaluate(ast))
+                interpreter.name_generator.counter = counter
+                self.assertEqual(nodes.linearize(nodes.evaluate(nodes.from_tuple(ast))), expected)
+        self.assertEqual(nodes.linearize(nodes.evaluate(nodes.from_tuple(parse("(\\x. hd x)(1:2:#)")))), "1.0")
+
+    def test_substitute(self):
+        # free variables of the replacement are not captured
+        self.assertEqual(interpret("(\\x.\\y.x) y"), "(\\Var%d.y)" % interpreter.name_generator.counter)
+        counter = interpreter.name_generator.counter
+        # no capture possible, so no fresh names
+        self.assertEqual(interpret("(\\f.\\x.\\y.f x y) (\\a.\\b.a)"), "(\\x.(\\y.x))")
+        self.assertEqual(interpreter.name_generator.counter, counter)
+        # subtrees without the name are not copied
+        tree = ('app', ('lam', 'y', ('plus', ('var', 'y'), 1.0)), ('var', 'x'))
+        result = substitute(tree, 'x', 2.0)
+        self.assertEqual(result, ('app', ('lam', 'y', ('plus', ('var', 'y'), 1.0)), 2.0))
+        self.assertIs(result[1], tree[1])
+        self.assertIs(substitute(tree, 'z', 2.0), tree)
+        self.assertEqual(substitute(('hd', ('var', 'x')), 'x', ('nil',)), ('hd', ('nil',)))
+        # a binder the replacement mentions is only renamed when name occurs under it
+        counter = interpreter.name_generator.counter
+        tree = ('lam', 'y', ('plus', ('var', 'y'), 1.0))
+        self.assertIs(substitute(tree, 'x', ('var', 'y')), tree)
+        self.assertEqual(interpreter.name_generator.counter, counter)
+        self.assertEqual(substitute(('let', 'y', 1.0, ('plus', ('var', 'x'), ('var', 'y'))), 'x', ('var', 'y')),
+                         ('let', 'Var%d' % (counter + 1), 1.0, ('plus', ('var', 'y'), ('var', 'Var%d' % (counter + 1)))))
+        # lambda and let bodies can be numbers
+        self.assertEqual(interpret("letrec f = \\x. 1 in let g = \\y. 2 in f (g 3)"), "((fix 1.0) (2.0 3.0))")
+
+    def test_substitute_iter(self):
+        tree = ('lam', 'y', ('app', ('plus', ('var', 'x'), 1.0), ('lam', 'x', ('var', 'x'))))
+        self.assertEqual(substitute_iter(tree, 'x', 2.0), substitute(tree, 'x', 2.0))
+        # binders the replacement mentions get the same fresh names as with substitute
+        tree = ('let', 'y', ('var', 'x'), ('rec', 'z', ('app', ('var', 'z'), ('var', 'x')), ('lam', 'y', ('var', 'x'))))
+        counter = interpreter.name_generator.counter
+        expected = substitute(tree, 'x', ('app', ('var', 'y'), ('var', 'z')))
+        interpreter.name_generator.counter = counter
+        self.assertEqual(substitute_iter(tree, 'x', ('app', ('var', 'y'), ('var', 'z'))), expected)
+        self.assertIs(substitute_iter(tree, 'w', ('var', 'y')), tree)
+        self.assertEqual(substitute_iter(('hd', ('var', 'x')), 'x', ('nil',)), ('hd', ('nil',)))
+
+    def test_stats(self):
+        evaluate_function = interpreter.evaluate
+        result, stats = interpret("let f = \\x. x + 1 in f (f 2)", stats=True)
+        self.assertEqual(result, "4.0")
+        self.assertEqual(list(stats.phases), ['parse', 'optimize', 'evaluate', 'linearize'])
+        self.assertEqual(stats.beta_reductions, 2)
+        self.assertEqual(stats.constructs['let'], 1)
+        self.assertEqual(stats.constructs['app'], 2)
+        self.assertGreater(stats.substitutions, 0)
+        self.assertGreater(stats.nodes_allocated, 0)
+        self.assertEqual(json.loads(json.dumps(stats.as_dict()))['beta_reductions'], 2)
+        # collecting stops after the run, also when it fails
+        self.assertIs(interpreter.evaluate, evaluate_function)
+        self.assertIsNone(interpreter.stats)
+        with self.assertRaises(Exception):
+            interpret("1 +", stats=True)
+        self.assertIs(interpreter.evaluate, evaluate_function)
+        self.assertEqual(interpret("(\\x.x+1) 2"), "3.0")
+
+        result, stats = interpret("letrec f = \\n. if n == 0 then 1 else n * f (n-1) in f 5", engine='env', stats=True)
+        self.assertEqual(result, "120.0")
+        self.assertEqual(stats.beta_reductions, 6)
+        self.assertGreaterEqual(stats.max_depth, 6)
+
+        directory = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run([sys.executable, 'interpreter.py', '--stats-json', '(\\x.x+1) 2'], cwd=directory,
+                                capture_output=True, text=True, check=True)
+        self.assertIn("3.0", output.stdout)
+        self.assertEqual(json.loads(output.stderr)['beta_reductions'], 1)
+
+    def test_budgets(self):
+        loop = "letrec loop = \\n. loop (n+1) in loop 0"
+        for engine in ['env', 'stack']:
+            for limits, resource in [({'max_steps': 1000}, 'steps'), ({'max_nodes': 1000}, 'nodes'),
+                                     ({'max_seconds': 0.1}, 'seconds')]:
+                with self.subTest(engine=engine, limits=limits):
+                    with self.assertRaises(interpreter.BudgetExceeded) as caught:
+                        interpret(loop, engine=engine, **limits)
+                    self.assertEqual(caught.exception.resource, resource)
+                    self.assertGreater(caught.exception.stats.steps, 0)
+                    self.assertEqual(caught.exception.as_dict()['budget'], resource)
+        deep = "letrec f = \\n. if n == 0 then 0 else 1 + f (n-1) in f 100000"
+        for engine in ['env', 'stack']:
+            with self.subTest(engine=engine):
+                with self.assertRaises(interpreter.BudgetExceeded) as caught:
+                    interpret(deep, engine=engine, max_depth=100)
+                self.assertEqual(caught.exception.resource, 'depth')
+                self.assertEqual(caught.exception.stats.max_depth, 101)
+        # the Python recursion limit counts as the depth limit, when there is one
+        with self.assertRaises(interpreter.BudgetExceeded) as caught:
+            interpret(deep, engine='env', max_depth=10 ** 9)
+        self.assertEqual(caught.exception.resource, 'depth')
+        with self.assertRaises(RecursionError):
+            interpret(deep, engine='env', max_steps=10 ** 9)
+        with self.assertRaises(interpreter.BudgetExceeded):
+            interpret("(\\f. f f 0) (\\self.\\n. if n < 0 then 0 else self self (n+1))", max_steps=5000)
+        self.assertEqual(interpret("letrec f = \\n. if n == 0 then 1 else n * f (n-1) in f 5", engine='env',
+                                   max_steps=1000, max_depth=100, max_nodes=1000, max_seconds=10), "120.0")
+        self.assertIsNone(interpreter.stats)
+        # the other engines count steps and check the time, or reject the limits they can't enforce
+        omega = "(\\x. x x) (\\x. x x)"
+        # 2 ** 10 applications, without nesting deeper than the recursion limit
+        doubling = "let f0 = \\x. x + 1 in " + "".join(f"let f{i} = \\x. f{i-1} (f{i-1} x) in " for i in range(1, 11)) + "f10 0"
+        for engine, program in [('vm', loop), ('lazy', loop), ('compiled', omega), ('nodes', omega)]:
+            for limits, resource in [({'max_steps': 100}, 'steps'), ({'max_seconds': 1e-6}, 'seconds')]:
+                with self.subTest(engine=engine, limits=limits):
+                    with self.assertRaises(interpreter.BudgetExceeded) as caught:
+                        interpret(doubling if resource == 'seconds' else program, engine=engine, **limits)
+                    self.assertEqual(caught.exception.resource, resource)
+        with self.assertRaises(interpreter.BudgetExceeded) as caught:
+            interpret(deep, engine='vm', max_depth=100)
+        self.assertEqual(caught.exception.resource, 'depth')
+        for engine, limits in [('compiled', {'max_depth': 100}), ('nodes', {'max_nodes': 1000}),
+                               ('vm', {'max_nodes': 1000})]:
+            with self.subTest(engine=engine, limits=limits):
+                with self.assertRaises(ValueError):
+                    interpret("1+1", engine=engine, **limits)
+        self.assertEqual(interpret("1+1", engine='vm', max_steps=1000, max_seconds=10), "2.0")
+        self.assertIsNone(interpreter.stats)
+        self.assertIsNone(nodes.stats)
+        # the optimizer, first imported during a limited run, doesn't keep that run's wrappers
+        sys.modules.pop('optimizer', None)
+        self.assertEqual(interpret("let a = 1 in a + 1", engine='env', max_nodes=3), "2.0")
+        for _ in range(3):
+            self.assertEqual(interpret("let x = 1:2:# in let y = 3 in x : y : x : #"),
+                             "((1.0 : (2.0 : #)) : (3.0 : ((1.0 : (2.0 : #)) : #)))")
+        results = list(interpret_many([loop, "1+1"], workers=1, engine='env', limits={'max_steps': 1000}))
+        self.assertTrue(results[0].error.startswith("BudgetExceeded: steps"))
+        self.assertEqual(results[1].result, "2.0")
+
+    def test_benchmark_baseline(self):
+        import benchmark
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(benchmark.run_suite(['factorial', 'parse'], 0.05, path, save=True, repeat=1), [])
+                with open(path) as file:
+                    baseline = json.load(file)
+                self.assertEqual(sorted(baseline), ['factorial', 'parse'])
+                self.assertGreater(baseline['parse']['peak_bytes'], 0)
+                baseline['factorial']['seconds'] /= 100
+                with open(path, 'w') as file:
+                    json.dump(baseline, file)
+                regressions = benchmark.run_suite(['factorial', 'parse'], 0.05, path, repeat=1)
+            self.assertIn('factorial seconds', regressions)
+            self.assertNotIn('parse peak_bytes', regressions)
+
+    def test_streaming_linearize(self):
+        for input_expr, expected in self.engine_tests:
+            with self.subTest(input=input_expr):
+                stream = io.StringIO()
+                interpreter.interpret_stream(input_expr, stream)
+                self.assertEqual(stream.getvalue(), expected)
+        # a long list comes out in several chunks
+        n = 20000
+        ast = parse(":".join(str(i) for i in range(n)) + ":#")
+        chunks = list(interpreter.linearize_chunks(ast))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), linearize(ast))
+        stream = io.StringIO()
+        interpreter.write_linear(ast, stream)
+        self.assertEqual(stream.getvalue(), linearize(ast))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
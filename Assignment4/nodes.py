@@ -0,0 +1,395 @@
+# compact AST: slotted node classes with small-integer opcodes
+# instead of tagged tuples such as ('plus', l, r).
+# evaluate, substitute and linearize dispatch through tables indexed by the
+# opcode instead of comparing the tag string against every case in turn.
+# the semantics are the same as the tuple functions in interpreter.py.
+
+# opcodes
+VAR, LAM, APP, LET, REC, FIX, FIX_LAM, IF, NIL, CONS, HD, TL, SEQ, \
+    PLUS, MINUS, MULTIPLY, NEGATION, EQ, LT, GT, LE, GE = range(22)
+
+TAGS = ['var', 'lam', 'app', 'let', 'rec', 'fix', 'fix-lam', 'if', 'nil', 'cons', 'hd', 'tl', 'seq',
+        'plus', 'minus', 'multiply', 'negation', 'eq', 'lt', 'gt', 'le', 'ge']
+OPCODES = {tag: op for op, tag in enumerate(TAGS)}
+
+# one slotted class per opcode. a, b, c hold the fields in the same order as
+# the tuple form, eg ('let', name, value, body) becomes Let(name, value, body).
+# the opcode is a class attribute, so an instance only stores its fields and
+# is 16 bytes smaller than the tuple with the same fields.
+class Node:
+    __slots__ = ()
+    op = None
+
+    def fields(self):
+        return ()
+
+    def __repr__(self):
+        return f"{TAGS[self.op]}{self.fields()!r}"
+
+class Node1(Node):
+    __slots__ = ('a',)
+
+    def __init__(self, a):
+        self.a = a
+
+    def fields(self):
+        return (self.a,)
+
+class Node2(Node1):
+    __slots__ = ('b',)
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def fields(self):
+        return (self.a, self.b)
+
+class Node3(Node2):
+    __slots__ = ('c',)
+
+    def __init__(self, a, b, c):
+        self.a = a
+        self.b = b
+        self.c = c
+
+    def fields(self):
+        return (self.a, self.b, self.c)
+
+# numbers of fields used by each opcode
+ARITY = [1, 2, 2, 3, 3, 1, 2, 3, 0, 2, 1, 1, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2]
+
+CLASSES = [type(tag.title().replace('-', ''), ([Node, Node1, Node2, Node3][arity],), {'__slots__': (), 'op': op})
+           for op, (tag, arity) in enumerate(zip(TAGS, ARITY))]
+Var, Lam, App, Let, Rec, Fix, FixLam, If, Nil, Cons, Hd, Tl, Seq, \
+    Plus, Minus, Multiply, Negation, Eq, Lt, Gt, Le, Ge = CLASSES
+
+NIL_NODE = Nil()
+
+# conversion from and to the tuple form produced by LambdaCalculusTransformer
+def from_tuple(tree):
+    if not isinstance(tree, tuple):
+        return tree
+    if tree[0] == 'number':
+        return tree[1]
+    if tree[0] == 'app' and len(tree) == 2:
+        return from_tuple(tree[1])
+    op = OPCODES[tree[0]]
+    if op == NIL:
+        return NIL_NODE
+    return CLASSES[op](*[from_tuple(field) for field in tree[1:]])
+
+def to_tuple(node):
+    if not isinstance(node, Node):
+        return node
+    return (TAGS[node.op], *[to_tuple(field) for field in node.fields()])
+
+def is_number(value):
+    return isinstance(value, (float, int))
+
+# the Stats of interpreter.py while it is collecting, else None
+stats = None
+
+def evaluate(node):
+    if stats is not None:
+        stats.tick()
+    if isinstance(node, Node):
+        return EVALUATE[node.op](node)
+    return node
+
+def eval_var(node):
+    return node
+
+def eval_lam(node):
+    # If the lambda body is a constant value, return it directly
+    body = evaluate(node.b)
+    if is_number(body):
+        return body
+    return Lam(node.a, body)
+
+def eval_app(node):
+    left = evaluate(node.a)
+    right = evaluate(node.b)
+    if left is NIL_NODE:
+        return left
+    if isinstance(left, Node) and left.op == LAM:
+        return evaluate(substitute(left.b, left.a, right))
+    result = apply_primitive(left, right)
+    if result is not None:
+        return result
+    return App(left, right)
+
+# the built-in list functions of primitives.py, applied through the tuple
+# form when function is one of them applied to all but its last argument
+def apply_primitive(function, argument):
+    head = function
+    for _ in range(2):
+        if isinstance(head, Node) and head.op == APP:
+            head = head.a
+    if not (isinstance(head, Node) and head.op == VAR):
+        return None
+    import interpreter
+    if head.a not in interpreter.PRIMITIVE_NAMES:
+        return None
+    result = interpreter.apply_primitive(to_tuple(function), to_tuple(argument), enter_tuple, interpreter.cons_cell)
+    return None if result is None else from_tuple(result)
+
+def enter_tuple(function, value):
+    return to_tuple(evaluate(substitute(from_tuple(function[2]), function[1], from_tuple(value))))
+
+def eval_let(node):
+    value = evaluate(node.b)
+    return evaluate(substitute(node.c, node.a, value))
+
+def eval_rec(node):
+    rec_value = evaluate(Fix(Lam(node.a, node.b)))
+    return evaluate(substitute(node.c, node.a, rec_value))
+
+def eval_fix(node):
+    arg = evaluate(node.a)
+    if isinstance(arg, Node) and arg.op == LAM:
+        return FixLam(arg.a, arg.b)
+    return Fix(arg)
+
+def eval_if(node):
+    condition = evaluate(node.a)
+    if isinstance(condition, Node):
+        return If(condition, node.b, node.c)
+    if condition:
+        return evaluate(node.b)
+    return evaluate(node.c)
+
+def eval_nil(node):
+    return NIL_NODE
+
+def eval_cons(node):
+    return Cons(evaluate(node.a), evaluate(node.b))
+
+def eval_seq(node):
+    return Seq(evaluate(node.a), evaluate(node.b))
+
+def eval_hd(node):
+    lst = evaluate(node.a)
+    if isinstance(lst, Node):
+        if lst.op == CONS:
+            return lst.a
+        elif lst.op == NIL:
+            return NIL_NODE
+    return Hd(lst)
+
+def eval_tl(node):
+    lst = evaluate(node.a)
+    if isinstance(lst, Node):
+        if lst.op == CONS:
+            return lst.b
+        elif lst.op == NIL:
+            return NIL_NODE
+    return Tl(lst)
+
+def eval_negation(node):
+    value = evaluate(node.a)
+    if is_number(value):
+        return -value
+    return Negation(value)
+
+def eval_eq(node):
+    return values_equal(evaluate(node.a), evaluate(node.b))
+
+def values_equal(left, right):
+    while True:
+        if is_number(left) and is_number(right):
+            return float(left == right)
+        if not isinstance(left, Node) or not isinstance(right, Node):
+            return 0.0
+        if left.op == NIL and right.op == NIL:
+            return 1.0
+        if left.op != CONS or right.op != CONS:
+            return 0.0
+        if values_equal(left.a, right.a) == 0.0:
+            return 0.0
+        left, right = left.b, right.b
+
+def binary(op, function):
+    def eval_binary(node):
+        left = evaluate(node.a)
+        right = evaluate(node.b)
+        if is_number(left) and is_number(right):
+            return function(left, right)
+        return CLASSES[op](left, right)
+    return eval_binary
+
+EVALUATE = [eval_var, eval_lam, eval_app, eval_let, eval_rec, eval_fix, eval_var, eval_if,
+            eval_nil, eval_cons, eval_hd, eval_tl, eval_seq,
+            binary(PLUS, lambda l, r: l + r),
+            binary(MINUS, lambda l, r: l - r),
+            binary(MULTIPLY, lambda l, r: l * r),
+            eval_negation,
+            eval_eq,
+            binary(LT, lambda l, r: l < r),
+            binary(GT, lambda l, r: l > r),
+            binary(LE, lambda l, r: l <= r),
+            binary(GE, lambda l, r: l >= r)]
+
+# capture-avoiding substitution, as interpreter.substitute: nodes in which
+# name doesn't occur free are returned as they are, and a binder is only
+# renamed when name occurs under it and the replacement mentions it.
+# captured holds the free variables of the replacement once they are needed
+def substitute(node, name, replacement, captured=None):
+    if isinstance(node, Node):
+        return SUBSTITUTE[node.op](node, name, replacement, [] if captured is None else captured)
+    return node
+
+def subst_var(node, name, replacement, captured):
+    if node.a == name:
+        return replacement
+    return node
+
+# lam and fix-lam
+def subst_lam(node, name, replacement, captured):
+    if node.a == name:
+        return node
+    body = substitute(node.b, name, replacement, captured)
+    if body is node.b:
+        return node
+    if is_captured(node.a, replacement, captured):
+        binder, scope = rename(node.a, [node.b])
+        return CLASSES[node.op](binder, substitute(scope[0], name, replacement, captured))
+    return CLASSES[node.op](node.a, body)
+
+def subst_let(node, name, replacement, captured):
+    value = substitute(node.b, name, replacement, captured)
+    binder, body = node.a, node.c
+    if binder != name:
+        body = substitute(node.c, name, replacement, captured)
+        if body is not node.c and is_captured(binder, replacement, captured):
+            binder, scope = rename(binder, [node.c])
+            body = substitute(scope[0], name, replacement, captured)
+    if value is node.b and body is node.c:
+        return node
+    return Let(binder, value, body)
+
+def subst_rec(node, name, replacement, captured):
+    if node.a == name:
+        return node
+    value = substitute(node.b, name, replacement, captured)
+    body = substitute(node.c, name, replacement, captured)
+    if value is node.b and body is node.c:
+        return node
+    if is_captured(node.a, replacement, captured):
+        binder, scope = rename(node.a, [node.b, node.c])
+        return Rec(binder, substitute(scope[0], name, replacement, captured),
+                   substitute(scope[1], name, replacement, captured))
+    return Rec(node.a, value, body)
+
+def subst_unary(node, name, replacement, captured):
+    a = substitute(node.a, name, replacement, captured)
+    if a is node.a:
+        return node
+    return CLASSES[node.op](a)
+
+def subst_binary(node, name, replacement, captured):
+    a = substitute(node.a, name, replacement, captured)
+    b = substitute(node.b, name, replacement, captured)
+    if a is node.a and b is node.b:
+        return node
+    return CLASSES[node.op](a, b)
+
+def subst_if(node, name, replacement, captured):
+    a = substitute(node.a, name, replacement, captured)
+    b = substitute(node.b, name, replacement, captured)
+    c = substitute(node.c, name, replacement, captured)
+    if a is node.a and b is node.b and c is node.c:
+        return node
+    return If(a, b, c)
+
+def subst_none(node, name, replacement, captured):
+    return node
+
+SUBSTITUTE = [subst_var, subst_lam, subst_binary, subst_let, subst_rec, subst_unary, subst_lam,
+              subst_if, subst_none, subst_binary, subst_unary, subst_unary, subst_binary,
+              subst_binary, subst_binary, subst_binary, subst_unary,
+              subst_binary, subst_binary, subst_binary, subst_binary, subst_binary]
+
+# true if binder occurs free in replacement. captured keeps the free
+# variables of replacement for the next binder
+def is_captured(binder, replacement, captured):
+    if not isinstance(replacement, Node) or replacement.op == NIL:
+        return False
+    if not captured:
+        captured.append(free_vars(replacement))
+    return binder in captured[0]
+
+# binder renamed to a fresh name in the nodes it scopes over. the names come
+# from the generator of interpreter.py, so both ASTs get the same names
+def rename(binder, scope):
+    import interpreter
+    fresh_name = interpreter.name_generator.generate()
+    return fresh_name, [substitute(node, binder, Var(fresh_name)) for node in scope]
+
+# names that occur free in node (a frozenset)
+def free_vars(node):
+    names = set()
+    stack = [(node, ())]
+    while stack:
+        node, bound = stack.pop()
+        if not isinstance(node, Node):
+            continue
+        if node.op == VAR:
+            if node.a not in bound:
+                names.add(node.a)
+        elif node.op in (LAM, FIX_LAM):
+            stack.append((node.b, (*bound, node.a)))
+        elif node.op == LET:
+            stack.extend([(node.b, bound), (node.c, (*bound, node.a))])
+        elif node.op == REC:
+            stack.extend([(node.b, (*bound, node.a)), (node.c, (*bound, node.a))])
+        else:
+            stack.extend((field, bound) for field in node.fields())
+    return frozenset(names)
+
+# output templates for linearize, indexed by opcode: strings are copied and
+# 'a', 'b', 'c' name the fields to linearize in their place
+LINEAR_FORMS = [None, None, ('(', 'a', ' ', 'b', ')'), None, None, ('(fix ', 'a', ')'), None,
+                ('(if ', 'a', ' then ', 'b', ' else ', 'c', ')'), ('#',),
+                ('(', 'a', ' : ', 'b', ')'), None, None, ('a', ' ;; ', 'b'),
+                ('(', 'a', ' + ', 'b', ')'), ('(', 'a', ' - ', 'b', ')'), ('(', 'a', ' * ', 'b', ')'),
+                ('(-', 'a', ')'),
+                ('(', 'a', ' == ', 'b', ')'), ('(', 'a', ' < ', 'b', ')'), ('(', 'a', ' > ', 'b', ')'),
+                ('(', 'a', ' <= ', 'b', ')'), ('(', 'a', ' >= ', 'b', ')')]
+FIELDS = ('a', 'b', 'c')
+
+# iterative like interpreter.linearize: the stack holds nodes and pieces of text
+def linearize(node):
+    out = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is str:
+            out.append(node)
+        elif not isinstance(node, Node):
+            out.append(f"{node:.1f}" if is_number(node) else str(node))
+        elif LINEAR_FORMS[node.op] is not None:
+            for part in reversed(LINEAR_FORMS[node.op]):
+                stack.append(getattr(node, part) if part in FIELDS else part)
+        elif node.op == VAR:
+            out.append(node.a)
+        elif node.op == LAM:
+            stack.extend([')', node.b, f"(\\{node.a}."])
+        elif node.op in (LET, REC):
+            keyword = 'let' if node.op == LET else 'letrec'
+            stack.extend([')', node.c, ' in ', node.b, f"({keyword} {node.a} = "])
+        elif node.op in (HD, TL):
+            keyword = TAGS[node.op]
+            if isinstance(node.a, Node) and node.a.op == VAR:
+                out.append(f"({keyword} {node.a.a})")
+            elif isinstance(node.a, Node) and node.a.op == CONS:
+                stack.append(evaluate(node))
+            else:
+                stack.extend([')', node.a, f"({keyword} "])
+        else:
+            out.append(str(to_tuple(node)))
+    return ''.join(out)
+
+# engine entry point for interpret(): tuple AST in, tuple AST out
+def evaluate_tuple(tree):
+    return to_tuple(evaluate(from_tuple(tree)))
@@ -0,0 +1,190 @@
+# AST to AST simplification, run between LambdaCalculusTransformer and the
+# engines. the rewrites give the same results as evaluating the original,
+# because they only reduce what the engines reduce too: the branches of an
+# 'if' are left alone unless its condition is a number. under lambdas they
+# also keep the free variables of every subterm, and they rename nothing, so
+# reading closures back renames (and numbers fresh names) the same way
+#   - arithmetic, comparisons and '==' on two numbers are computed
+#   - an 'if' whose condition is a number keeps only the branch it takes,
+#     which is then simplified
+#   - 'let x = v in b' where v is a number, # or a variable becomes b[x:=v]
+#   - 'let x = e in b' where x occurs once in b, in a position that is always
+#     evaluated, and e is arithmetic, a comparison or a list, becomes b[x:=e].
+#     other expressions may evaluate to lambdas, which the subst engine
+#     treats differently when they are applied before being evaluated
+#   - let and letrec bindings of a number, #, a variable or a lambda whose
+#     name doesn't occur in the body are dropped (under a lambda, only when
+#     the body has the free variables of the value)
+# iterative like linearize, so deep terms don't hit the recursion limit.
+import collections
+
+import interpreter
+from interpreter import BINARY_OPS, free_vars
+
+INLINED_TAGS = {'plus', 'minus', 'multiply', 'negation', 'eq', 'lt', 'gt', 'le', 'ge', 'cons'}
+
+# the fields the engines evaluate only once the rest is a value: the
+# branches of an if. they are kept as they are until the if is pruned
+LAZY_FIELDS = {'if': (2, 3)}
+
+def is_number(tree):
+    return isinstance(tree, (float, int))
+
+# true for the values whose evaluation does nothing the result could show
+def is_inert(tree):
+    return is_number(tree) or tree[0] in ('nil', 'var', 'lam', 'fix-lam')
+
+# optimized tree and a Counter of what was done: 'folded', 'branches',
+# 'inlined', 'dropped', and the number of nodes 'before' and 'after'
+def optimize_report(tree):
+    report = collections.Counter()
+    report['before'] = count_nodes(tree)
+    cache = {}  # free_vars of the nodes seen in this run
+    # a binder the engines could rename, to avoid capturing a free variable
+    # or another binding of its name, is never removed: renaming takes a name
+    counts = collections.Counter(binders(tree))
+    droppable = {name for name, count in counts.items() if count == 1} - free_vars(tree)
+    results = []
+    # built is None for subtrees that are kept as they are. in_lambda is
+    # true under a lambda, whose body may be read back from a closure
+    stack = [(tree, False, False)]
+    while stack:
+        node, built, in_lambda = stack.pop()
+        if built is None:
+            results.append(node)
+        elif built:
+            fields = [results.pop() if isinstance(field, (tuple, float, int)) else field
+                      for field in reversed(node[1:])]
+            node = (node[0], *reversed(fields))
+            new, again = rewrite(node, report, cache, in_lambda, droppable)
+            if again:
+                stack.append((new, False, in_lambda))
+            else:
+                results.append(new)
+        elif isinstance(node, tuple) and node[0] not in ('var', 'nil'):
+            stack.append((node, True, in_lambda))
+            in_body = in_lambda or node[0] in ('lam', 'fix-lam')
+            stack.extend((field, None if index in LAZY_FIELDS.get(node[0], ()) else False, in_body)
+                         for index, field in reversed(list(enumerate(node))[1:])
+                         if isinstance(field, (tuple, float, int)))
+        else:
+            results.append(node)
+    tree = results[0]
+    report['after'] = count_nodes(tree)
+    return tree, report
+
+def optimize(tree):
+    return optimize_report(tree)[0]
+
+# simplify a node whose children are already simplified. returns the new
+# node and whether it must be simplified again (after inlining)
+def rewrite(node, report, cache=None, in_lambda=False, droppable=None):
+    cache = {} if cache is None else cache
+    tag = node[0]
+
+    # true if binders of these names may be removed
+    def removable(names):
+        return droppable is None or droppable.issuperset(names)
+    if tag in BINARY_OPS and is_number(node[1]) and is_number(node[2]):
+        report['folded'] += 1
+        return BINARY_OPS[tag](node[1], node[2]), False
+    if tag == 'eq' and is_number(node[1]) and is_number(node[2]):
+        report['folded'] += 1
+        return float(node[1] == node[2]), False
+    if tag == 'negation' and is_number(node[1]):
+        report['folded'] += 1
+        return -node[1], False
+    if tag == 'app' and len(node) == 2:
+        return node[1], False
+    if tag == 'if' and is_number(node[1]):
+        taken, dropped = (node[2], node[3]) if node[1] else (node[3], node[2])
+        if removable(binders(dropped)) and (not in_lambda or free_vars(dropped, cache) <= free_vars(taken, cache)):
+            report['branches'] += 1
+            return taken, True
+    if (tag in ('let', 'rec') and node[1] not in free_vars(node[3], cache) and is_inert(node[2])
+            and removable(binders(node[2]) + [node[1]])
+            and (not in_lambda or
+                 free_vars(node[2], cache) - ({node[1]} if tag == 'rec' else set()) <= free_vars(node[3], cache))):
+        report['dropped'] += 1
+        return node[3], False
+    if tag == 'let' and node[1] in free_vars(node[3], cache) and removable([node[1]]):
+        name, value, body = node[1], node[2], node[3]
+        small = is_number(value) or (isinstance(value, tuple) and value[0] in ('nil', 'var'))
+        if ((small or (isinstance(value, tuple) and value[0] in INLINED_TAGS and used_once_strictly(body, name, cache)))
+                and not binds_any(body, free_vars(value, cache))):
+            report['inlined'] += 1
+            # looked up on each call: collecting() swaps in a counting wrapper for a run
+            return interpreter.substitute(body, name, value), True
+    return node, False
+
+# the names bound in tree, with repeats
+def binders(tree):
+    names = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            if node[0] in ('lam', 'fix-lam', 'let', 'rec'):
+                names.append(node[1])
+            stack.extend(field for field in node[1:] if isinstance(field, tuple))
+    return names
+
+# true if tree has a binder for one of names: substituting a term with
+# those free variables would rename it, taking names the engines would use
+def binds_any(tree, names):
+    if not names:
+        return False
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            if node[0] in ('lam', 'fix-lam', 'let', 'rec') and node[1] in names:
+                return True
+            stack.extend(field for field in node[1:] if isinstance(field, tuple))
+    return False
+
+# the positions of a node that are evaluated whenever the node is: not the
+# bodies of lambdas, not the branches of an if, not the value of a letrec
+def strict_children(tree):
+    tag = tree[0]
+    if tag in ('lam', 'fix-lam', 'var', 'nil'):
+        return []
+    if tag == 'if':
+        return [(tree[1], None)]
+    if tag == 'let':
+        return [(tree[2], None), (tree[3], tree[1])]
+    if tag == 'rec':
+        return [(tree[3], tree[1])]
+    return [(child, None) for child in tree[1:] if isinstance(child, tuple)]
+
+# true if name occurs free in tree exactly once, in a strict position
+def used_once_strictly(tree, name, cache=None):
+    cache = {} if cache is None else cache
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, tuple) or name not in free_vars(node, cache):
+            continue
+        if node[0] == 'var':
+            count += 1
+            if count > 1:
+                return False
+            continue
+        strict = strict_children(node)
+        strict_count = sum(1 for child, bound in strict if bound != name and name in free_vars(child, cache))
+        lazy = [child for child in node[1:] if isinstance(child, tuple) and name in free_vars(child, cache)]
+        if len(lazy) > strict_count:
+            return False  # occurs where it isn't always evaluated (or is rebound)
+        stack.extend(child for child, bound in strict if bound != name)
+    return count == 1
+
+def count_nodes(tree):
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, tuple):
+            stack.extend(field for field in node[1:] if isinstance(field, (tuple, float, int)))
+    return count
@@ -0,0 +1,190 @@
+# built-in list functions. the results are those of the definitions
+#   length xs    = if xs == # then 0 else 1 + length (tl xs)
+#   sum xs       = foldl (\a.\b. a + b) 0 xs
+#   range n      = 0 : 1 : ... : #, the numbers i = 0, 1, ... with i < n
+#   map f xs     = if xs == # then # else f (hd xs) : map f (tl xs)
+#   foldl f z xs = if xs == # then z else foldl f (f z (hd xs)) (tl xs)
+# but computed in one loop over the list instead of one application (and,
+# with subst, one copy of the function) per element.
+# they take fully evaluated lists (cons cells or vecs ending in #), sum and
+# range take numbers. given anything else, the application stays symbolic.
+# numeric lists take a vectorized path: sum and range with NumPy if it is
+# installed, and map with NumPy when the function is arithmetic on its
+# argument. without NumPy they are plain loops over the numbers.
+import functools
+import math
+import operator
+
+from interpreter import vec_items
+
+ARITY = {'length': 1, 'sum': 1, 'range': 1, 'map': 2, 'foldl': 3}
+
+numpy = None
+
+# NumPy, or None if it isn't installed. imported on first use
+def get_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy or None
+
+# the elements of lst, head first, or None if lst isn't a complete list
+def list_items(lst):
+    items = []
+    while isinstance(lst, tuple):
+        if lst[0] == 'cons':
+            items.append(lst[1])
+            lst = lst[2]
+        elif lst[0] == 'vec':
+            items.extend(vec_items(lst))
+            return items
+        elif lst[0] == 'nil':
+            return items
+        else:
+            return None
+    return None
+
+def build_list(items, cons):
+    lst = ('nil',)
+    for item in reversed(items):
+        lst = cons(item, lst)
+    return lst
+
+def is_number(value):
+    return isinstance(value, (float, int))
+
+# function applied to value. enter(function, value) applies a function of
+# the engine: a 'lam' for subst, a 'closure' for the others
+def call(function, value, enter, cons):
+    if isinstance(function, tuple):
+        if function[0] in ('lam', 'closure'):
+            return enter(function, value)
+        if function[0] == 'nil':
+            return function
+    result = apply(function, value, enter, cons)
+    return ('app', function, value) if result is None else result
+
+# the result of applying function to argument if function is a built-in
+# applied to all but its last argument (function is then a spine of 'app's
+# ending in the 'var' of its name), else None
+def apply(function, argument, enter, cons):
+    arguments = [argument]
+    while isinstance(function, tuple) and function[0] == 'app' and len(arguments) < 3:
+        arguments.append(function[2])
+        function = function[1]
+    if not (isinstance(function, tuple) and function[0] == 'var') or ARITY.get(function[1]) != len(arguments):
+        return None
+    arguments.reverse()
+    return PRIMITIVES[function[1]](*arguments, enter=enter, cons=cons)
+
+def primitive_length(lst, enter, cons):
+    if isinstance(lst, tuple) and lst[0] == 'vec':
+        return float(lst[2])
+    items = list_items(lst)
+    return None if items is None else float(len(items))
+
+def primitive_sum(lst, enter, cons):
+    items = list_items(lst)
+    if items is None or not all(map(is_number, items)):
+        return None
+    np = get_numpy()
+    if np is not None:
+        values = np.array(items, dtype=float)
+        # exact, and so in any order, for integers whose sums fit in a double
+        with np.errstate(all='ignore'):
+            exact = np.all(values == np.floor(values)) and np.abs(values).sum() < 2 ** 53
+        if exact:
+            return 0.0 + float(values.sum())
+    # in order, (0 + x1) + x2 + ..., like the definition
+    return functools.reduce(operator.add, items, 0.0)
+
+def primitive_range(n, enter, cons):
+    if not is_number(n):
+        return None
+    count = max(0, math.ceil(n))
+    np = get_numpy()
+    if np is not None:
+        return build_list(np.arange(count, dtype=float).tolist(), cons)
+    return build_list([float(i) for i in range(count)], cons)
+
+def primitive_map(function, lst, enter, cons):
+    items = list_items(lst)
+    if items is None:
+        return None
+    np = get_numpy()
+    if np is not None and items and all(map(is_number, items)):
+        result = map_vectorized(np, function, items)
+        if result is not None:
+            return build_list(result, cons)
+    return build_list([call(function, item, enter, cons) for item in items], cons)
+
+def primitive_foldl(function, initial, lst, enter, cons):
+    items = list_items(lst)
+    if items is None:
+        return None
+    result = initial
+    for item in items:
+        result = call(call(function, result, enter, cons), item, enter, cons)
+    return result
+
+PRIMITIVES = {'length': primitive_length, 'sum': primitive_sum, 'range': primitive_range,
+              'map': primitive_map, 'foldl': primitive_foldl}
+
+VECTOR_OPS = {'plus': operator.add, 'minus': operator.sub, 'multiply': operator.mul}
+VECTOR_MAX_SIZE = 64  # larger function bodies are applied element by element
+
+# the results of function on the numbers items, computed on a NumPy array,
+# or None if function isn't a lambda made of + - * and negation of its
+# argument and numbers (or, for a closure, names bound to numbers)
+def map_vectorized(np, function, items):
+    if not (isinstance(function, tuple) and function[0] in ('lam', 'closure')):
+        return None
+    name, body = function[1], function[2]
+    env = function[3] if function[0] == 'closure' else None
+    values = {}
+    size = 0
+    stack = [body]
+    while stack:
+        tree = stack.pop()
+        size += 1
+        if size > VECTOR_MAX_SIZE:
+            return None
+        if is_number(tree):
+            continue
+        if tree[0] == 'var':
+            if tree[1] != name:
+                value = lookup_number(env, tree[1])
+                if value is None:
+                    return None
+                values[tree[1]] = value
+        elif tree[0] in VECTOR_OPS or tree[0] == 'negation':
+            stack.extend(tree[1:])
+        else:
+            return None
+    values[name] = np.array(items, dtype=float)
+    with np.errstate(all='ignore'):  # overflow gives inf, like Python floats
+        result = vector_evaluate(body, values)
+    if is_number(result):  # the body doesn't use the argument
+        return [result] * len(items)
+    return result.tolist()
+
+def lookup_number(env, name):
+    while env is not None:
+        if env[0] == name:
+            return env[1] if is_number(env[1]) else None
+        env = env[2]
+    return None
+
+# body, checked by map_vectorized, with the names bound to values
+def vector_evaluate(body, values):
+    if is_number(body):
+        return body
+    if body[0] == 'var':
+        return values[body[1]]
+    if body[0] == 'negation':
+        return -vector_evaluate(body[1], values)
+    return VECTOR_OPS[body[0]](vector_evaluate(body[1], values), vector_evaluate(body[2], values))
@@ -0,0 +1,137 @@
+# long-lived evaluation server on a Unix socket.
+# a pool of worker processes is started once and keeps a ready parser, so a
+# request only pays for evaluation. requests and responses are JSON objects,
+# one per line:
+#   {"id": 1, "source": "1+1"}           or {"id": 2, "path": "factorial.lc"}
+#   {"id": 1, "result": "2.0", "error": null, "seconds": 0.0001, "total": 0.002}
+# "engine" optionally selects the evaluation engine. seconds is the time spent
+# evaluating in the worker, total the time from receiving the request to
+# sending the response. requests on one connection may be pipelined, responses
+# are sent as they complete and carry the request's id.
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import interpreter
+
+class Server:
+    def __init__(self, socket_path, workers=None, timeout=10.0, max_pending=64):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.timeout = timeout
+        # backpressure: at most max_pending requests are being evaluated or
+        # waiting for a worker, further lines are not read until one finishes
+        self.pending = asyncio.Semaphore(max_pending)
+        self.pool = None
+
+    async def run(self):
+        # the workers are started, and build their parser, right away
+        self.pool = multiprocessing.Pool(self.workers, initializer=interpreter.init_worker)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # also stops workers still busy with programs that timed out
+            self.pool.terminate()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    async def handle_connection(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                await self.pending.acquire()
+                line = await reader.readline()
+                if not line:
+                    self.pending.release()
+                    break
+                task = asyncio.create_task(self.respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def respond(self, line, writer):
+        start = time.perf_counter()
+        try:
+            response = await self.handle_request(line)
+        finally:
+            self.pending.release()
+        response['total'] = time.perf_counter() - start
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    async def handle_request(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            engine = request.get('engine', 'subst')
+            if engine not in interpreter.ENGINES:
+                raise ValueError(f"unknown engine {engine!r}")
+            if 'path' in request:
+                with open(request['path']) as file:
+                    source_code = file.read()
+            else:
+                source_code = request['source']
+        except (ValueError, KeyError, AttributeError, OSError) as e:
+            return {'id': request_id, 'result': None, 'error': f"{type(e).__name__}: {e}", 'seconds': 0.0}
+
+        # the time limit stops a program soon after the server stops waiting
+        # for it, so that it doesn't keep its worker busy (subst, env and stack
+        # engines). it is a little longer, so the response is still a timeout
+        job = self.submit((request_id, source_code, engine, {'max_seconds': self.timeout + 0.1}))
+        try:
+            result = await asyncio.wait_for(job, self.timeout)
+        except asyncio.TimeoutError:
+            # other engines can't be interrupted, their worker finishes the program in the background
+            return {'id': request_id, 'result': None, 'error': f"Timeout: no result after {self.timeout} s",
+                    'seconds': self.timeout}
+        return {'id': request_id, 'result': result.result, 'error': result.error, 'seconds': result.seconds}
+
+    # run interpret_one on a worker, as a future of the event loop
+    def submit(self, job):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(result):
+            if not future.done():  # not cancelled by a timeout
+                future.set_result(result)
+
+        def set_exception(exception):
+            if not future.done():
+                future.set_exception(exception)
+
+        self.pool.apply_async(interpreter.interpret_one, (job,),
+                              callback=lambda result: loop.call_soon_threadsafe(set_result, result),
+                              error_callback=lambda exception: loop.call_soon_threadsafe(set_exception, exception))
+        return future
+
+def serve(socket_path, workers=None, timeout=10.0, max_pending=64):
+    server = Server(socket_path, workers, timeout, max_pending)
+    try:
+        asyncio.run(server.run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+# thin client: send one request and wait for its response
+def request(socket_path, source=None, path=None, engine='subst'):
+    message = {'id': 0, 'engine': engine}
+    if path is not None:
+        message['path'] = os.path.abspath(path)
+    else:
+        message['source'] = source
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(message).encode() + b'\n')
+        with client.makefile('rb') as response:
+            return json.loads(response.readline())
@@ -0,0 +1,265 @@
+# bytecode compiler and stack virtual machine.
+# a program compiles to a CodeObject: a flat array of (opcode, argument)
+# pairs plus a constant pool. every lambda body is a CodeObject of its own,
+# kept in the constant pool of the code around it.
+# the machine keeps operands on one list and calls on another, so neither the
+# depth of the program nor its recursion uses Python frames. calls in tail
+# position replace the current call instead of adding one.
+# values and environments are the ones of interpreter.evaluate_env, so the
+# results are read back and linearized the same way. a lambda evaluates to
+# ('closure', name, body, env, code) where code is its CodeObject.
+from array import array
+
+import interpreter
+from interpreter import BINARY_OPS, apply_primitive, make_cons, quote, readback, values_equal, vec_head, vec_tail
+
+OPNAMES = ['CONST', 'LOAD', 'CLOSURE', 'CALL', 'TAIL_CALL', 'RETURN', 'BIND', 'UNBIND',
+           'REC_BIND', 'REC_SET', 'FIX', 'TEST', 'JUMP', 'NEG', 'HD', 'TL',
+           'CONS', 'SEQ', 'EQ', 'BINARY']
+CONST, LOAD, CLOSURE, CALL, TAIL_CALL, RETURN, BIND, UNBIND, \
+    REC_BIND, REC_SET, FIX, TEST, JUMP, NEG, HD, TL, \
+    CONS, SEQ, EQ, BINARY = range(len(OPNAMES))
+
+BINARY_TAGS = ['plus', 'minus', 'multiply', 'lt', 'gt', 'le', 'ge']
+
+# CONST k       push constants[k]
+# LOAD d        push the value d frames up the environment chain
+# CLOSURE k     push a closure of the function constants[k] = (name, body, code)
+# CALL          pop argument and function and call it, or push the residual application
+# TAIL_CALL     the same, replacing the current call
+# RETURN        return the top of the stack to the caller
+# BIND k        pop a value and bind the name constants[k] to it
+# UNBIND        drop the innermost binding
+# REC_BIND k    bind the name constants[k] to itself (for letrec)
+# REC_SET       pop a value and store it in the innermost binding
+# FIX           pop a function and call it with its name bound to the result
+# TEST k        pop a condition, constants[k] = [then, else, else address, end address]:
+#               go on if it is true, jump to the else address if it is false,
+#               push the residual if expression and jump to the end otherwise
+# JUMP a        continue at address a
+# NEG, HD, TL   pop a value and push the result
+# CONS, SEQ, EQ pop two values and push the result
+# BINARY k      pop two values and push BINARY_TAGS[k] of them
+class CodeObject:
+    def __init__(self, name):
+        self.name = name
+        self.code = array('i')
+        self.constants = []
+
+    def emit(self, op, argument=0):
+        self.code.extend((op, argument))
+        return len(self.code) - 2
+
+    def constant(self, value):
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+# compile tree (in tail position if tail) into code.
+# scope holds the names bound around tree, innermost first
+def compile_into(code, tree, scope, tail):
+    if not isinstance(tree, tuple):
+        code.emit(CONST, code.constant(tree))
+        return
+    tag = tree[0]
+    if tag == 'number':
+        code.emit(CONST, code.constant(tree[1]))
+    elif tag == 'nil':
+        code.emit(CONST, code.constant(('nil',)))
+    elif tag == 'var':
+        if tree[1] in scope:
+            code.emit(LOAD, scope.index(tree[1]))
+        else:
+            code.emit(CONST, code.constant(tree))  # free variables stay symbolic
+    elif tag == 'lam':
+        code.emit(CLOSURE, code.constant((tree[1], tree[2], compile_function(tree[1], tree[2], scope))))
+    elif tag == 'app' and len(tree) == 2:
+        compile_into(code, tree[1], scope, tail)
+    elif tag == 'app':
+        compile_into(code, tree[1], scope, False)
+        compile_into(code, tree[2], scope, False)
+        code.emit(TAIL_CALL if tail else CALL)
+    elif tag == 'let':
+        compile_into(code, tree[2], scope, False)
+        code.emit(BIND, code.constant(tree[1]))
+        compile_into(code, tree[3], (tree[1],) + scope, tail)
+        if not tail:
+            code.emit(UNBIND)
+    elif tag == 'rec':
+        code.emit(REC_BIND, code.constant(tree[1]))
+        compile_into(code, tree[2], (tree[1],) + scope, False)
+        code.emit(REC_SET)
+        compile_into(code, tree[3], (tree[1],) + scope, tail)
+        if not tail:
+            code.emit(UNBIND)
+    elif tag == 'fix':
+        compile_into(code, tree[1], scope, False)
+        code.emit(FIX)
+    elif tag == 'if':
+        compile_into(code, tree[1], scope, False)
+        branches = [tree[2], tree[3], 0, 0]
+        code.emit(TEST, code.constant(branches))
+        compile_into(code, tree[2], scope, tail)
+        jump = code.emit(JUMP)
+        branches[2] = len(code.code)
+        compile_into(code, tree[3], scope, tail)
+        branches[3] = code.code[jump + 1] = len(code.code)
+    elif tag in ['negation', 'hd', 'tl']:
+        compile_into(code, tree[1], scope, False)
+        code.emit({'negation': NEG, 'hd': HD, 'tl': TL}[tag])
+    elif tag in ['cons', 'seq', 'eq'] or tag in BINARY_TAGS:
+        compile_into(code, tree[1], scope, False)
+        compile_into(code, tree[2], scope, False)
+        if tag in BINARY_TAGS:
+            code.emit(BINARY, BINARY_TAGS.index(tag))
+        else:
+            code.emit({'cons': CONS, 'seq': SEQ, 'eq': EQ}[tag])
+    else:
+        code.emit(CONST, code.constant(tree))
+
+def compile_function(name, body, scope):
+    code = CodeObject(name)
+    compile_into(code, body, (name,) + scope, True)
+    code.emit(RETURN)
+    return code
+
+def compile_program(tree):
+    code = CodeObject('<program>')
+    compile_into(code, tree, (), True)
+    code.emit(RETURN)
+    return code
+
+# run program in env, the environment its code was compiled for
+def run(program, env=None):
+    stats = interpreter.stats  # counts the calls while limits or statistics are on
+    stack = []
+    # saved (code, constants, pc, env, fix frame) of the callers
+    calls = []
+    code, constants, pc = program.code, program.constants, 0
+    while True:
+        op = code[pc]
+        argument = code[pc + 1]
+        pc += 2
+        if op == LOAD:
+            frame = env
+            for _ in range(argument):
+                frame = frame[2]
+            stack.append(frame[1])
+        elif op == CONST:
+            stack.append(constants[argument])
+        elif op == BINARY:
+            right = stack.pop()
+            left = stack.pop()
+            if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+                stack.append(BINARY_OPS[BINARY_TAGS[argument]](left, right))
+            else:
+                stack.append((BINARY_TAGS[argument], left, right))
+        elif op == CALL or op == TAIL_CALL:
+            value = stack.pop()
+            function = stack.pop()
+            if stats is not None:
+                stats.tick()
+                stats.reached(len(calls))
+            if isinstance(function, tuple) and function[0] == 'closure':
+                if op == CALL:
+                    calls.append((code, constants, pc, env, None))
+                function_code = function[4]
+                code, constants, pc = function_code.code, function_code.constants, 0
+                env = [function[1], value, function[3], False]
+            elif isinstance(function, tuple) and function[0] == 'nil':
+                stack.append(function)
+            else:
+                result = apply_primitive(function, value, enter_closure)
+                stack.append(('app', function, value) if result is None else result)
+        elif op == TEST:
+            condition = stack.pop()
+            then_tree, else_tree, else_address, end_address = constants[argument]
+            if isinstance(condition, tuple):
+                stack.append(('if', condition, quote(then_tree, env), quote(else_tree, env)))
+                pc = end_address
+            elif not condition:
+                pc = else_address
+        elif op == JUMP:
+            pc = argument
+        elif op == RETURN:
+            if not calls:
+                return stack.pop()
+            code, constants, pc, env, fix_frame = calls.pop()
+            if fix_frame is not None:
+                fix_frame[1] = stack[-1]
+        elif op == CLOSURE:
+            name, body, function_code = constants[argument]
+            stack.append(('closure', name, body, env, function_code))
+        elif op == BIND:
+            env = [constants[argument], stack.pop(), env, False]
+        elif op == UNBIND:
+            env = env[2]
+        elif op == REC_BIND:
+            name = constants[argument]
+            env = [name, ('var', name), env, True]
+        elif op == REC_SET:
+            env[1] = stack.pop()
+        elif op == FIX:
+            function = stack.pop()
+            if isinstance(function, tuple) and function[0] == 'closure':
+                fix_frame = [function[1], ('var', function[1]), function[3], True]
+                calls.append((code, constants, pc, env, fix_frame))
+                function_code = function[4]
+                code, constants, pc, env = function_code.code, function_code.constants, 0, fix_frame
+            else:
+                stack.append(('fix', function))
+        elif op == CONS:
+            tail = stack.pop()
+            stack.append(make_cons(stack.pop(), tail))
+        elif op == EQ:
+            right = stack.pop()
+            stack.append(values_equal(stack.pop(), right))
+        elif op == SEQ:
+            second = stack.pop()
+            stack.append(('seq', stack.pop(), second))
+        elif op == NEG:
+            value = stack.pop()
+            stack.append(-value if isinstance(value, (float, int)) else ('negation', value))
+        elif op == HD or op == TL:
+            lst = stack.pop()
+            if isinstance(lst, tuple) and lst[0] == 'cons':
+                stack.append(lst[1] if op == HD else lst[2])
+            elif isinstance(lst, tuple) and lst[0] == 'vec':
+                stack.append(vec_head(lst) if op == HD else vec_tail(lst))
+            elif isinstance(lst, tuple) and lst[0] == 'nil':
+                stack.append(lst)
+            else:
+                stack.append(('hd' if op == HD else 'tl', lst))
+
+# a closure applied to value, on a machine of its own (for primitives.py)
+def enter_closure(function, value):
+    return run(function[4], [function[1], value, function[3], False])
+
+# readable listing of code and of the functions in its constant pool
+def disassemble(code):
+    lines = []
+    functions = [code]
+    while functions:
+        code = functions.pop(0)
+        lines.append(f"{code.name}:")
+        for pc in range(0, len(code.code), 2):
+            op, argument = code.code[pc], code.code[pc + 1]
+            comment = ''
+            if op in (CONST, BIND, REC_BIND):
+                comment = repr(code.constants[argument])
+            elif op == CLOSURE:
+                name, _, function_code = code.constants[argument]
+                comment = f"\\{name}"
+                functions.append(function_code)
+            elif op == TEST:
+                comment = f"else {code.constants[argument][2]}, end {code.constants[argument][3]}"
+            elif op == BINARY:
+                comment = BINARY_TAGS[argument]
+            if op in (CONST, LOAD, CLOSURE, BIND, REC_BIND, TEST, JUMP, BINARY):
+                lines.append(f"  {pc:4d} {OPNAMES[op]:<10}{argument:<5}{comment}".rstrip())
+            else:
+                lines.append(f"  {pc:4d} {OPNAMES[op]}")
+    return '\n'.join(lines)
+
+# engine entry point for interpret()
+def evaluate_vm(tree):
+    return readback(run(compile_program(tree)))